@@ -0,0 +1,182 @@
+import os
+import io
+import json
+import hashlib
+import lzma
+import gzip
+
+import numpy
+
+DEFAULT_CACHE_DIR = '.collect_cache'
+
+# the collectors read logs that were compressed to save disk space, e.g.
+# stdout.xz, by decompressing them while parsing; the uncompressed file is
+# preferred when both exist
+LOG_SUFFIXES = ['', '.xz', '.gz', '.zst']
+
+def find_log(filepath):
+    for suffix in LOG_SUFFIXES:
+        if os.path.exists(filepath + suffix):
+            return filepath + suffix
+    raise FileNotFoundError(f"No such log file: '{filepath}' (also tried {', '.join(LOG_SUFFIXES[1:])})")
+
+def strip_log_suffix(filepath):
+    # returns the path of the uncompressed log, which find_log resolves again
+    for suffix in LOG_SUFFIXES[1:]:
+        if filepath.endswith(suffix):
+            return filepath[:-len(suffix)]
+    return filepath
+
+def open_log(filepath, mode='r'):
+    # mode is either 'r' (text) or 'rb' (binary), like open()
+    filepath = find_log(filepath)
+    # the decompressors default to binary mode
+    stream_mode = mode if 'b' in mode else 'rt'
+    if filepath.endswith('.xz'):
+        return lzma.open(filepath, stream_mode)
+    elif filepath.endswith('.gz'):
+        return gzip.open(filepath, stream_mode)
+    elif filepath.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {filepath} requires the zstandard module: pip install zstandard")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True)
+        return stream if 'b' in mode else io.TextIOWrapper(stream)
+    else:
+        return open(filepath, mode)
+
+def get_source_digest(*filepaths):
+    # parsed results depend on the parser code, so cached results must be
+    # invalidated whenever the collector changes
+    h = hashlib.sha1()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as inf:
+            h.update(inf.read())
+    return h.hexdigest()
+
+def get_fingerprint(filepaths, source_digest, options={}):
+    # identifies the experiment output by the size and mtime of its files, which
+    # is much cheaper than hashing multi-GB logs, along with the collector
+    # options that change the parsed result
+    files = []
+    for filepath in sorted(find_log(filepath) for filepath in filepaths):
+        st = os.stat(filepath)
+        files.append([os.path.basename(filepath), st.st_size, st.st_mtime_ns])
+    return {'source': source_digest, 'options': options, 'files': files}
+
+def get_cache_path(cache_dir, path):
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, f'{key}.json')
+
+def load_cached(cache_dir, path, fingerprint):
+    try:
+        with open(get_cache_path(cache_dir, path), 'r') as inf:
+            entry = json.load(inf)
+    except (OSError, ValueError):
+        return None
+    if entry.get('fingerprint') != fingerprint:
+        return None
+    return entry['record']
+
+def store_cached(cache_dir, path, fingerprint, record):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = get_cache_path(cache_dir, path)
+    # write then rename, so concurrent collectors never see a partial entry
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as outf:
+        json.dump({'path': os.path.abspath(path), 'fingerprint': fingerprint, 'record': record}, outf, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+def get_manifest_path(outname):
+    return f'{outname}.manifest'
+
+def load_manifest(outname):
+    # maps each experiment name in a json lines output to its fingerprint
+    try:
+        with open(get_manifest_path(outname), 'r') as inf:
+            return json.load(inf)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(outname, manifest):
+    with open(get_manifest_path(outname), 'w') as outf:
+        json.dump(manifest, outf, sort_keys=True, indent=2)
+
+def write_results(outname, records, jsonl=False, append=False):
+    # streams the records to the output file, so that we never need to hold
+    # all of them in memory at once
+    count = 0
+    if jsonl:
+        with open(outname, 'a' if append else 'w') as outf:
+            for record in records:
+                outf.write(json.dumps(record, sort_keys=True))
+                outf.write('\n')
+                count += 1
+    else:
+        with open(outname, 'w') as outf:
+            # same output as json.dump(list(records), outf, sort_keys=True, indent=2)
+            outf.write('[')
+            for record in records:
+                outf.write(',\n  ' if count > 0 else '\n  ')
+                outf.write(json.dumps(record, sort_keys=True, indent=2).replace('\n', '\n  '))
+                count += 1
+            outf.write('\n]' if count > 0 else ']')
+    return count
+
+def load_results(path):
+    # reads a results file written either as a json list or as json lines
+    with open(path, 'r') as inf:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in inf if line.strip()]
+        else:
+            return json.load(inf)
+
+def iter_results(path):
+    # yields the records of a results file; json lines are read one at a time
+    if path.endswith('.jsonl'):
+        with open(path, 'r') as inf:
+            for line in inf:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from load_results(path)
+
+# name of the array in a series sidecar that lists its delta-encoded columns
+SERIES_DELTA_KEY = '~delta'
+
+def save_series(filepath, columns, dtypes, delta_columns=()):
+    # writes the columns to a compressed npz sidecar, converted to the given
+    # dtypes; monotonic columns like timestamps are stored as the differences
+    # between consecutive values, which are small and compress well
+    arrays = {}
+    for name, values in columns.items():
+        values = numpy.asarray(values)
+        if name in delta_columns:
+            values = numpy.diff(values, prepend=values.dtype.type(0))
+        arrays[name] = values.astype(dtypes[name])
+    arrays[SERIES_DELTA_KEY] = numpy.array(sorted(delta_columns), dtype=str)
+
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    tmp_path = f'{filepath}.{os.getpid()}.tmp.npz'
+    numpy.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, filepath)
+
+def load_series(filepath):
+    # returns the decoded columns of a sidecar written by save_series, with the
+    # delta-encoded columns summed up at full precision
+    series = {}
+    with numpy.load(filepath) as npz:
+        delta_columns = set(npz[SERIES_DELTA_KEY].tolist())
+        for name in npz.files:
+            if name == SERIES_DELTA_KEY:
+                continue
+            values = npz[name]
+            if name in delta_columns:
+                values = numpy.cumsum(values, dtype=numpy.float64 if values.dtype.kind == 'f' else numpy.int64)
+            series[name] = values
+    return series
+
+def load_result_series(results_path, record):
+    # the series path in a result is relative to the directory of the results file
+    return load_series(os.path.join(os.path.dirname(results_path), record['~results']['series']))
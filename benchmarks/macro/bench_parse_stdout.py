@@ -0,0 +1,177 @@
+import sys
+import os
+import argparse
+import random
+import re
+import tempfile
+import time
+
+from collect import parse_shadow_stdout, parse_counter_phantom, parse_counter_classic, timestamp_to_seconds, get_stats
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-l', "--log",
+        help="Path to an existing shadow stdout file to parse; if not given, a log is generated",
+        default=None
+    )
+    parser.add_argument('-s', "--size_gib",
+        help="Approximate size of the generated log, in GiB",
+        type=float,
+        default=2.0
+    )
+    parser.add_argument('-n', "--num_hosts",
+        help="Number of hosts that log a heartbeat in each simulated second of the generated log",
+        type=int,
+        default=64000
+    )
+    parser.add_argument("--skip_linewise",
+        help="Only run the chunked parser",
+        action='store_true'
+    )
+    args = parser.parse_args()
+    run(args)
+
+def run(args):
+    if args.log != None:
+        bench(args.log, args.skip_linewise)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'stdout')
+        print(f"Generating a {args.size_gib} GiB log with {args.num_hosts} hosts at {path}")
+        generate_log(path, int(args.size_gib * 2**30), args.num_hosts)
+        bench(path, args.skip_linewise)
+
+def bench(path, skip_linewise):
+    num_lines = count_lines(path)
+    size_gib = os.path.getsize(path) / 2**30
+    print(f"Parsing {path}: {num_lines} lines, {size_gib:.2f} GiB")
+
+    # run the new parser first so the old one does not benefit from a warm page cache
+    start = time.perf_counter()
+    result_chunked = parse_shadow_stdout(path)
+    elapsed_chunked = time.perf_counter() - start
+    print(f"chunked: {elapsed_chunked:.2f} seconds, {num_lines/elapsed_chunked:.0f} lines/sec")
+
+    if skip_linewise:
+        return
+
+    start = time.perf_counter()
+    result_linewise = parse_shadow_stdout_linewise(path)
+    elapsed_linewise = time.perf_counter() - start
+    print(f"linewise: {elapsed_linewise:.2f} seconds, {num_lines/elapsed_linewise:.0f} lines/sec")
+
+    print(f"speedup: {elapsed_linewise/elapsed_chunked:.1f}x")
+    # the linewise parser does not return the heartbeat time series
+    assert result_chunked[:5] == result_linewise, "the parsers disagree"
+
+def count_lines(path):
+    count = 0
+    with open(path, 'rb') as inf:
+        while True:
+            chunk = inf.read(2**24)
+            if not chunk:
+                break
+            count += chunk.count(b'\n')
+    return count
+
+def generate_log(path, size, num_hosts):
+    rng = random.Random(1)
+    counters = [','.join(str(rng.randint(0, 10**6)) for _ in range(12)) for _ in range(1024)]
+
+    with open(path, 'w') as outf:
+        outf.write("00:00:00.000100 [1:shadow] 00:00:00.000000000 [info] [n/a] [main.c:1] [main] Starting Shadow\n")
+        for i in range(num_hosts):
+            outf.write(f"00:00:01.000000 [2:worker-0] 00:00:00.000000000 [info] [peer{i}:11.0.0.1] [process.c:1] [process_start] process 'peer{i}.phold.1000' started\n")
+
+        simsec, realsec = 1, 1.0
+        while outf.tell() < size:
+            lines = []
+            for i in range(num_hosts):
+                realsec += 0.0001
+                rt = f"{int(realsec//3600):02d}:{int(realsec%3600//60):02d}:{realsec%60:09.6f}"
+                st = f"{simsec//3600:02d}:{simsec%3600//60:02d}:{simsec%60:02d}.000000000"
+                recv, send = counters[(i+simsec) % 1024], counters[(i*7+simsec) % 1024]
+                lines.append(f"{rt} [2:worker-0] {st} [message] [peer{i}:11.0.0.1] [tracker.c:1] [_tracker_logNode] [shadow-heartbeat] [node] 1000,2;{simsec};0;{recv};{send};0\n")
+            outf.write(''.join(lines))
+            simsec += 1
+
+        outf.write("99:00:00.000000 [1:shadow] 99:00:00.000000000 [info] [n/a] [m.c:1] [f] Global syscall counts: {read:123, write:456}\n")
+        outf.write("99:00:00.000000 [1:shadow] 99:00:00.000000000 [info] [n/a] [m.c:1] [f] Global allocated object counts: {Event:789, Payload:12}\n")
+
+# the original line-by-line parser, kept as the baseline for the benchmark
+def parse_shadow_stdout_linewise(filepath):
+    heartbeat_times = {}
+    syscalls, objects = {}, {}
+    seconds_to_init = None
+
+    # works for both classic and phantom
+    heartbeat_prog = re.compile(" \[shadow-heartbeat\] \[node\] ")
+
+    # classic does not log syscalls
+    syscall_phantom_prog = re.compile("Global syscall counts:\s")
+
+    object_phantom_prog = re.compile("Global allocated object counts:\s")
+    object_classic_prog = re.compile("ObjectCounter: counter values:\s")
+
+    init_phantom_prog = re.compile("process \'peer.*\' started")
+    init_classic_prog = re.compile("ran the pth main thread until it blocked")
+
+    with open(filepath, 'r') as inf:
+        for line in inf:
+            line = line.strip()
+
+            match = heartbeat_prog.search(line)
+            if match:
+                parts = line.split(' ', 3)
+                realtime = timestamp_to_seconds(parts[0])
+                simtime = timestamp_to_seconds(parts[2])
+                pkts_send, pkts_recv, bytes_send, bytes_recv = parse_heartbeat(line[match.end():])
+
+                heartbeat_times.setdefault(simtime, {'pkts_send':0, 'pkts_recv':0, 'bytes_send':0, 'bytes_recv':0})
+                heartbeat_times[simtime]['pkts_send'] += pkts_send
+                heartbeat_times[simtime]['pkts_recv'] += pkts_recv
+                heartbeat_times[simtime]['bytes_send'] += bytes_send
+                heartbeat_times[simtime]['bytes_recv'] += bytes_recv
+
+                continue
+
+            match = syscall_phantom_prog.search(line)
+            if match:
+                syscalls = parse_counter_phantom(line[match.end():])
+                continue
+
+            match = object_phantom_prog.search(line)
+            if match:
+                objects = parse_counter_phantom(line[match.end():])
+                continue
+
+            match = object_classic_prog.search(line)
+            if match:
+                objects = parse_counter_classic(line[match.end():])
+                continue
+
+            match = init_phantom_prog.search(line)
+            if match:
+                seconds_to_init = timestamp_to_seconds(line.split(' ', 1)[0])
+                continue
+
+            match = init_classic_prog.search(line)
+            if match:
+                seconds_to_init = timestamp_to_seconds(line.split(' ', 1)[0])
+                continue
+
+    # sort so the stats see the values in the same order as the chunked parser
+    packets = [heartbeat_times[s]['pkts_send'] for s in sorted(heartbeat_times)]
+    bytes = [heartbeat_times[s]['bytes_send'] for s in sorted(heartbeat_times)]
+
+    return seconds_to_init, syscalls, objects, get_stats(packets), get_stats(bytes)
+
+def parse_heartbeat(s):
+    parts = s.strip().split(';')
+    counters_recv, counters_send = parts[3].split(','), parts[4].split(',')
+    # count number of packets that carry >0 payloads, and total bytes in payloads
+    return int(counters_send[6]), int(counters_recv[6]), int(counters_send[8]), int(counters_recv[8])
+
+if __name__ == '__main__':
+    sys.exit(main())
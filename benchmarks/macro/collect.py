@@ -4,8 +4,21 @@ import json
 import argparse
 import re
 import datetime
-
-from numpy import mean, median, std, var, percentile
+import time
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from collect_common import *
+from stats_common import get_stats
+from results_db import open_results_db, store_records
+from memsampler import MEMSAMPLER_FILENAME, MEMSAMPLER_MAGIC, MEMSAMPLER_FIELDS, MEMSAMPLER_HEADER, MEMSAMPLER_RECORD
+from procsampler import PROCSAMPLER_FILENAME, PROCSAMPLER_MAGIC, PROCSAMPLER_FIELDS, PROCSAMPLER_HEADER, PROCSAMPLER_RECORD, PSS_UNKNOWN
+import collect_common
+import stats_common
+import memsampler
+import procsampler
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -17,56 +30,454 @@ def main():
         help="Prefix for the json output file",
         default='results'
     )
+    parser.add_argument('-j', "--jobs", 
+        help="Number of worker processes used to parse experiment directories in parallel",
+        type=int,
+        default=1
+    )
+    parser.add_argument("--jsonl", 
+        help="Write the results as json lines (one experiment per line) to PREFIX_NAME.jsonl",
+        action='store_true'
+    )
+    parser.add_argument("--append", 
+        help="Append the experiments that are not yet in PREFIX_NAME.jsonl instead of rewriting it; implies --jsonl",
+        action='store_true'
+    )
+    parser.add_argument("--cache_dir", 
+        help="Directory in which parsed experiments are cached, so unchanged experiments are not parsed again",
+        default=DEFAULT_CACHE_DIR
+    )
+    parser.add_argument("--no_cache", 
+        help="Do not read or write the parse cache",
+        action='store_true'
+    )
+    parser.add_argument("--db", 
+        help="Also upsert the results into this sqlite database, as the source named by the basename of PREFIX_NAME",
+        default=None
+    )
+    parser.add_argument("--follow", 
+        help="Path to the directory of a single running experiment, whose stdout and memory log are tailed to report its progress until it finishes",
+        metavar="EXP_DIR",
+        default=None
+    )
+    parser.add_argument("--interval", 
+        help="Number of real seconds between two progress reports in --follow mode",
+        type=float,
+        default=10.0
+    )
+    parser.add_argument("--window", 
+        help="Number of simulated seconds over which the rates are averaged in --follow mode",
+        type=int,
+        default=10
+    )
+    parser.add_argument("--follow_output", 
+        help="Also append the progress reports of --follow mode as json lines to this file",
+        default=None
+    )
+    parser.add_argument("--idle_timeout", 
+        help="Number of real seconds without new shadow output after which --follow mode reports the experiment as unfinished and stops (0 to wait forever)",
+        type=float,
+        default=900.0
+    )
     args = parser.parse_args()
-    process_benchmark(args)
+    if args.follow != None:
+        return follow_sim(args)
+    else:
+        process_benchmark(args)
 
 def process_benchmark(args):
     print(f"Parsing results from {args.base_directory}")
-    data = process_sims(args.base_directory)
 
-    outname = f'{args.prefix_name}.json'
+    jsonl = args.jsonl or args.append
+    outname = f'{args.prefix_name}.jsonl' if jsonl else f'{args.prefix_name}.json'
+    cache_dir = None if args.no_cache else args.cache_dir
+    # the per-experiment time series are written to npz sidecars next to the results
+    series_dir = f'{args.prefix_name}_series'
+
+    # the parsed results also depend on the stats and on the record layouts of
+    # the samplers, so their code is part of the cache fingerprints
+    source_digest = get_source_digest(__file__, collect_common.__file__, stats_common.__file__,
+        memsampler.__file__, procsampler.__file__)
+    paths = find_sims(args.base_directory)
+    fingerprints = {path: get_sim_fingerprint(path, source_digest) for path in paths}
+
+    append = args.append and os.path.exists(outname)
+    manifest = load_manifest(outname) if append else {}
+    if append:
+        changed = [path for path in paths if os.path.basename(path) in manifest and \
+            manifest[os.path.basename(path)] != fingerprints[path]]
+        if len(changed) > 0:
+            print(f"{len(changed)} experiments changed since they were written to {outname}, rewriting it")
+            append, manifest = False, {}
+        else:
+            paths = [path for path in paths if os.path.basename(path) not in manifest]
+            print(f"Skipping {len(manifest)} experiments that are already in {outname}")
+
     print(f"Saving results to {outname}")
-    with open(outname, 'w') as outf:
-        json.dump(data, outf, sort_keys=True, indent=2)
+    records = process_sims(paths, fingerprints, series_dir, args.jobs, cache_dir, manifest)
+    if args.db != None:
+        db = open_results_db(args.db)
+        records = store_records(db, os.path.basename(args.prefix_name), records)
+    count = write_results(outname, records, jsonl=jsonl, append=append)
+    print(f"Wrote {count} experiments to {outname}")
+
+    if jsonl:
+        save_manifest(outname, manifest)
 
-def process_sims(dirname):
-    data = []
+def find_sims(dirname):
+    paths = []
 
-    for name in os.listdir(dirname):
+    # sort so that the serial and parallel modes produce identical output
+    for name in sorted(os.listdir(dirname)):
         path = os.path.join(dirname, name)
 
         if 'shadow_' not in name or os.path.isfile(path):
             continue
 
-        with open(os.path.join(path, 'shadow.json'), 'r') as inf:
-            shadow_json = json.load(inf)
-
-        #hostsdir = os.path.join(path, 'shadow.data/hosts')
-        stderr_path = os.path.join(path, 'stderr')
-        stdout_path = os.path.join(path, 'stdout')
-        free_path = os.path.join(path, 'free.log')
-
-        perf_stats = parse_shadow_stderr(stderr_path)
-        seconds_to_init, syscall_counts, object_counts, packet_stats, byte_stats = parse_shadow_stdout(stdout_path)
-        mem_used = parse_free_log(free_path)
-
-        shadow_json['~results'] = {
-            'perf': perf_stats,
-            'syscalls': syscall_counts,
-            'objects': object_counts,
-            'packets_per_second': packet_stats,
-            'bytes_per_second': byte_stats,
-            'seconds_to_init': seconds_to_init,
-            'mem_used': mem_used,
-        }
-
-        data.append(shadow_json)
+        paths.append(path)
+
+    return paths
+
+def get_sim_fingerprint(path, source_digest):
+    filenames = ['shadow.json', 'stderr', 'stdout']
+    filepaths = [os.path.join(path, name) for name in filenames] + [get_mem_log_path(path)]
+    procs_path = get_procs_log_path(path)
+    if procs_path != None:
+        filepaths.append(procs_path)
+    return get_fingerprint(filepaths, source_digest)
+
+def process_sims(paths, fingerprints, series_dir, num_jobs=1, cache_dir=None, manifest={}):
+    # yields the parsed experiments in the order of paths, and records each
+    # yielded experiment in the manifest
+    tasks = [(path, fingerprints[path], series_dir, cache_dir) for path in paths]
+
+    if num_jobs > 1:
+        with Pool(processes=num_jobs) as pool:
+            # imap yields in input order, so the merged list stays deterministic
+            for result in pool.imap(process_sim_task, tasks):
+                yield handle_sim_result(result, fingerprints, manifest)
+    else:
+        for task in tasks:
+            yield handle_sim_result(process_sim_task(task), fingerprints, manifest)
+
+def handle_sim_result(result, fingerprints, manifest):
+    path, shadow_json, elapsed, cached = result
+    if cached:
+        print(f"Loaded {path} from cache in {elapsed:.3f} seconds")
+    else:
+        print(f"Parsed {path} in {elapsed:.3f} seconds")
+    manifest[os.path.basename(path)] = fingerprints[path]
+    return shadow_json
+
+def process_sim_task(task):
+    path, fingerprint, series_dir, cache_dir = task
+    start = time.perf_counter()
+
+    if cache_dir != None:
+        shadow_json = load_cached(cache_dir, path, fingerprint)
+        # the cached result is only usable if its sidecar is where it points to
+        if shadow_json != None and shadow_json['~results'].get('series') == get_series_name(path, series_dir) and \
+                os.path.exists(get_series_path(path, series_dir)):
+            return path, shadow_json, time.perf_counter() - start, True
+
+    shadow_json = process_sim(path, series_dir)
+
+    if cache_dir != None:
+        store_cached(cache_dir, path, fingerprint, shadow_json)
+
+    return path, shadow_json, time.perf_counter() - start, False
+
+def get_series_path(path, series_dir):
+    return os.path.join(series_dir, f'{os.path.basename(path)}.npz')
+
+def get_series_name(path, series_dir):
+    # relative to the directory of the results file
+    return f'{os.path.basename(series_dir)}/{os.path.basename(path)}.npz'
+
+def process_sim(path, series_dir):
+    with open(os.path.join(path, 'shadow.json'), 'r') as inf:
+        shadow_json = json.load(inf)
+
+    #hostsdir = os.path.join(path, 'shadow.data/hosts')
+    stderr_path = os.path.join(path, 'stderr')
+    stdout_path = os.path.join(path, 'stdout')
+
+    # the logs may be compressed, so parse them concurrently to decompress
+    # them in parallel (the decompressors release the GIL)
+    procs_path = get_procs_log_path(path)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        perf_future = executor.submit(parse_shadow_stderr, stderr_path)
+        stdout_future = executor.submit(parse_shadow_stdout, stdout_path)
+        mem_future = executor.submit(parse_mem_log, path)
+        if procs_path != None:
+            procs_future = executor.submit(parse_proc_samples, procs_path)
+
+    perf_stats = perf_future.result()
+    seconds_to_init, syscall_counts, object_counts, packet_stats, byte_stats, heartbeats = stdout_future.result()
+    mem_times, mem_used = mem_future.result()
+
+    columns = {
+        'simtime_ns': numpy.round(heartbeats['simtime'] * 10**9).astype(numpy.int64),
+        'realtime_sec': heartbeats['realtime'],
+        'packets': heartbeats['packets'],
+        'bytes': heartbeats['bytes'],
+        'mem_time_sec': mem_times,
+        'mem_used': mem_used,
+    }
+    dtypes = {
+        'simtime_ns': numpy.int64,
+        'realtime_sec': numpy.float32,
+        'packets': numpy.int64,
+        'bytes': numpy.int64,
+        'mem_time_sec': numpy.float64,
+        'mem_used': numpy.int64,
+    }
+    delta_columns = ['simtime_ns', 'realtime_sec', 'mem_time_sec', 'mem_used']
+
+    if procs_path != None:
+        proc_stats, proc_series = procs_future.result()
+        for name, values in proc_series.items():
+            columns[f'procs_{name}'] = values
+            dtypes[f'procs_{name}'] = numpy.float64 if name == 'time_sec' else numpy.int64
+        delta_columns.append('procs_time_sec')
+
+    save_series(get_series_path(path, series_dir), columns, dtypes, delta_columns=delta_columns)
+
+    shadow_json['~results'] = {
+        'perf': perf_stats,
+        'syscalls': syscall_counts,
+        'objects': object_counts,
+        'packets_per_second': packet_stats,
+        'bytes_per_second': byte_stats,
+        'seconds_to_init': seconds_to_init,
+        'mem_used_max': mem_used.max().item(),
+        'series': get_series_name(path, series_dir),
+    }
 
-    return data
+    # only experiments that ran with procsampler.py have per-process stats
+    if procs_path != None:
+        shadow_json['~results']['procs'] = proc_stats
+
+    return shadow_json
+
+def follow_sim(args):
+    path = args.follow
+    print(f"Following {path}, reporting every {args.interval} seconds until the experiment finishes (Ctrl-C to stop)")
+
+    stdout_tail = new_tail(os.path.join(path, 'stdout'))
+    free_tail = new_tail(os.path.join(path, 'free.log'))
+    mem_tail = new_tail(os.path.join(path, MEMSAMPLER_FILENAME), record_size=MEMSAMPLER_RECORD.size, header_size=MEMSAMPLER_HEADER.size)
+    stderr_path = os.path.join(path, 'stderr')
+    # shadow logs heartbeats until it exits, but the samplers run on their own,
+    # so only the output of shadow shows that the experiment is still running
+    shadow_log_paths = [os.path.join(path, 'stdout'), stderr_path]
+
+    # the same incremental state that parse_shadow_stdout and parse_free_log
+    # build, so the final numbers match a regular collect exactly
+    heartbeats = new_heartbeat_totals()
+    free_state = new_free_state()
+    mem_state = new_mem_sample_state()
+
+    outf = open(args.follow_output, 'a') if args.follow_output != None else None
+    next_report = time.monotonic()
+    log_sizes, last_growth = get_log_sizes(shadow_log_paths), time.monotonic()
+    unfinished = False
+
+    try:
+        while True:
+            # perf only writes its stats to stderr after shadow exited, and then
+            # we drain the logs one last time, including unterminated lines
+            done = is_sim_done(stderr_path)
+
+            # if shadow died before perf wrote its stats, e.g., because it
+            # crashed or was killed, its logs stop growing and it never finishes
+            sizes = get_log_sizes(shadow_log_paths)
+            if sizes != log_sizes:
+                log_sizes, last_growth = sizes, time.monotonic()
+            elif not done and args.idle_timeout > 0 and time.monotonic() - last_growth >= args.idle_timeout:
+                unfinished = True
+            final = done or unfinished
+
+            for chunk in read_tail(stdout_tail, final=final):
+                add_heartbeat_chunk(heartbeats, summarize_heartbeat_chunk(chunk))
+            for chunk in read_tail(free_tail, final=final):
+                parse_free_lines(chunk.decode().splitlines(keepends=True), free_state)
+            for chunk in read_tail(mem_tail, final=final):
+                add_mem_sample_chunk(mem_state, chunk)
+
+            if final or time.monotonic() >= next_report:
+                report = get_follow_report(heartbeats, free_state, mem_state, args.window, done)
+                if unfinished:
+                    report['unfinished'] = True
+                print_follow_report(report)
+                if outf != None:
+                    outf.write(json.dumps(report, sort_keys=True))
+                    outf.write('\n')
+                    outf.flush()
+                next_report = time.monotonic() + args.interval
+
+            if final:
+                break
+
+            time.sleep(min(args.interval, 1.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_tail(stdout_tail)
+        close_tail(free_tail)
+        close_tail(mem_tail)
+        if outf != None:
+            outf.close()
+
+    if unfinished:
+        print(f"Stopped following {path}: shadow wrote no output for {args.idle_timeout} seconds but did not finish")
+        return 1
+    return 0
+
+def get_log_sizes(paths):
+    # the sizes of the files, or None for the missing ones
+    sizes = []
+    for filepath in paths:
+        try:
+            sizes.append(os.stat(filepath).st_size)
+        except FileNotFoundError:
+            sizes.append(None)
+    return sizes
+
+def new_tail(filepath, record_size=None, header_size=0):
+    # reads lines, or fixed-size records after a header if record_size is set
+    return {'path': filepath, 'file': None, 'inode': None, 'offset': header_size, 'leftover': b'',
+        'record_size': record_size, 'header_size': header_size}
+
+def close_tail(tail):
+    if tail['file'] != None:
+        tail['file'].close()
+        tail['file'] = None
+
+def read_tail(tail, final=False):
+    # yields chunks of the complete lines (or records) that were appended to the
+    # file since the last call, following the file across rotations and truncations
+
+    try:
+        st = os.stat(tail['path'])
+    except FileNotFoundError:
+        st = None
+
+    if tail['file'] != None and (st == None or st.st_ino != tail['inode'] or st.st_size < tail['offset']):
+        # the file was rotated or truncated; finish reading the old file through
+        # our open handle, which still refers to it, and then start over
+        yield from read_tail_chunks(tail, final=True)
+        close_tail(tail)
+        tail['offset'], tail['leftover'] = tail['header_size'], b''
+
+    if tail['file'] == None:
+        if st == None:
+            return
+        tail['file'] = open(tail['path'], 'rb')
+        tail['inode'] = os.fstat(tail['file'].fileno()).st_ino
+
+    yield from read_tail_chunks(tail, final)
+
+def read_tail_chunks(tail, final=False):
+    inf = tail['file']
+    inf.seek(tail['offset'])
+    while True:
+        data = inf.read(STDOUT_CHUNK_SIZE)
+        if not data:
+            break
+        tail['offset'] += len(data)
+        data = tail['leftover'] + data
+        if tail['record_size'] != None:
+            i = len(data) - len(data) % tail['record_size'] - 1
+        else:
+            i = data.rfind(b'\n')
+        tail['leftover'] = data[i+1:]
+        if i >= 0:
+            yield data[:i+1]
+    # an incomplete record is useless, but an unterminated line is not
+    if final and tail['leftover'] and tail['record_size'] == None:
+        yield tail['leftover']
+    if final:
+        tail['leftover'] = b''
+
+def is_sim_done(stderr_path):
+    # the perf stats are small and at the end of stderr
+    try:
+        with open(stderr_path, 'rb') as inf:
+            inf.seek(max(0, os.fstat(inf.fileno()).st_size - 2**16))
+            return b';duration_time;' in inf.read()
+    except FileNotFoundError:
+        return False
+
+def new_mem_sample_state():
+    return {'min': None, 'max': None, 'last': None}
+
+def add_mem_sample_chunk(state, chunk):
+    _, used = parse_mem_sample_records(chunk)
+    if len(used) == 0:
+        return
+    state['min'] = min(used.min().item(), state['min']) if state['min'] != None else used.min().item()
+    state['max'] = max(used.max().item(), state['max']) if state['max'] != None else used.max().item()
+    state['last'] = used[-1].item()
+
+def get_follow_report(heartbeats, free_state, mem_state, window, done):
+    simtimes, realtimes, counters = get_heartbeat_series(heartbeats)
+    if not done:
+        # nodes may still be logging heartbeats for the latest simtime
+        simtimes, realtimes, counters = simtimes[:-1], realtimes[:-1], counters[:-1]
+
+    report = {'done': done, 'time': datetime.datetime.now().isoformat(timespec='seconds')}
+
+    if len(simtimes) > 0:
+        packets = counters[:, HEARTBEAT_PKTS_SEND]
+        bytes = counters[:, HEARTBEAT_BYTES_SEND]
+        k = min(window, len(simtimes))
+        report['simtime'] = simtimes[-1].item()
+        report['realtime'] = realtimes[-1].item()
+        report['packets'] = packets.sum().item()
+        report['packets_per_second'] = packets[-k:].mean().item()
+        report['bytes_per_second'] = bytes[-k:].mean().item()
+        if k > 1 and realtimes[-1] > realtimes[-k]:
+            report['simsec_per_realsec'] = ((simtimes[-1] - simtimes[-k]) / (realtimes[-1] - realtimes[-k])).item()
+        if done:
+            # the same stats that a regular collect stores for the experiment
+            report['packets_per_second_stats'] = get_stats(packets.tolist())
+            report['bytes_per_second_stats'] = get_stats(bytes.tolist())
+
+    if len(free_state['mem_used']) > 0:
+        mem_used = get_mem_used(free_state)
+        # the latest sample, since dicts keep their insertion order
+        report['mem_used'] = next(reversed(mem_used.values()))
+        report['mem_used_max'] = max(mem_used.values())
+
+    if mem_state['last'] != None:
+        # relative to the least memory used, like parse_mem_samples
+        report['mem_used'] = mem_state['last'] - mem_state['min']
+        report['mem_used_max'] = mem_state['max'] - mem_state['min']
+
+    return report
+
+def print_follow_report(report):
+    parts = [f"[{report['time']}]"]
+    if 'simtime' in report:
+        parts.append(f"simtime {report['simtime']:.0f}s")
+        if 'simsec_per_realsec' in report:
+            parts.append(f"{report['simsec_per_realsec']:.3f} sim-sec/real-sec")
+        parts.append(f"{report['packets_per_second']:.0f} packets/sec")
+        parts.append(f"{report['bytes_per_second']/2**20:.1f} MiB/sec")
+    if 'mem_used_max' in report:
+        parts.append(f"mem_used {report['mem_used']/2**30:.2f} GiB")
+        parts.append(f"mem_used_max {report['mem_used_max']/2**30:.2f} GiB")
+    if report['done']:
+        parts.append("(done)")
+    elif report.get('unfinished', False):
+        parts.append("(unfinished)")
+    print(', '.join(parts), flush=True)
 
 def parse_shadow_stderr(filepath):
     d = {}
-    with open(filepath, 'r') as inf:
+    with open_log(filepath, 'r') as inf:
         for line in inf:
             if line[0] == '*':
                 continue
@@ -84,75 +495,170 @@ def parse_shadow_stderr(filepath):
                 d[k] = int(parts[0])
     return d
 
-def parse_shadow_stdout(filepath):
-    heartbeat_times = {}
-    syscalls, objects = {}, {}
-    seconds_to_init = None
-
-    # works for both classic and phantom
-    heartbeat_prog = re.compile(" \[shadow-heartbeat\] \[node\] ")
-
-    # classic does not log syscalls
-    syscall_phantom_prog = re.compile("Global syscall counts:\s")
-
-    object_phantom_prog = re.compile("Global allocated object counts:\s")
-    object_classic_prog = re.compile("ObjectCounter: counter values:\s")
-
-    init_phantom_prog = re.compile("process \'peer.*\' started")
-    init_classic_prog = re.compile("ran the pth main thread until it blocked")
-
-    with open(filepath, 'r') as inf:
-        for line in inf:
-            line = line.strip()
-
-            match = heartbeat_prog.search(line)
-            if match:
-                parts = line.split(' ', 3)
-                realtime = timestamp_to_seconds(parts[0])
-                simtime = timestamp_to_seconds(parts[2])
-                pkts_send, pkts_recv, bytes_send, bytes_recv = parse_heartbeat(line[match.end():])
-
-                heartbeat_times.setdefault(simtime, {'pkts_send':0, 'pkts_recv':0, 'bytes_send':0, 'bytes_recv':0})
-                heartbeat_times[simtime]['pkts_send'] += pkts_send
-                heartbeat_times[simtime]['pkts_recv'] += pkts_recv
-                heartbeat_times[simtime]['bytes_send'] += bytes_send
-                heartbeat_times[simtime]['bytes_recv'] += bytes_recv
+# stdout is read in large binary chunks, and the heartbeat lines in each chunk
+# are located and parsed with numpy instead of running python code per line
+STDOUT_CHUNK_SIZE = 16*2**20
 
-                continue
-
-            match = syscall_phantom_prog.search(line)
-            if match:
-                syscalls = parse_counter_phantom(line[match.end():])
-                continue
-
-            match = object_phantom_prog.search(line)
-            if match:
-                objects = parse_counter_phantom(line[match.end():])
-                continue
+# works for both classic and phantom
+HEARTBEAT_MARKER = b' [shadow-heartbeat] [node] '
 
-            match = object_classic_prog.search(line)
-            if match:
-                objects = parse_counter_classic(line[match.end():])
-                continue
+# columns of the counters returned by parse_heartbeat_chunk
+HEARTBEAT_PKTS_SEND, HEARTBEAT_PKTS_RECV, HEARTBEAT_BYTES_SEND, HEARTBEAT_BYTES_RECV = range(4)
 
-            match = init_phantom_prog.search(line)
-            if match:
-                seconds_to_init = timestamp_to_seconds(line.split(' ', 1)[0])
-                continue
+# the remaining interesting lines are rare, so we find them by their literal
+# marker and then check them in python
+SYSCALL_PHANTOM_MARKER = b'Global syscall counts: ' # classic does not log syscalls
+OBJECT_PHANTOM_MARKER = b'Global allocated object counts: '
+OBJECT_CLASSIC_MARKER = b'ObjectCounter: counter values: '
+INIT_PHANTOM_MARKER = b"process 'peer"
+INIT_CLASSIC_MARKER = b'ran the pth main thread until it blocked'
+INIT_PHANTOM_PROG = re.compile(rb"process \'peer.*\' started")
 
-            match = init_classic_prog.search(line)
-            if match:
-                seconds_to_init = timestamp_to_seconds(line.split(' ', 1)[0])
-                continue
-
-    packets = [heartbeat_times[s]['pkts_send'] for s in heartbeat_times]
-    bytes = [heartbeat_times[s]['bytes_send'] for s in heartbeat_times]
+def parse_shadow_stdout(filepath):
+    heartbeat_chunks = []
+    state = {'syscalls': {}, 'objects': {}, 'seconds_to_init': None}
+
+    with open_log(filepath, 'rb') as inf:
+        for chunk in read_line_chunks(inf):
+            heartbeat_chunks.append(summarize_heartbeat_chunk(chunk))
+            parse_other_chunk(chunk, state)
+
+    simtimes, realtimes, counters = merge_heartbeat_chunks(heartbeat_chunks)
+    packets = counters[:, HEARTBEAT_PKTS_SEND].tolist()
+    bytes = counters[:, HEARTBEAT_BYTES_SEND].tolist()
+
+    heartbeats = {
+        'simtime': simtimes,
+        'realtime': realtimes,
+        'packets': counters[:, HEARTBEAT_PKTS_SEND],
+        'bytes': counters[:, HEARTBEAT_BYTES_SEND],
+    }
 
-    return seconds_to_init, syscalls, objects, get_stats(packets), get_stats(bytes)
+    return state['seconds_to_init'], state['syscalls'], state['objects'], get_stats(packets), get_stats(bytes), heartbeats
+
+def read_line_chunks(inf, chunk_size=STDOUT_CHUNK_SIZE):
+    # yields chunks that only contain complete lines
+    leftover = b''
+    while True:
+        chunk = inf.read(chunk_size)
+        if not chunk:
+            break
+        chunk = leftover + chunk
+        i = chunk.rfind(b'\n')
+        if i < 0:
+            leftover = chunk
+            continue
+        leftover = chunk[i+1:]
+        yield chunk[:i+1]
+    if leftover:
+        yield leftover
+
+def summarize_heartbeat_chunk(chunk):
+    # returns the unique simtimes in the chunk, the realtime (in seconds) at
+    # which the last heartbeat of each simtime was logged, and the counters
+    # summed over all nodes for each simtime
+    simtimes, counters, line_starts = parse_heartbeat_chunk(chunk)
+    keys, sums, last = sum_heartbeats(simtimes, counters)
+    # only a handful of lines per chunk, so we parse them in python
+    realtimes = [timestamp_to_seconds(chunk[i:chunk.index(b' ', i)].decode()) for i in line_starts[last].tolist()]
+    return keys, realtimes, sums
+
+def parse_heartbeat_chunk(chunk):
+    # returns the simtime (as bytes), the counters and the start offset of
+    # every heartbeat line in the chunk, with the counter columns in the order
+    # of parse_heartbeat
+
+    # splitting on the marker is cheaper than creating a match object per line
+    pieces = chunk.split(HEARTBEAT_MARKER)
+    lengths = numpy.fromiter(map(len, pieces), dtype=numpy.int64, count=len(pieces))
+    payload_starts = numpy.cumsum(lengths[:-1] + len(HEARTBEAT_MARKER))
+    del pieces
+    if len(payload_starts) == 0:
+        return numpy.empty(0, dtype='S1'), numpy.empty((0, 4), dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+
+    buf = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    end = len(buf)
+
+    # positions of the separators, with a sentinel so lookups past the end are safe
+    newlines = numpy.flatnonzero(buf == ord('\n'))
+    spaces = numpy.append(numpy.flatnonzero(buf == ord(' ')), [end, end, end])
+    semicolons = numpy.append(numpy.flatnonzero(buf == ord(';')), [end]*5)
+    commas = numpy.append(numpy.flatnonzero(buf == ord(',')), [end]*9)
+
+    i = numpy.searchsorted(newlines, payload_starts)
+    line_starts = numpy.concatenate(([0], newlines + 1))[i]
+    line_ends = numpy.append(newlines, end)[i]
+
+    # the simtime is the third space-separated token of the line
+    k = numpy.searchsorted(spaces, line_starts)
+    simtime_starts, simtime_ends = spaces[k+1] + 1, spaces[k+2]
+    valid = simtime_ends <= payload_starts - len(HEARTBEAT_MARKER)
+
+    # the 4th and 5th semicolon-separated fields hold the recv and send counters
+    k = numpy.searchsorted(semicolons, payload_starts)
+    recv_starts, recv_ends = semicolons[k+2] + 1, semicolons[k+3]
+    send_starts, send_ends = recv_ends + 1, numpy.minimum(semicolons[k+4], line_ends)
+    valid &= recv_ends < line_ends
 
-def timestamp_to_seconds(s):
-    parts = s.split(':')
-    return int(parts[0])*3600.0 + int(parts[1])*60.0 + float(parts[2])
+    # count number of packets that carry >0 payloads, and total bytes in payloads
+    pkts, bytes = [], []
+    for field_starts, field_ends in [(send_starts, send_ends), (recv_starts, recv_ends)]:
+        k = numpy.searchsorted(commas, numpy.minimum(field_starts, end))
+        valid &= commas[k+7] < field_ends
+        pkts.append((commas[k+5] + 1, commas[k+6]))
+        bytes.append((commas[k+7] + 1, numpy.minimum(commas[k+8], field_ends)))
+    columns = pkts + bytes
+
+    counters = numpy.empty((len(payload_starts), 4), dtype=numpy.int64)
+    for c, (col_starts, col_ends) in enumerate(columns):
+        counters[:, c], col_valid = parse_uint_fields(buf, col_starts, col_ends)
+        valid &= col_valid
+
+    simtimes = gather_fields(buf, simtime_starts, numpy.where(valid, simtime_ends, simtime_starts))
+
+    # anything that does not look like the usual heartbeat line is handled by
+    # the line-based parser, which preserves its exact semantics
+    invalid = numpy.flatnonzero(~valid)
+    if len(invalid) > 0:
+        simtimes = simtimes.tolist()
+        for j in invalid:
+            line = chunk[line_starts[j]:line_ends[j]].decode().strip()
+            simtimes[j] = line.split(' ', 3)[2].encode()
+            counters[j] = parse_heartbeat(line[line.index(HEARTBEAT_MARKER.decode()) + len(HEARTBEAT_MARKER):])
+        simtimes = numpy.array(simtimes)
+
+    return simtimes, counters, line_starts
+
+def gather_fields(buf, starts, ends):
+    # returns the bytes in [start, end) for each field as a numpy bytes array
+    widths = ends - starts
+    max_width = int(widths.max()) if len(widths) > 0 else 0
+    if max_width == 0:
+        return numpy.zeros(len(starts), dtype='S1')
+    offsets = numpy.arange(max_width)
+    idx = numpy.minimum(starts[:, None] + offsets, len(buf) - 1)
+    # the trailing NUL bytes of shorter fields are ignored by numpy
+    chars = numpy.where(offsets < widths[:, None], buf[idx], 0).astype(numpy.uint8)
+    return numpy.ascontiguousarray(chars).view(f'S{max_width}').ravel()
+
+def parse_uint_fields(buf, starts, ends):
+    # returns the integer value of the decimal digits in [start, end) for each
+    # field, and whether the field consisted of only 1 to 18 digits
+    widths = ends - starts
+    valid = (widths >= 1) & (widths <= 18)
+    widths = numpy.where(valid, widths, 0)
+    max_width = int(widths.max()) if len(widths) > 0 else 0
+
+    # align the digits on the right, so column i holds the 10^i digit
+    offsets = numpy.arange(max_width)
+    in_field = offsets < widths[:, None]
+    idx = numpy.where(in_field, ends[:, None] - 1 - offsets, 0)
+    digits = buf[idx].astype(numpy.int64) - ord('0')
+    valid &= numpy.all(~in_field | ((digits >= 0) & (digits <= 9)), axis=1)
+
+    digits = numpy.where(in_field, digits, 0)
+    values = digits @ (10 ** numpy.arange(max_width, dtype=numpy.int64))
+    return values, valid
 
 def parse_heartbeat(s):
     parts = s.strip().split(';')
@@ -160,6 +666,78 @@ def parse_heartbeat(s):
     # count number of packets that carry >0 payloads, and total bytes in payloads
     return int(counters_send[6]), int(counters_recv[6]), int(counters_send[8]), int(counters_recv[8])
 
+def sum_heartbeats(simtimes, counters):
+    # returns the unique simtimes, the counters summed over all nodes for each,
+    # and the index of the last heartbeat of each
+    keys, inverse = numpy.unique(simtimes, return_inverse=True)
+    sums = numpy.zeros((len(keys), counters.shape[1]), dtype=numpy.int64)
+    numpy.add.at(sums, inverse.ravel(), counters)
+    last = numpy.zeros(len(keys), dtype=numpy.int64)
+    numpy.maximum.at(last, inverse.ravel(), numpy.arange(len(simtimes)))
+    return keys, sums, last
+
+def merge_heartbeat_chunks(heartbeat_chunks):
+    # returns the sorted simtimes (in seconds), the realtime (in seconds) of the
+    # last heartbeat of each simtime, and the summed counters over all chunks
+    heartbeats = new_heartbeat_totals()
+    for heartbeat_chunk in heartbeat_chunks:
+        add_heartbeat_chunk(heartbeats, heartbeat_chunk)
+    return get_heartbeat_series(heartbeats)
+
+def new_heartbeat_totals():
+    return {'counters': {}, 'realtimes': {}}
+
+def add_heartbeat_chunk(heartbeats, heartbeat_chunk):
+    totals, last_realtimes = heartbeats['counters'], heartbeats['realtimes']
+    simtimes, realtimes, counters = heartbeat_chunk
+    for simtime, realtime, row in zip(simtimes.tolist(), realtimes, counters):
+        simtime = timestamp_to_seconds(simtime.decode())
+        last_realtimes[simtime] = realtime
+        if simtime in totals:
+            totals[simtime] += row
+        else:
+            totals[simtime] = row.copy()
+
+def get_heartbeat_series(heartbeats):
+    totals, last_realtimes = heartbeats['counters'], heartbeats['realtimes']
+    simtimes = sorted(totals)
+    counters = numpy.array([totals[s] for s in simtimes], dtype=numpy.int64).reshape(-1, 4)
+    realtimes = numpy.array([last_realtimes[s] for s in simtimes], dtype=numpy.float64)
+    return numpy.array(simtimes), realtimes, counters
+
+def parse_other_chunk(chunk, state):
+    matches = []
+    for kind, marker in enumerate([SYSCALL_PHANTOM_MARKER, OBJECT_PHANTOM_MARKER,
+            OBJECT_CLASSIC_MARKER, INIT_PHANTOM_MARKER, INIT_CLASSIC_MARKER]):
+        i = chunk.find(marker)
+        while i >= 0:
+            matches.append((i, kind, marker))
+            i = chunk.find(marker, i + len(marker))
+
+    # later lines overwrite the values from earlier lines
+    for i, kind, marker in sorted(matches):
+        line_start = chunk.rfind(b'\n', 0, i) + 1
+        line_end = chunk.find(b'\n', i)
+        if line_end < 0:
+            line_end = len(chunk)
+        line = chunk[line_start:line_end].decode().strip()
+        rest = chunk[i+len(marker):line_end].decode().strip()
+
+        if kind == 0:
+            state['syscalls'] = parse_counter_phantom(rest)
+        elif kind == 1:
+            state['objects'] = parse_counter_phantom(rest)
+        elif kind == 2:
+            state['objects'] = parse_counter_classic(rest)
+        elif kind == 3 and INIT_PHANTOM_PROG.search(chunk, i, line_end) == None:
+            continue
+        else:
+            state['seconds_to_init'] = timestamp_to_seconds(line.split(' ', 1)[0])
+
+def timestamp_to_seconds(s):
+    parts = s.split(':')
+    return int(parts[0])*3600.0 + int(parts[1])*60.0 + float(parts[2])
+
 def parse_counter_phantom(s):
     s = s.replace('{', '{"')
     s = s.replace(':', '":')
@@ -174,48 +752,146 @@ def parse_counter_classic(s):
         d[key] = int(val)
     return d
 
-def parse_free_log(filepath):
-    mem_used = {}
-
-    last_ts = None
-    mem_header = None
-    with open(filepath, 'r') as inf:
-        for line in inf:
-            if "+00" in line:
-                ts_str = line.strip().split('+')[0]
-                dt = datetime.datetime.strptime(ts_str, "%Y-%m-%d %H:%M:%S")
-                last_ts = dt.timestamp()
-            elif 'total' in line and mem_header == None:
-                mem_header = [p.strip() for p in line.strip().split()]
-            elif "Mem:" in line:
-                parts = [p.strip() for p in line.strip().split()]
-                mem_counts = [int(p) for p in parts[1:]]
-
-                memd = {f"mem_{mem_header[i]}": mem_counts[i] for i in range(len(mem_counts))}
-                used = memd['mem_total'] - memd['mem_available']
-
-                mem_used.setdefault(last_ts, used)
+def get_mem_log_path(path):
+    # experiments that ran with memsampler.py have a binary memory log, while
+    # older experiments polled free into free.log
+    try:
+        return find_log(os.path.join(path, MEMSAMPLER_FILENAME))
+    except FileNotFoundError:
+        return os.path.join(path, 'free.log')
+
+def parse_mem_log(path):
+    # returns the sample times and the memory used by the simulation at each
+    mem_path = get_mem_log_path(path)
+    if os.path.basename(mem_path).startswith(MEMSAMPLER_FILENAME):
+        return parse_mem_samples(mem_path)
+
+    mem_used = parse_free_log(mem_path)
+    return numpy.array(list(mem_used.keys()), dtype=numpy.float64), numpy.array(list(mem_used.values()), dtype=numpy.int64)
+
+def parse_mem_samples(filepath):
+    with open_log(filepath, 'rb') as inf:
+        data = inf.read()
+
+    magic, interval, num_fields = MEMSAMPLER_HEADER.unpack_from(data)
+    assert magic == MEMSAMPLER_MAGIC and num_fields == len(MEMSAMPLER_FIELDS), f"{filepath} is not a memsampler log"
+
+    times, used = parse_mem_sample_records(memoryview(data)[MEMSAMPLER_HEADER.size:])
+
+    # the memory used by the simulation, relative to the least memory used
+    # while it was running, like parse_free_log
+    return times, used - used.min()
+
+def parse_mem_sample_records(data):
+    # returns the times and the memory used (total - available) of the records;
+    # a partial record at the end, e.g., when the sampler was killed, is ignored
+    dtype = numpy.dtype([('time', '<f8')] + [(name, '<u8') for name in MEMSAMPLER_FIELDS])
+    assert dtype.itemsize == MEMSAMPLER_RECORD.size
+    samples = numpy.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+    used = samples['MemTotal'].astype(numpy.int64) - samples['MemAvailable'].astype(numpy.int64)
+    return samples['time'].copy(), used
+
+def get_procs_log_path(path):
+    try:
+        return find_log(os.path.join(path, PROCSAMPLER_FILENAME))
+    except FileNotFoundError:
+        return None
+
+def parse_proc_samples(filepath):
+    # returns the summary stats of the shadow process and of the plugin
+    # processes in its tree, and their per-sample totals for the series
+    with open_log(filepath, 'rb') as inf:
+        data = inf.read()
+
+    magic, interval, clk_tck, root_pid = PROCSAMPLER_HEADER.unpack_from(data)
+    assert magic == PROCSAMPLER_MAGIC, f"{filepath} is not a procsampler log"
+
+    samples = parse_proc_sample_records(memoryview(data)[PROCSAMPLER_HEADER.size:])
+    is_shadow = samples['pid'] == root_pid
+
+    # the records of a sample all have the same time
+    times, sample_index = numpy.unique(samples['time'], return_inverse=True)
+
+    series = {'time_sec': times}
+    stats = {'num_samples': len(times)}
+
+    # the pss is unknown if the sampler ran with --no_pss
+    names = ['rss', 'pss'] if (samples['pss'] != PSS_UNKNOWN).any() else ['rss']
+    for name in names:
+        values = samples[name].astype(numpy.int64)
+        values[samples[name] == PSS_UNKNOWN] = 0
+        for who, mask in [('shadow', is_shadow), ('plugins', ~is_shadow)]:
+            totals = numpy.bincount(sample_index[mask], weights=values[mask], minlength=len(times)).astype(numpy.int64)
+            series[f'{who}_{name}'] = totals
+            stats[f'{who}_{name}_max'] = totals.max().item() if len(totals) > 0 else 0
+
+    plugins_count = numpy.bincount(sample_index[~is_shadow], minlength=len(times))
+    series['plugins_count'] = plugins_count
+    stats['plugins_count_max'] = plugins_count.max().item() if len(plugins_count) > 0 else 0
+
+    # the cpu times and context switch counts only grow, so the total of a
+    # process is its last sampled value; the time a process ran after its last
+    # sample is missed, which is bounded by the sampling interval
+    cpu_ticks = samples['utime'] + samples['stime']
+    for who, mask in [('shadow', is_shadow), ('plugins', ~is_shadow)]:
+        stats[f'{who}_cpu_sec'] = sum_proc_max(samples['pid'][mask], cpu_ticks[mask]) / clk_tck
+        stats[f'{who}_voluntary_ctx_switches'] = sum_proc_max(samples['pid'][mask], samples['vcsw'][mask])
+        stats[f'{who}_involuntary_ctx_switches'] = sum_proc_max(samples['pid'][mask], samples['nvcsw'][mask])
+
+    return stats, series
+
+def parse_proc_sample_records(data):
+    # a partial record at the end, e.g., when the sampler was killed, is ignored
+    dtype = numpy.dtype([(name, f'<{code}') for name, code in zip(PROCSAMPLER_FIELDS, ['f8', 'u4', 'u4'] + ['u8']*6)])
+    assert dtype.itemsize == PROCSAMPLER_RECORD.size
+    return numpy.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+def sum_proc_max(pids, values):
+    # sums the max value of each pid
+    if len(pids) == 0:
+        return 0
+    order = numpy.argsort(pids, kind='stable')
+    pids, values = pids[order], values[order]
+    starts = numpy.flatnonzero(numpy.r_[True, pids[1:] != pids[:-1]])
+    return int(numpy.maximum.reduceat(values, starts).sum())
 
+def parse_free_log(filepath):
+    state = new_free_state()
+    with open_log(filepath, 'r') as inf:
+        parse_free_lines(inf, state)
+    return get_mem_used(state)
+
+def new_free_state():
+    return {'mem_used': {}, 'last_ts': None, 'mem_header': None}
+
+def parse_free_lines(lines, state):
+    mem_used = state['mem_used']
+    for line in lines:
+        if "+00" in line:
+            ts_str = line.strip().split('+')[0]
+            dt = datetime.datetime.strptime(ts_str, "%Y-%m-%d %H:%M:%S")
+            state['last_ts'] = dt.timestamp()
+        elif 'total' in line and state['mem_header'] == None:
+            state['mem_header'] = [p.strip() for p in line.strip().split()]
+        elif "Mem:" in line:
+            mem_header = state['mem_header']
+            parts = [p.strip() for p in line.strip().split()]
+            mem_counts = [int(p) for p in parts[1:]]
+
+            memd = {f"mem_{mem_header[i]}": mem_counts[i] for i in range(len(mem_counts))}
+            used = memd['mem_total'] - memd['mem_available']
+
+            mem_used.setdefault(state['last_ts'], used)
+
+def get_mem_used(state):
+    # the memory used by the simulation, relative to the least memory used
+    # while it was running
+    mem_used = dict(state['mem_used'])
     used_by_system = min(mem_used.values())
     for k in mem_used:
         mem_used[k] -= used_by_system
 
     return mem_used
 
-def get_stats(datal):
-    stats = {
-        'count': len(datal),
-        'sum': sum(datal),
-        'min': min(datal),
-        'max': max(datal),
-        'mean': mean(datal),
-        'median': median(datal),
-        'std': std(datal),
-        'var': var(datal),
-    }
-    for p in range(5, 100, 5):
-        stats[f'p{p}'] = percentile(datal, p)
-    return stats
-
 if __name__ == '__main__':
     sys.exit(main())
\ No newline at end of file
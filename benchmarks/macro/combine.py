@@ -3,21 +3,25 @@ import os
 import argparse
 import json
 
-from numpy import mean, median, std, var, percentile
+from collect_common import iter_results
+from results_db import open_results_db, write_records
+import stats_common
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("phase_number", type=int,)
     parser.add_argument("--data_dir", default="data")
+    parser.add_argument("--db", help="Also upsert the combined results into this sqlite database, as the source 'phase<N>'", default=None)
     args = parser.parse_args()
     run(args)
 
 def run(args):
     paths = []
 
-    for name in os.listdir(args.data_dir):
+    for name in sorted(os.listdir(args.data_dir)):
         path = os.path.join(args.data_dir, name)
-        if f'phase{args.phase_number}-' in name:
+        # skip the manifests that collect.py writes next to json lines output
+        if f'phase{args.phase_number}-' in name and name.endswith(('.json', '.jsonl')):
             paths.append(path)
 
     combined_results = combine(paths)
@@ -27,50 +31,112 @@ def run(args):
     with open(outname, 'w') as outf:
         json.dump(combined_results, outf, sort_keys=True, indent=2)
 
+    if args.db != None:
+        print(f"Saving combined results to {args.db}")
+        write_records(open_results_db(args.db), f'phase{args.phase_number}', combined_results)
+
 def combine(paths):
-    trials = [load(path) for path in paths]
-    return merge(trials)
+    return merge((load(path) for path in paths), trial_names=paths)
 
 def load(path):
-    with open(path, 'r') as inf:
-        return json.load(inf)
-
-def merge(trials):
-    combined_exps = []
-
-    for trial in trials:
+    # a generator, so that only one trial is in memory at a time
+    yield from iter_results(path)
+
+def merge(trials, trial_names=None):
+    # the combined experiments and the values of each of their trials, keyed
+    # by the frozen config of the experiment
+    combined_exps = {}
+    trial_values = {}
+    trial_keys = []
+
+    for i, trial in enumerate(trials):
+        name = trial_names[i] if trial_names != None else f'trial {i}'
+        keys = set()
         for exp in trial:
             filter_keys = ['args', 'cmd', 'label', 'seed']
             delete_keys(exp, filter_keys)
             delete_keys(exp['exe'], filter_keys)
-            if select(combined_exps, exp) == None:
-                combined_exps.append(copy_exp_metadata(exp))
 
-    for exp in combined_exps:
-        all_results = [select(trial, exp)['~results'] for trial in trials]
-        exp['~results'] = merge_results(all_results)
+            key = get_config_key(exp)
+            assert key not in keys, f"{name} has more than one experiment with config {format_config(exp)}"
+            keys.add(key)
+
+            if key not in combined_exps:
+                combined_exps[key] = copy_exp_metadata(exp)
+                trial_values[key] = []
+            trial_values[key].append(get_trial_values(exp['~results']))
+        trial_keys.append((name, keys))
+
+    # every config should have run in every trial
+    for name, keys in trial_keys:
+        missing = [key for key in combined_exps if key not in keys]
+        if len(missing) > 0:
+            print(f"{name} is missing {len(missing)} of {len(combined_exps)} configs, which are combined from the other trials:")
+            for key in missing:
+                print(f"    {format_config(combined_exps[key])}")
+
+    for key, exp in combined_exps.items():
+        exp['~results'] = merge_trial_values(trial_values[key])
+
+    return list(combined_exps.values())
 
-    return combined_exps
+def get_config_key(exp):
+    # hashable, and equal for configs whose fields are all equal
+    return freeze({k: exp[k] for k in exp if k != "~results"})
+
+def freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def format_config(exp):
+    return json.dumps({k: exp[k] for k in exp if k != "~results"}, sort_keys=True)
 
 def merge_results(results):
-    merged = {
-        'packets': get_stats([r['packets_per_second']['sum'] for r in results]),
-        'payload_gib': get_stats([r['bytes_per_second']['sum']/2**30 for r in results]),
-        'mem_used_gib': get_stats([max(r['mem_used'].values())/2**30 for r in results]),
-        'object_events': get_stats([get_value(r['objects'], "Event", "event_new") for r in results]),
-        'object_payloads': get_stats([get_value(r['objects'], "Payload", "payload_new") for r in results]),
-        'seconds_to_init': get_stats([r['seconds_to_init'] for r in results]),
-        'seconds_post_init': get_stats([r['perf']['duration-time-nanos']/10.0**9 - r['seconds_to_init'] for r in results]),
-        'syscalls': get_stats([sum(r['syscalls'].values()) for r in results]),
+    return merge_trial_values([get_trial_values(r) for r in results])
+
+def get_trial_values(r):
+    # the value of each combined metric in the results of a single trial
+    values = {
+        'packets': r['packets_per_second']['sum'],
+        'payload_gib': r['bytes_per_second']['sum']/2**30,
+        'mem_used_gib': get_mem_used_max(r)/2**30,
+        'object_events': get_value(r['objects'], "Event", "event_new"),
+        'object_payloads': get_value(r['objects'], "Payload", "payload_new"),
+        'seconds_to_init': r['seconds_to_init'],
+        'seconds_post_init': r['perf']['duration-time-nanos']/10.0**9 - r['seconds_to_init'],
+        'syscalls': sum(r['syscalls'].values()),
     }
 
-    for key in results[0]['perf'].keys():
+    for key in r['perf'].keys():
         if 'duration-time-nanos' in key:
-            merged[f'perf_duration-time-sec'] = get_stats([r['perf'][key]/10.0**9 for r in results])
+            values[f'perf_duration-time-sec'] = r['perf'][key]/10.0**9
         else:
-            merged[f'perf_{key}'] = get_stats([r['perf'][key] for r in results])
-
-    return merged
+            values[f'perf_{key}'] = r['perf'][key]
+
+    # only experiments that ran with procsampler.py have per-process stats
+    if 'procs' in r:
+        for who in ['shadow', 'plugins']:
+            values[f'{who}_rss_gib'] = r['procs'][f'{who}_rss_max']/2**30
+            if f'{who}_pss_max' in r['procs']:
+                values[f'{who}_pss_gib'] = r['procs'][f'{who}_pss_max']/2**30
+            values[f'{who}_cpu_sec'] = r['procs'][f'{who}_cpu_sec']
+
+    return values
+
+def merge_trial_values(trial_values):
+    # the stats of the metrics that all of the trials have
+    return {key: get_stats([values[key] for values in trial_values])
+        for key in trial_values[0] if all(key in values for values in trial_values)}
+
+def get_mem_used_max(r):
+    # older results store the whole mem_used time series instead of its max
+    if 'mem_used_max' in r:
+        return r['mem_used_max']
+    else:
+        return max(r['mem_used'].values())
 
 def get_value(d, key1, key2):
     if key1 in d:
@@ -82,43 +148,16 @@ def delete_keys(d, keys):
     for key in keys:
         del d[key]
 
-def select(exp_list, exp_find):
-    matched = []
-    for exp in exp_list:
-        keys_cmp = [k for k in exp if k != 'exe' and k != "~results"]
-        if match(exp, exp_find, keys_cmp) and \
-                match(exp['exe'], exp_find['exe'], exp['exe'].keys()):
-            matched.append(exp)
-    if len(matched) == 0:
-        return None
-    assert len(matched) == 1
-    return matched[0]
-    
-def match(da, db, keys):
-    for key in keys:
-        if da[key] != db[key]:
-            return False
-    return True
-
 def copy_exp_metadata(exp):
     d = {k: exp[k] for k in exp if k != 'exe' and k != "~results"}
     d['exe'] = {k: exp['exe'][k] for k in exp['exe']}
     return d
 
 def get_stats(datal):
-    stats = {
-        'count': len(datal),
-        #'sum': sum(datal),
-        'min': min(datal),
-        'max': max(datal),
-        'mean': mean(datal),
-        'median': median(datal),
-        'std': std(datal),
-        'var': var(datal),
-        #'values': datal,
-    }
-    #for p in range(5, 100, 5):
-    #    stats[f'p{p}'] = percentile(datal, p)
+    # the trial stats do not need the sum or the percentiles, but keep the
+    # values of the trials, in the order of the trials, for bootstrap CIs
+    stats = stats_common.get_stats(datal, with_sum=False, percentiles=[])
+    stats['values'] = list(datal)
     return stats
 
 if __name__ == '__main__':
@@ -15,4 +15,6 @@ docker run \
     --rm \
     --env RUNHOST="$(hostname)" \
     --env RUNUSRGRP="$(id -u):$(id -g)" \
+    --env MEM_INTERVAL="${MEM_INTERVAL:-0.1}" \
+    --env PROC_INTERVAL="${PROC_INTERVAL:-60}" \
     netsim:benchmark
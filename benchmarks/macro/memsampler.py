@@ -0,0 +1,117 @@
+import sys
+import os
+import argparse
+import struct
+import time
+import signal
+import select
+
+# Samples the system memory usage from /proc/meminfo, replacing the loop in
+# free_cmd.sh that forked `date` and `free` every second and logged text. The
+# samples are written as fixed-width binary records, which collect.py reads
+# with numpy instead of parsing text.
+
+MEMSAMPLER_FILENAME = 'mem.bin'
+
+MEMSAMPLER_MAGIC = b'NSMEMv01'
+
+# the /proc/meminfo fields in each record, in bytes
+MEMSAMPLER_FIELDS = ['MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached', 'Shmem', 'SwapTotal', 'SwapFree']
+
+MEMINFO_KEYS = [f'{name}:'.encode() for name in MEMSAMPLER_FIELDS]
+
+# magic, sampling interval in seconds, number of fields
+MEMSAMPLER_HEADER = struct.Struct('<8sdI4x')
+
+# wall clock time in seconds since the epoch, then the fields
+MEMSAMPLER_RECORD = struct.Struct('<d' + 'Q'*len(MEMSAMPLER_FIELDS))
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', "--output",
+        help="Path to the binary file to which the samples are written",
+        default=MEMSAMPLER_FILENAME
+    )
+    parser.add_argument('-i', "--interval",
+        help="Number of seconds between two samples, e.g., 0.01 to catch short memory peaks",
+        type=float,
+        default=0.1
+    )
+    parser.add_argument("--flush_interval",
+        help="Number of seconds between two writes of the buffered samples to the output file",
+        type=float,
+        default=1.0
+    )
+    args = parser.parse_args()
+    run(args)
+
+def run(args):
+    # a kill only stops the loop after the current sample, instead of exiting
+    # in the middle of a write, so the output only has whole records and all of
+    # the buffered samples are written
+    stop = []
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda signum, frame: stop.append(signum))
+    # python resumes a time.sleep that a signal interrupted, so we wait on a
+    # pipe instead, to which the signals are also written, to wake up at once
+    wakeup_fd = get_signal_wakeup_fd()
+
+    # reading the open file again at offset 0 makes the kernel regenerate it,
+    # so every sample costs a single syscall
+    fd = os.open('/proc/meminfo', os.O_RDONLY)
+    positions = []
+
+    with open(args.output, 'wb') as outf:
+        outf.write(MEMSAMPLER_HEADER.pack(MEMSAMPLER_MAGIC, args.interval, len(MEMSAMPLER_FIELDS)))
+        outf.flush()
+
+        records = []
+        next_sample = time.monotonic()
+        next_flush = next_sample + args.flush_interval
+
+        try:
+            while len(stop) == 0:
+                values = parse_meminfo(os.pread(fd, 2**14, 0), positions)
+                records.append(MEMSAMPLER_RECORD.pack(time.time(), *values))
+
+                now = time.monotonic()
+                if now >= next_flush:
+                    # the records are taken out of the buffer first, so that
+                    # they are never written twice
+                    flushed, records = records, []
+                    outf.write(b''.join(flushed))
+                    outf.flush()
+                    next_flush = now + args.flush_interval
+
+                next_sample += args.interval
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    select.select([wakeup_fd], [], [], delay)
+                else:
+                    # we fell behind, so skip the missed samples instead of bursting
+                    next_sample = time.monotonic()
+        finally:
+            outf.write(b''.join(records))
+            os.close(fd)
+
+def get_signal_wakeup_fd():
+    # returns the read end of a pipe that becomes readable when a signal arrives
+    rfd, wfd = os.pipe()
+    os.set_blocking(wfd, False)
+    signal.set_wakeup_fd(wfd)
+    return rfd
+
+def parse_meminfo(data, positions):
+    # returns the values of the fields in bytes; positions caches the index of
+    # each value in the whitespace-separated tokens, since the layout of
+    # /proc/meminfo does not change while the system is running
+    tokens = data.split()
+    if len(positions) == 0 or any(tokens[i-1] != key for key, i in zip(MEMINFO_KEYS, positions)):
+        index = {token: i+1 for i, token in enumerate(tokens) if token in MEMINFO_KEYS}
+        missing = [name for name, key in zip(MEMSAMPLER_FIELDS, MEMINFO_KEYS) if key not in index]
+        assert len(missing) == 0, f"/proc/meminfo has no {', '.join(missing)} field, which older kernels do not report"
+        positions[:] = [index[key] for key in MEMINFO_KEYS]
+    return [int(tokens[i]) * 1024 for i in positions]
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import numpy
+
+from collect_common import load_results
+from stats_common import compute_mean_and_error_arrays, compute_bootstrap_ci_arrays
+
+# Pivots the experiments of a phase file once into a dense numpy array with
+# one axis per config field that varies across the experiments, followed by a
+# metric axis and a stat axis. Selecting the results of a config, or of a whole
+# line of configs, is then an index into the array instead of a scan over all
+# experiments with a query predicate per experiment. If the phase file has the
+# values of the trials of each experiment, they are kept in a second array with
+# a trial axis instead of the stat axis, from which the bootstrap CIs of every
+# metric of every experiment are computed together.
+
+# the name by which a config field is selected, and its path in an experiment
+CUBE_FIELDS = [
+    ('msgload', ['exe', 'msgload']),
+    ('cpuload', ['exe', 'cpuload']),
+    ('quantity', ['exe', 'quantity']),
+    ('weights', ['exe', 'weights']),
+    ('interpose_method', ['interpose_method']),
+    ('num_workers', ['num_workers']),
+    ('scheduling_policy', ['scheduling_policy']),
+    ('use_memory_manager', ['use_memory_manager']),
+    ('use_pinning', ['use_pinning']),
+    ('use_realtime', ['use_realtime']),
+    ('use_syscall_preloading', ['use_syscall_preloading']),
+    ('use_shim_syscall_handler', ['use_shim_syscall_handler']),
+    ('use_syscall_counters', ['use_syscall_counters']),
+    ('use_single_core', ['use_single_core']),
+    ('use_logging', ['use_logging']),
+]
+
+CUBE_STATS = ['count', 'mean', 'median', 'min', 'max', 'std', 'var']
+
+def load_metric_cube(filepath):
+    return build_metric_cube(load_results(filepath))
+
+def get_field(record, path):
+    for key in path:
+        if not isinstance(record, dict) or key not in record:
+            return None
+        record = record[key]
+    return record
+
+def build_metric_cube(records, fields=CUBE_FIELDS, stats=CUBE_STATS):
+    configs = [{name: get_field(record, path) for name, path in fields} for record in records]
+
+    # fields with a single value are not axes, but are still checked on select
+    axes, labels, constants = [], {}, {}
+    for name, _ in fields:
+        values = []
+        for config in configs:
+            if config[name] not in values:
+                values.append(config[name])
+        if len(values) > 1:
+            axes.append(name)
+            labels[name] = values
+        elif len(values) == 1:
+            constants[name] = values[0]
+
+    metrics = []
+    for record in records:
+        for key, value in record['~results'].items():
+            if isinstance(value, dict) and key not in metrics:
+                metrics.append(key)
+
+    index = {name: {value: i for i, value in enumerate(labels[name])} for name in axes}
+    shape = [len(labels[name]) for name in axes]
+    values = numpy.full(shape + [len(metrics), len(stats)], numpy.nan)
+    counts = numpy.zeros(shape, dtype=numpy.int64)
+
+    # phase files from before combine.py kept the trial values have none
+    num_trials = max((len(result['values']) for record in records for result in record['~results'].values()
+        if isinstance(result, dict) and 'values' in result), default=0)
+    trials = numpy.full(shape + [len(metrics), num_trials], numpy.nan) if num_trials > 0 else None
+
+    for record, config in zip(records, configs):
+        cell = tuple(index[name][config[name]] for name in axes)
+        counts[cell] += 1
+        for i, metric in enumerate(metrics):
+            result = record['~results'].get(metric)
+            if result != None:
+                values[cell + (i,)] = [result.get(stat, numpy.nan) for stat in stats]
+                if trials is not None and 'values' in result:
+                    trials[cell + (i, slice(0, len(result['values'])))] = result['values']
+
+    return {
+        'axes': axes,
+        'labels': labels,
+        'constants': constants,
+        'index': index,
+        'metrics': metrics,
+        'metric_index': {metric: i for i, metric in enumerate(metrics)},
+        'stats': stats,
+        'stat_index': {stat: i for i, stat in enumerate(stats)},
+        'values': values,
+        'trials': trials,
+        'counts': counts,
+        # the bootstrap CIs, by (method, confidence level), computed on demand
+        'bootstrap': {},
+    }
+
+def select_cells(cube, query):
+    # returns the index of the cell of the single experiment that matches the
+    # query, where a list of values for a field selects a line of cells; like
+    # a query predicate, the fields that are not in the query match any value,
+    # so exactly one experiment must match each point of the selection
+    field_names = [name for name, _ in CUBE_FIELDS]
+    for name, value in query.items():
+        assert name in field_names, f"'{name}' is not a config field, use one of {', '.join(field_names)}"
+        if name in cube['constants']:
+            values = value if isinstance(value, list) else [value]
+            assert all(v == cube['constants'][name] for v in values), f"no experiment has {name}={value}"
+
+    selected, free = [], []
+    for axis in cube['axes']:
+        index = cube['index'][axis]
+        if axis in query:
+            value = query[axis]
+            values = value if isinstance(value, list) else [value]
+            assert all(v in index for v in values), f"no experiment has {axis}={value}"
+            selected.append((axis, numpy.array([index[v] for v in values]), isinstance(value, list)))
+        else:
+            free.append(axis)
+
+    # the counts of the selected points (first) over all cells of the free axes (last)
+    arrays = [a for _, a, _ in selected] + [numpy.arange(len(cube['index'][axis])) for axis in free]
+    order = [cube['axes'].index(axis) for axis, _, _ in selected] + [cube['axes'].index(axis) for axis in free]
+    counts = cube['counts'].transpose(order)[numpy.ix_(*arrays)] if len(arrays) > 0 else cube['counts']
+    counts = counts.reshape(counts.shape[:len(selected)] + (-1,))
+
+    matches = counts.sum(axis=-1)
+    assert (matches == 1).all(), f"expected exactly 1 experiment to match {query}, found {sorted(set(matches.flatten().tolist()))}"
+
+    free_shape = [len(cube['index'][axis]) for axis in free]
+    free_cells = numpy.unravel_index(counts.argmax(axis=-1), free_shape) if len(free) > 0 else ()
+
+    # one index array per axis, all with the shape of the selection
+    cell = [None] * len(cube['axes'])
+    grid = numpy.meshgrid(*[a for _, a, _ in selected], indexing='ij') if len(selected) > 0 else []
+    for (axis, _, _), a in zip(selected, grid):
+        cell[cube['axes'].index(axis)] = a
+    for axis, a in zip(free, free_cells):
+        cell[cube['axes'].index(axis)] = a
+
+    # drop the dimensions of the fields that were selected with a single value
+    keep = tuple(slice(None) if is_list else 0 for _, _, is_list in selected)
+    return tuple(a[keep] for a in cell)
+
+def get_metric_stats(cube, metric, query, stats=('count', 'mean', 'std')):
+    # returns an array of each stat of the metric over the selection
+    cell = select_cells(cube, query)
+    m = cube['metric_index'][metric]
+    return {stat: cube['values'][cell + (m, cube['stat_index'][stat])] for stat in stats}
+
+def select_results(cube, **query):
+    # the '~results' of the single experiment that matches the query, with the
+    # stats of every metric that the experiment has
+    cell = select_cells(cube, query)
+    values = cube['values'][cell]
+    results = {}
+    for i, metric in enumerate(cube['metrics']):
+        if numpy.isnan(values[i]).all():
+            continue
+        results[metric] = {stat: get_stat_value(stat, v) for stat, v in zip(cube['stats'], values[i].tolist()) if v == v}
+        if cube['trials'] is not None:
+            trials = cube['trials'][cell + (i,)]
+            results[metric]['values'] = trials[~numpy.isnan(trials)].tolist()
+    return results
+
+def get_stat_value(stat, value):
+    return int(value) if stat == 'count' else value
+
+def get_bootstrap_cis(cube, method, confidence_level):
+    # the lower and upper CI bounds of the mean of every metric of every
+    # experiment, with a bound axis of size 2 after the metric axis
+    key = (method, confidence_level)
+    if key not in cube['bootstrap']:
+        assert cube['trials'] is not None, "the phase file has no trial values, rerun combine.py to bootstrap"
+        _, lower, upper = compute_bootstrap_ci_arrays(cube['trials'], confidence_level, method)
+        cube['bootstrap'][key] = numpy.stack([lower, upper], axis=-1)
+    return cube['bootstrap'][key]
+
+def compute_cube_means_and_errors(cube, metric, query, confidence_level=0.99, method='t'):
+    # same as plot_common.compute_means_and_errors, for a line of configs
+    s = get_metric_stats(cube, metric, query)
+    if method == 't':
+        m, e = compute_mean_and_error_arrays(s['count'], s['mean'], s['std'], confidence_level)
+        return m.tolist(), e.tolist()
+
+    # asymmetric errors, as the [lower, upper] rows of a matplotlib yerr
+    cell = select_cells(cube, query)
+    bounds = get_bootstrap_cis(cube, method, confidence_level)[cell + (cube['metric_index'][metric],)]
+    m = s['mean']
+    return m.tolist(), [(m - bounds[..., 0]).tolist(), (bounds[..., 1] - m).tolist()]
@@ -0,0 +1,172 @@
+import sys
+import os
+import json
+import time
+import argparse
+import importlib
+import subprocess
+import tempfile
+
+# A single entry point for the analysis scripts, e.g.:
+#   python3 netsim_analyze.py collect -i exps1/phase6 -o phase6-1
+#   python3 netsim_analyze.py combine 6
+#   python3 netsim_analyze.py plot 6 --processes 4
+#   python3 netsim_analyze.py stats --db results.db
+#   python3 netsim_analyze.py query --source phase6 --metric mem_used_gib num_workers=28
+#
+# The collect, combine, stats and plot subcommands run the main function of
+# the script with the remaining arguments. A script is only imported once its
+# subcommand was chosen, so that e.g. a query never pays for the matplotlib or
+# scipy imports of the plot scripts. `startup` measures how long the stats and
+# query subcommands take to run, and fails if that is over a budget.
+
+# subcommand -> the script that runs it
+SCRIPT_COMMANDS = {
+    'collect': 'collect',
+    'combine': 'combine',
+    'stats': 'stats_phase6',
+}
+
+# modules that take a large part of a second to import, which the fast
+# subcommands must not import before they do any work
+HEAVY_MODULES = ['matplotlib', 'scipy', 'tinydb']
+
+# the subcommands whose startup time is checked, with the arguments that they
+# are run with: stats only parses its arguments, since the phase files may not
+# exist, and query lists the sources of an empty database ({db})
+STARTUP_COMMANDS = {
+    'stats': ['stats', '--help'],
+    'query': ['query', '--db', '{db}', '--list_sources'],
+}
+# the maximum number of seconds from the start of the interpreter until the
+# subcommand is done
+STARTUP_BUDGET_SEC = 0.5
+
+def main():
+    # argparse does not pass options like --help through to a REMAINDER, so
+    # the arguments of the scripts are split off before parsing
+    argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] in SCRIPT_COMMANDS:
+        return run_script(SCRIPT_COMMANDS[argv[0]], argv[1:])
+    if len(argv) > 1 and argv[0] == 'plot' and argv[1] in [str(phase) for phase in range(1, 7)]:
+        return run_script(f'plot_phase{argv[1]}', argv[2:])
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, script in SCRIPT_COMMANDS.items():
+        # the script parses its own arguments, including --help
+        p = subparsers.add_parser(command, add_help=False, help=f"Run {script}.py with the remaining arguments")
+        p.add_argument('args', nargs=argparse.REMAINDER)
+
+    p = subparsers.add_parser('plot', help="Run plot_phase<PHASE>.py with the remaining arguments")
+    p.add_argument('phase', type=int, choices=range(1, 7))
+    p.add_argument('args', nargs=argparse.REMAINDER)
+
+    p = subparsers.add_parser('query', formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Print the experiments (or one metric of them) that match config fields, from a results database")
+    p.add_argument('config', nargs='*', metavar='FIELD=VALUE',
+        help="Config fields to match, e.g., interpose_method=ptrace num_workers=28; values are parsed as json if possible")
+    p.add_argument("--db", help="Path to the sqlite results database (see collect.py --db)", default='results.db')
+    p.add_argument("--source", help="Only match the experiments of this source, e.g., phase6 or phase6-1", default=None)
+    p.add_argument("--metric", help="Only print this metric of each experiment", default=None)
+    p.add_argument("--stat", help="The stat of the metric to print", default='mean')
+    p.add_argument("--list_sources", help="Only print the sources in the database", action='store_true')
+
+    p = subparsers.add_parser('startup', formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help=f"Check that the {' and '.join(STARTUP_COMMANDS)} subcommands start within a time budget")
+    p.add_argument("--budget", help="Maximum startup time in seconds", type=float, default=STARTUP_BUDGET_SEC)
+    p.add_argument("--repeat", help="Number of times each subcommand is run; the fastest one counts", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'query':
+        return run_query(args)
+    elif args.command == 'startup':
+        return run_startup_check(args)
+
+def run_script(script, argv):
+    module = importlib.import_module(script)
+    sys.argv = [f'{script}.py'] + argv
+    return module.main()
+
+def parse_config_value(s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        return s
+
+def run_query(args):
+    # imported here, so that the other subcommands do not import sqlite3
+    results_db = importlib.import_module('results_db')
+    if not os.path.exists(args.db):
+        print(f"No results database at {args.db}", file=sys.stderr)
+        return 1
+    db = results_db.open_results_db(args.db)
+
+    if args.list_sources:
+        for source in results_db.get_sources(db):
+            print(source)
+        return 0
+
+    config = {}
+    for item in args.config:
+        name, sep, value = item.partition('=')
+        if sep == '':
+            print(f"Expected FIELD=VALUE, got '{item}'", file=sys.stderr)
+            return 1
+        config[name] = parse_config_value(value)
+
+    try:
+        if args.metric != None:
+            for config_key, value in results_db.select_metric(db, args.metric, args.stat, source=args.source, **config):
+                print(json.dumps({'config': json.loads(config_key), args.metric: {args.stat: value}}, sort_keys=True))
+        else:
+            for record in results_db.select_records(db, source=args.source, **config):
+                print(json.dumps(record, sort_keys=True))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+def run_startup_check(args):
+    script = os.path.abspath(__file__)
+    failed = False
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # an empty file is an empty sqlite database
+        db = os.path.join(tmpdir, 'results.db')
+        open(db, 'wb').close()
+
+        for command, command_argv in STARTUP_COMMANDS.items():
+            argv = [a.format(db=db) for a in command_argv]
+            timings, heavy = time_command(script, argv, args.repeat)
+
+            ok = min(timings) <= args.budget and len(heavy) == 0
+            failed = failed or not ok
+            print(f"{command}: {'ok' if ok else 'FAILED'}, ran in {min(timings):.3f} seconds "
+                f"(median {sorted(timings)[len(timings)//2]:.3f}, budget {args.budget:.3f})"
+                + (f", imported {', '.join(heavy)}" if len(heavy) > 0 else ''))
+
+    return 1 if failed else 0
+
+def time_command(script, argv, repeat):
+    # runs the subcommand like the netsim-analyze wrapper does, through main,
+    # from the start of the interpreter, so that the python startup, the
+    # argument parsing and the imports of the subcommand are all measured
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script] + argv,
+            stdout=subprocess.DEVNULL, check=True, cwd=os.path.dirname(script))
+        timings.append(time.perf_counter() - start)
+
+    # one more run that lists its imports, which would slow down the timed runs
+    err = subprocess.run([sys.executable, '-X', 'importtime', script] + argv,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True, cwd=os.path.dirname(script)).stderr
+    imported = {line.rsplit(b'|', 1)[-1].strip().decode().split('.')[0] for line in err.splitlines()}
+    heavy = sorted(name for name in HEAVY_MODULES if name in imported)
+    return timings, heavy
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import sys
+import os
+import ast
+import glob
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Runs the collect -> combine -> plot -> stats steps of the macro benchmarks
+# as a dependency graph, instead of running every script by hand. Each stage
+# is hashed over the code of its scripts, its parameters, and its inputs, and
+# is skipped if its outputs exist and were produced from the same hash. The
+# phases are independent, so the stages of different phases run concurrently.
+#
+# For phase N and trial T (the T-th of the --trials directories):
+#   collect N-T: <trial>/phaseN -> DATA_DIR/phaseN-T.json
+#   combine N: DATA_DIR/phaseN-*.json -> phaseN.json
+#   plot N: phaseN.json -> the figures, where the figures of the all-metrics
+#       sweeps are also skipped individually (see plot_pool.py)
+#   stats: phase6.json -> stats_phase6.txt
+#
+# The stages run in the directory of this script, like the scripts are run by
+# hand, so the phase files, figures and state are written there wherever the
+# pipeline is started from.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PIPELINE_STATE_FILENAME = '.pipeline_state.json'
+PIPELINE_FIGURE_CACHE_DIR = '.pipeline_figures'
+
+PHASES = [1, 2, 3, 4, 5, 6]
+
+# the script that each kind of stage runs
+STAGE_SCRIPTS = {
+    'collect': 'collect.py',
+    'combine': 'combine.py',
+    'plot': 'plot_phase{phase}.py',
+    'stats': 'stats_phase6.py',
+}
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-t', "--trials",
+        help="Paths to the experiment directories of the trials, e.g., exps1 exps2 exps3, each with a phase[1-6] subdirectory; without trials, the collected phaseN-T.json files in DATA_DIR are combined as they are",
+        nargs='*',
+        default=[]
+    )
+    parser.add_argument('-d', "--data_dir",
+        help="Directory of the collected phaseN-T.json files of the trials (default: the directory of this script)",
+        default=None
+    )
+    parser.add_argument('-p', "--phases",
+        help="The phases to run",
+        type=int,
+        nargs='+',
+        default=PHASES
+    )
+    parser.add_argument('-j', "--jobs",
+        help="Number of cores to use; the phases run concurrently and split the cores among them",
+        type=int,
+        default=os.cpu_count() or 1
+    )
+    parser.add_argument("--state",
+        help=f"Path to the json file in which the hashes of the stages are recorded (default: {PIPELINE_STATE_FILENAME} in the directory of this script)",
+        default=None
+    )
+    parser.add_argument("--force",
+        help="Run every stage, even if its inputs are unchanged",
+        action='store_true'
+    )
+    parser.add_argument('-n', "--dry_run",
+        help="Only print the stages that would run",
+        action='store_true'
+    )
+    args = parser.parse_args()
+
+    # the paths on the command line are relative to where the pipeline was
+    # started, and all others to the directory of this script
+    args.trials = [os.path.abspath(path) for path in args.trials]
+    args.data_dir = os.path.abspath(args.data_dir) if args.data_dir != None else BENCHMARK_DIR
+    args.state = os.path.abspath(args.state) if args.state != None else get_path(PIPELINE_STATE_FILENAME)
+
+    return run(args)
+
+def run(args):
+    state = load_state(args.state)
+    lock = threading.Lock()
+
+    # the cores of each phase, for its collect workers and plot processes
+    cores = max(1, args.jobs // len(args.phases))
+
+    with ThreadPoolExecutor(max_workers=len(args.phases)) as executor:
+        futures = [executor.submit(run_phase, args, phase, cores, state, lock) for phase in args.phases]
+        failed = [phase for phase, future in zip(args.phases, futures) if not future.result()]
+
+    if len(failed) > 0:
+        print(f"Failed phases: {', '.join(str(phase) for phase in failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+def run_phase(args, phase, cores, state, lock):
+    # returns True if all stages of the phase succeeded or were unchanged
+    ran = False
+    for i, trial_dir in enumerate(args.trials):
+        prefix = os.path.join(args.data_dir, f'phase{phase}-{i+1}')
+        stage = {
+            'name': f'collect {phase}-{i+1}',
+            'cmd': ['python3', 'collect.py', '-i', os.path.join(trial_dir, f'phase{phase}'), '-o', prefix],
+            'jobs': ['-j', str(cores)],
+            'code': get_code_paths(STAGE_SCRIPTS['collect']),
+            'inputs': [get_dir_manifest_digest(os.path.join(trial_dir, f'phase{phase}'))],
+            'outputs': [f'{prefix}.json'],
+        }
+        ran = run_stage(args, stage, state, lock, ran)
+        if ran == None:
+            return False
+
+    trial_paths = get_trial_paths(args.data_dir, phase)
+    if len(trial_paths) == 0 and args.dry_run and ran:
+        return True
+    if len(trial_paths) == 0:
+        print(f"No collected trials of phase {phase} in {args.data_dir}, skipping it", file=sys.stderr)
+        return True
+
+    stage = {
+        'name': f'combine {phase}',
+        'cmd': ['python3', 'combine.py', '--data_dir', args.data_dir, str(phase)],
+        'code': get_code_paths(STAGE_SCRIPTS['combine']),
+        'inputs': [get_files_digest(trial_paths)],
+        'outputs': [f'phase{phase}.json'],
+    }
+    ran = run_stage(args, stage, state, lock, ran)
+    if ran == None:
+        return False
+
+    # the plot stage runs whenever the phase changed, and the plot script
+    # itself skips the sweep figures whose own inputs are unchanged
+    figure_cache = os.path.join(PIPELINE_FIGURE_CACHE_DIR, f'phase{phase}.json')
+    stage = {
+        'name': f'plot {phase}',
+        'cmd': ['python3', f'plot_phase{phase}.py', '--figure_cache', figure_cache],
+        'jobs': ['--processes', str(cores)],
+        'code': get_code_paths(STAGE_SCRIPTS['plot'].format(phase=phase)),
+        'inputs': [get_files_digest([f'phase{phase}.json'])],
+        'outputs': [figure_cache],
+    }
+    ran = run_stage(args, stage, state, lock, ran)
+    if ran == None:
+        return False
+
+    if phase == 6:
+        stage = {
+            'name': 'stats',
+            'cmd': ['python3', 'stats_phase6.py'],
+            'stdout': 'stats_phase6.txt',
+            'code': get_code_paths(STAGE_SCRIPTS['stats']),
+            'inputs': [get_files_digest(['phase6.json'])],
+            'outputs': ['stats_phase6.txt'],
+        }
+        ran = run_stage(args, stage, state, lock, ran)
+        if ran == None:
+            return False
+
+    return True
+
+def run_stage(args, stage, state, lock, upstream_ran=False):
+    # returns whether this stage (or one before it) ran, or None if it failed
+    digest = get_stage_digest(stage)
+    with lock:
+        unchanged = state.get(stage['name']) == digest and all(os.path.exists(get_path(path)) for path in stage['outputs'])
+
+    # in a dry run, the outputs of the stages before it did not change yet
+    if unchanged and not args.force and not (args.dry_run and upstream_ran):
+        print(f"[{stage['name']}] unchanged, skipping")
+        return upstream_ran
+
+    # the number of processes is not part of the digest, since the outputs
+    # do not depend on it
+    cmd = stage['cmd'] + stage.get('jobs', [])
+    print(f"[{stage['name']}] running {' '.join(cmd)}")
+    if args.dry_run:
+        return True
+
+    if 'stdout' in stage:
+        with open(get_path(stage['stdout']), 'w') as outf:
+            rc = subprocess.run(cmd, stdout=outf, cwd=BENCHMARK_DIR).returncode
+    else:
+        rc = subprocess.run(cmd, cwd=BENCHMARK_DIR).returncode
+
+    if rc != 0:
+        print(f"[{stage['name']}] failed with exit code {rc}", file=sys.stderr)
+        return None
+
+    # only a stage that succeeded is recorded, so a failed stage runs again
+    with lock:
+        state[stage['name']] = digest
+        save_state(args.state, state)
+    return True
+
+def get_stage_digest(stage):
+    h = hashlib.sha256()
+    h.update(json.dumps(stage['cmd']).encode())
+    h.update(get_files_digest(stage['code']).encode())
+    for digest in stage['inputs']:
+        h.update(digest.encode())
+    return h.hexdigest()
+
+def get_path(path):
+    # a path of the stages, relative to the directory of this script
+    return os.path.join(BENCHMARK_DIR, path)
+
+def get_code_paths(script):
+    # the script and the modules of this directory that it imports, directly
+    # or through other modules, read from their import statements so that the
+    # code of a stage is never missing a module that it runs
+    paths, pending = [], [script]
+    while len(pending) > 0:
+        path = pending.pop()
+        if path in paths:
+            continue
+        paths.append(path)
+        with open(get_path(path), 'r') as inf:
+            tree = ast.parse(inf.read(), filename=path)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            pending += [f'{name}.py' for name in names if os.path.exists(get_path(f'{name}.py'))]
+    return [script] + sorted(paths[1:])
+
+def get_files_digest(paths):
+    # the digest of the names and contents of the files, where a file that
+    # does not exist yet, e.g., in a dry run, has no content
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.encode())
+        if not os.path.exists(get_path(path)):
+            h.update(b'\0')
+            continue
+        with open(get_path(path), 'rb') as inf:
+            for chunk in iter(lambda: inf.read(2**20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+def get_dir_manifest_digest(dirpath):
+    # the raw experiment logs are far too large to hash, so a trial directory
+    # is hashed over the path, size and modification time of its files, which
+    # is also what collect.py keys its parse cache on
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(dirpath):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            h.update(f'{os.path.relpath(path, dirpath)}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+    return h.hexdigest()
+
+def get_trial_paths(data_dir, phase):
+    # the same files that combine.py reads
+    paths = glob.glob(os.path.join(data_dir, f'phase{phase}-*.json')) + \
+        glob.glob(os.path.join(data_dir, f'phase{phase}-*.jsonl'))
+    return sorted(paths)
+
+def load_state(filepath):
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as inf:
+        return json.load(inf)
+
+def save_state(filepath, state):
+    tmp_path = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as outf:
+        json.dump(state, outf, sort_keys=True, indent=2)
+    os.replace(tmp_path, filepath)
+
+if __name__ == '__main__':
+    sys.exit(main())
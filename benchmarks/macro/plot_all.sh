@@ -1,7 +1,19 @@
-python plot_phase1.py
-python plot_phase2.py
-python plot_phase3.py
-python plot_phase4.py
-python plot_phase5.py
-python plot_phase6.py
-python stats_phase6.py > stats_phase6.txt
+# the phases are independent, so plot them all at once, and split the cores
+# among them for the figures of their all-metrics sweeps
+processes=$(( ($(nproc) + 5) / 6 ))
+
+pids=""
+for phase in 1 2 3 4 5 6
+do
+    python plot_phase${phase}.py --processes ${processes} &
+    pids="${pids} $!"
+done
+python stats_phase6.py > stats_phase6.txt &
+pids="${pids} $!"
+
+status=0
+for pid in ${pids}
+do
+    wait ${pid} || status=1
+done
+exit ${status}
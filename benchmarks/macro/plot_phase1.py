@@ -1,20 +1,32 @@
 import sys
 import os
 import json
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results, compute_cube_means_and_errors
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase1.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
+    )
+    args = parser.parse_args()
+
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube("phase1.json")
 
     set_plot_options(grid='both')
     
@@ -30,14 +42,25 @@ def main():
         ncol=3, ymax=2.5*10**6, ylabel="Page Faults")
 
     # all of the results for analysis
-    plot_all_phase1_metrics(db, 'uniform')
-    plot_all_phase1_metrics(db, 'skewed')
+    plot_all_phase1_metrics(db, 'uniform', processes=args.processes, figure_cache=args.figure_cache)
+    plot_all_phase1_metrics(db, 'skewed', processes=args.processes, figure_cache=args.figure_cache)
+
+    report_peak_rss('plot_phase1.py')
 
-def plot_all_phase1_metrics(db, ew):
+def plot_all_phase1_metrics(db, ew, processes=None, figure_cache=None):
     metric_keys = select(db, ew='skewed', im='ptrace', nw=35, usp=True).keys()
+    jobs = []
     for metric_key in metric_keys:
-        plot_phase1_metric(db, ew, metric_key, 
-            title=ew, ylabel=metric_key.replace('_', '-'), dir='phase1_metrics')
+        dir = 'phase1_metrics'
+        jobs.append(([get_phase1_metric_filename(metric_key, ew, dir)], plot_phase1_metric, (ew, metric_key),
+            dict(title=ew, ylabel=metric_key.replace('_', '-'), dir=dir)))
+    render_figures(db, jobs, processes, figure_cache)
+
+def get_phase1_metric_filename(metric_key, ew, dir=None):
+    filename = f"phold-phase1-{metric_key.replace('_', '-')}-{ew}.pdf"
+    if dir != None:
+        filename = os.path.join(dir, filename)
+    return filename
 
 def plot_phase1_metric(db, ew, metric_key, 
         title=None, ncol=1, dir=None,
@@ -50,72 +73,60 @@ def plot_phase1_metric(db, ew, metric_key,
 
     x_threads = [7, 14, 21, 28, 35, 42, 49, 56]
 
-    pyplot.figure()
-
-    for i, (im, usp) in enumerate(methods):
-        y_vals, y_errs = [], []
-
-        for nw in x_threads:
-            result = select(db, ew=ew, im=im, nw=nw, usp=usp)
-            m, e = compute_mean_and_error(result[metric_key])
-            y_vals.append(m)
-            y_errs.append(e)
-
-        pyplot.errorbar(x_threads, y_vals, yerr=y_errs,
-            label=names[i], color=colors[i], fmt=formats[i],
-            capsize=3.0, linewidth=1.0)
-
-    pyplot.xticks(x_threads)
-    if yticks != None:
-        pyplot.yticks(yticks)
-
-    if yscale != None:
-        pyplot.yscale(yscale)
-    if ymin != None:
-        pyplot.ylim(ymin=ymin)
-    if ymax != None:
-        pyplot.ylim(ymax=ymax)
-    if ylabel != None:
-        if ylabel_ralign:
-            pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
+    with render_figure(get_phase1_metric_filename(metric_key, ew, dir)):
+        for i, (im, usp) in enumerate(methods):
+            y_vals, y_errs = compute_cube_means_and_errors(db, metric_key, get_query(ew=ew, im=im, nw=x_threads, usp=usp))
+
+            pyplot.errorbar(x_threads, y_vals, yerr=y_errs,
+                label=names[i], color=colors[i], fmt=formats[i],
+                capsize=3.0, linewidth=1.0)
+
+        pyplot.xticks(x_threads)
+        if yticks != None:
+            pyplot.yticks(yticks)
+
+        if yscale != None:
+            pyplot.yscale(yscale)
+        if ymin != None:
+            pyplot.ylim(ymin=ymin)
+        if ymax != None:
+            pyplot.ylim(ymax=ymax)
+        if ylabel != None:
+            if ylabel_ralign:
+                pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
+            else:
+                pyplot.ylabel(ylabel)
+        pyplot.xlabel('Logical Processors Count')
+
+        if title != None:
+            pyplot.title(title)
+
+        if bbox != None:
+            pyplot.legend(ncol=ncol, loc='upper left', bbox_to_anchor=bbox)
         else:
-            pyplot.ylabel(ylabel)
-    pyplot.xlabel('Logical Processors Count')
-
-    if title != None:
-        pyplot.title(title)
+            pyplot.legend(ncol=ncol)
+        pyplot.tight_layout(pad=0.3)
 
-    if bbox != None:
-        pyplot.legend(ncol=ncol, loc='upper left', bbox_to_anchor=bbox)
-    else:
-        pyplot.legend(ncol=ncol)
-    pyplot.tight_layout(pad=0.3)
-
-    filename = f"phold-phase1-{metric_key.replace('_', '-')}-{ew}.pdf"
-    if dir != None:
-        os.makedirs(dir, exist_ok = True)
-        filename = os.path.join(dir, filename)
-    pyplot.savefig(filename)
+        if dir != None:
+            os.makedirs(dir, exist_ok = True)
 
 def select(db, ew, im, nw, usp):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.msgload == 100) &
-        (exp.exe.quantity == 1000) &
-        (exp.exe.weights == ew) &
-        (exp.interpose_method == im) &
-        (exp.num_workers == nw) &
-        (exp.scheduling_policy == 'host') &
-        (exp.use_memory_manager == (None if im == 'classic' else True)) &
-        (exp.use_pinning == True) &
-        (exp.use_realtime == False) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else usp))
+    return select_results(db, **get_query(ew, im, nw, usp))
+
+def get_query(ew, im, nw, usp):
+    # nw may also be a list, to select the line of configs over its values
+    return dict(
+        msgload=100,
+        quantity=1000,
+        weights=ew,
+        interpose_method=im,
+        num_workers=nw,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else usp)
     )
 
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
-
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -1,20 +1,35 @@
 import sys
 import os
 import json
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results, compute_cube_means_and_errors
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
+
+# one figure per method
+PHASE2_METHODS = ['ptrace', 'seccomp', 'classic']
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase2.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
+    )
+    args = parser.parse_args()
+
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube("phase2.json")
     
     set_plot_options()
     plot_phase2_cpusched_barchart(db)
@@ -29,13 +44,25 @@ def main():
 
     
     # all of the results for analysis
-    plot_all_phase2_metrics(db)
+    plot_all_phase2_metrics(db, processes=args.processes, figure_cache=args.figure_cache)
+
+    report_peak_rss('plot_phase2.py')
 
-def plot_all_phase2_metrics(db):
+def plot_all_phase2_metrics(db, processes=None, figure_cache=None):
     metric_keys = select(db, im='ptrace', nw=14, up=True, ur=True).keys()
+    jobs = []
     for metric_key in metric_keys:
-        plot_phase2_metric(db,metric_key, title=True,
-            ylabel=metric_key.replace('_', '-'), dir='phase2_metrics')
+        dir = 'phase2_metrics'
+        outputs = [get_phase2_metric_filename(metric_key, im, dir) for im in PHASE2_METHODS]
+        jobs.append((outputs, plot_phase2_metric, (metric_key,),
+            dict(title=True, ylabel=metric_key.replace('_', '-'), dir=dir)))
+    render_figures(db, jobs, processes, figure_cache)
+
+def get_phase2_metric_filename(metric_key, im, dir=None):
+    filename = f"phold-phase2-{metric_key.replace('_', '-')}-{im}.pdf"
+    if dir != None:
+        filename = os.path.join(dir, filename)
+    return filename
 
 def plot_phase2_metric(db, metric_key, 
         title=None, ncol=1, dir=None,
@@ -46,66 +73,53 @@ def plot_phase2_metric(db, metric_key,
     colors = ['C0', 'C1', 'C2', 'C3']
     formats = ['o-', '^-', 's-', '*-']
 
-    methods = ['ptrace', 'seccomp', 'classic']
     x_threads = [14, 28, 42, 56]
 
-    for _, im in enumerate(methods):
-        pyplot.figure()
-
-        for i, (up, ur) in enumerate(cpu_modes):
-            y_vals, y_errs = [], []
-
-            for nw in x_threads:
-                result = select(db, im=im, nw=nw, up=up, ur=ur)
-                m, e = compute_mean_and_error(result[metric_key])
-                y_vals.append(m)
-                y_errs.append(e)
-
-            pyplot.errorbar(x_threads, y_vals, yerr=y_errs,
-                label=names[i], color=colors[i], fmt=formats[i],
-                capsize=2.0, linewidth=1.0)
-
-        pyplot.xticks(x_threads)
-        if yticks != None:
-            pyplot.yticks(yticks)
-
-        if yscale != None:
-            pyplot.yscale(yscale)
-        if ymin != None:
-            pyplot.ylim(ymin=ymin)
-        if ymax != None:
-            pyplot.ylim(ymax=ymax)
-        if ylabel != None:
-            if ylabel_ralign:
-                pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
-            else:
-                pyplot.ylabel(ylabel)
-        pyplot.xlabel('Logical Processor Count')
-
-        if title != None:
-            pyplot.title(im)
-
-        pyplot.legend(ncol=ncol)
-        pyplot.tight_layout(pad=0.3)
-
-        filename = f"phold-phase2-{metric_key.replace('_', '-')}-{im}.pdf"
-        if dir != None:
-            os.makedirs(dir, exist_ok = True)
-            filename = os.path.join(dir, filename)
-        pyplot.savefig(filename)
+    for _, im in enumerate(PHASE2_METHODS):
+        with render_figure(get_phase2_metric_filename(metric_key, im, dir)):
+            for i, (up, ur) in enumerate(cpu_modes):
+                y_vals, y_errs = compute_cube_means_and_errors(db, metric_key, get_query(im=im, nw=x_threads, up=up, ur=ur))
+
+                pyplot.errorbar(x_threads, y_vals, yerr=y_errs,
+                    label=names[i], color=colors[i], fmt=formats[i],
+                    capsize=2.0, linewidth=1.0)
+
+            pyplot.xticks(x_threads)
+            if yticks != None:
+                pyplot.yticks(yticks)
+
+            if yscale != None:
+                pyplot.yscale(yscale)
+            if ymin != None:
+                pyplot.ylim(ymin=ymin)
+            if ymax != None:
+                pyplot.ylim(ymax=ymax)
+            if ylabel != None:
+                if ylabel_ralign:
+                    pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
+                else:
+                    pyplot.ylabel(ylabel)
+            pyplot.xlabel('Logical Processor Count')
+
+            if title != None:
+                pyplot.title(im)
+
+            pyplot.legend(ncol=ncol)
+            pyplot.tight_layout(pad=0.3)
+
+            if dir != None:
+                os.makedirs(dir, exist_ok = True)
 
 def plot_phase2_cpusched_barchart(db):
-    pyplot.figure()
-
-    pyplot.subplot(131)
-    plot_phold_cpusched_helper(db, im='ptrace', title="ptrace", ylabel=True)
-    pyplot.subplot(132)
-    plot_phold_cpusched_helper(db, im='seccomp', title="seccomp")
-    pyplot.subplot(133)
-    plot_phold_cpusched_helper(db, im='classic', title="uni-process")
+    with render_figure('phold-phase2-cpusched-bar.pdf'):
+        pyplot.subplot(131)
+        plot_phold_cpusched_helper(db, im='ptrace', title="ptrace", ylabel=True)
+        pyplot.subplot(132)
+        plot_phold_cpusched_helper(db, im='seccomp', title="seccomp")
+        pyplot.subplot(133)
+        plot_phold_cpusched_helper(db, im='classic', title="uni-process")
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig('phold-phase2-cpusched-bar.pdf')
+        pyplot.tight_layout(pad=0.3)
 
 def plot_phold_cpusched_helper(db, im, title=None, ylabel=False):
     names = ['standard', 'pin+standard', 'realtime', 'pin+realtime']
@@ -133,24 +147,22 @@ def plot_phold_cpusched_helper(db, im, title=None, ylabel=False):
         pyplot.title(title)
 
 def select(db, im, nw, up, ur):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.msgload == 100) &
-        (exp.exe.quantity == 1000) &
-        (exp.exe.weights == 'skewed') &
-        (exp.interpose_method == im) &
-        (exp.num_workers == nw) &
-        (exp.scheduling_policy == 'host') &
-        (exp.use_memory_manager == (None if im == 'classic' else True)) &
-        (exp.use_pinning == up) &
-        (exp.use_realtime == ur) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else True))
+    return select_results(db, **get_query(im, nw, up, ur))
+
+def get_query(im, nw, up, ur):
+    # nw may also be a list, to select the line of configs over its values
+    return dict(
+        msgload=100,
+        quantity=1000,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=nw,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=up,
+        use_realtime=ur,
+        use_syscall_preloading=(None if im == 'classic' else True)
     )
 
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
-
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -1,63 +1,73 @@
 import sys
 import os
 import json
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase3.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
+    )
+    args = parser.parse_args()
+
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube("phase3.json")
 
     set_plot_options()
     plot_phase3_memmgr_barcharts(db)
 
     set_plot_options(grid='both')
-    plot_all_phase3_metrics(db)
+    plot_all_phase3_metrics(db, processes=args.processes, figure_cache=args.figure_cache)
+
+    report_peak_rss('plot_phase3.py')
 
 def plot_phase3_memmgr_barcharts(db,):
     # seccomp vs classic
-    pyplot.figure()
+    with render_figure(f'phold-phase3-memmgr-bar-seccomp.pdf'):
+        pyplot.subplot(131)
+        plot_phold_phase3_helper_paper(db, 'perf_duration-time-sec', is_seccomp=True,
+            ylabel="Benchmark Time (s)", val_round=1, ymax=60)
 
-    pyplot.subplot(131)
-    plot_phold_phase3_helper_paper(db, 'perf_duration-time-sec', is_seccomp=True,
-        ylabel="Benchmark Time (s)", val_round=1, ymax=60)
+        pyplot.subplot(132)
+        plot_phold_phase3_helper_paper(db, 'mem_used_gib', is_seccomp=True,
+            ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.5)
 
-    pyplot.subplot(132)
-    plot_phold_phase3_helper_paper(db, 'mem_used_gib', is_seccomp=True,
-        ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.5)
-    
-    pyplot.subplot(133)
-    plot_phold_phase3_helper_paper(db, 'perf_page-faults', is_seccomp=True,
-        ylabel=r"Page Faults ($\times$10$^6$)", val_div=10**6, ymax=1.85)
+        pyplot.subplot(133)
+        plot_phold_phase3_helper_paper(db, 'perf_page-faults', is_seccomp=True,
+            ylabel=r"Page Faults ($\times$10$^6$)", val_div=10**6, ymax=1.85)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(f'phold-phase3-memmgr-bar-seccomp.pdf')
+        pyplot.tight_layout(pad=0.3)
 
     # ptrace vs classic
-    pyplot.figure()
+    with render_figure(f'phold-phase3-memmgr-bar-ptrace.pdf'):
+        pyplot.subplot(131)
+        plot_phold_phase3_helper_paper(db, 'perf_duration-time-sec', is_seccomp=False,
+            ylabel="Benchmark Time (s)", val_round=1, ymax=90)
 
-    pyplot.subplot(131)
-    plot_phold_phase3_helper_paper(db, 'perf_duration-time-sec', is_seccomp=False,
-        ylabel="Benchmark Time (s)", val_round=1, ymax=90)
+        pyplot.subplot(132)
+        plot_phold_phase3_helper_paper(db, 'mem_used_gib', is_seccomp=False,
+            ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.5)
 
-    pyplot.subplot(132)
-    plot_phold_phase3_helper_paper(db, 'mem_used_gib', is_seccomp=False,
-        ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.5)
-    
-    pyplot.subplot(133)
-    plot_phold_phase3_helper_paper(db, 'perf_page-faults', is_seccomp=False,
-        ylabel=r"Page Faults ($\times$10$^6$)", val_div=10**6, ymax=1.85)
+        pyplot.subplot(133)
+        plot_phold_phase3_helper_paper(db, 'perf_page-faults', is_seccomp=False,
+            ylabel=r"Page Faults ($\times$10$^6$)", val_div=10**6, ymax=1.85)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(f'phold-phase3-memmgr-bar-ptrace.pdf')
+        pyplot.tight_layout(pad=0.3)
 
 def plot_phold_phase3_helper_paper(db, metric_key, is_seccomp=True, val_div=1, val_round=2, title=None, ymax=None, ylabel=None, yticks=None):
     if is_seccomp:
@@ -108,8 +118,9 @@ def plot_phold_phase3_helper_paper(db, metric_key, is_seccomp=True, val_div=1, v
     if title != None:
         pyplot.title(title)
 
-def plot_all_phase3_metrics(db):
+def plot_all_phase3_metrics(db, processes=None, figure_cache=None):
     metric_keys = select(db, im='ptrace', umm=True).keys()
+    jobs = []
     for metric_key in metric_keys:
         metric_label = metric_key.replace('_', '-')
         dir = 'phase3_metrics'
@@ -119,10 +130,13 @@ def plot_all_phase3_metrics(db):
             os.makedirs(dir, exist_ok = True)
             filename = os.path.join(dir, filename)
 
-        pyplot.figure()
-        plot_phold_phase3_helper(db, metric_key, ylabel=metric_label)
+        jobs.append(([filename], plot_phase3_metric, (metric_key, filename), dict(ylabel=metric_label)))
+    render_figures(db, jobs, processes, figure_cache)
+
+def plot_phase3_metric(db, metric_key, filename, ylabel=None):
+    with render_figure(filename):
+        plot_phold_phase3_helper(db, metric_key, ylabel=ylabel)
         pyplot.tight_layout(pad=0.3)
-        pyplot.savefig(filename)
         
 def plot_phold_phase3_helper(db, metric_key, val_div=1, val_round=2, title=None, ymax=None, ylabel=None, yticks=None):
     names = [
@@ -166,24 +180,17 @@ def plot_phold_phase3_helper(db, metric_key, val_div=1, val_round=2, title=None,
         pyplot.title(title)
 
 def select(db, im, umm):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.msgload == 100) &
-        (exp.exe.quantity == 1000) &
-        (exp.exe.weights == 'skewed') &
-        (exp.interpose_method == im) &
-        (exp.num_workers == 28) &
-        (exp.scheduling_policy == 'host') &
-        (exp.use_memory_manager == umm) &
-        (exp.use_pinning == True) &
-        (exp.use_realtime == False) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else True))
-    )
-
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
+    return select_results(db,
+        msgload=100,
+        quantity=1000,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=28,
+        scheduling_policy='host',
+        use_memory_manager=umm,
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True))
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -1,20 +1,32 @@
 import sys
 import os
 import json
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase4.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
+    )
+    args = parser.parse_args()
+
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube("phase4.json")
 
     set_plot_options()
     plot_phase4_sched_barcharts(db)
@@ -22,7 +34,9 @@ def main():
     plot_phase4_sched_barchart(db)
 
     set_plot_options(grid='both')
-    plot_all_phase4_metrics(db)
+    plot_all_phase4_metrics(db, processes=args.processes, figure_cache=args.figure_cache)
+
+    report_peak_rss('plot_phase4.py')
 
 def plot_phase4_sched_barcharts(db):
     names = ['thread/host', 'thread/LP']
@@ -33,114 +47,112 @@ def plot_phase4_sched_barcharts(db):
     colors_classic = ['C4', 'C5']
 
     # seccomp vs classic
-    fig = pyplot.figure(constrained_layout=False)
-    gs = fig.add_gridspec(ncols=9, nrows=1)
-
-    #pyplot.subplot(161)
-    fig.add_subplot(gs[0, 1])
-    plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
-        names, sched_seccomp, colors_phantom,
-        title='seccomp', title_loc='right',
-        ylabel="Benchmark Time (s)", 
-        yticks=[0,20,40,60], ymax=65, val_round=1)
-    #pyplot.subplot(162)
-    fig.add_subplot(gs[0, 2])
-    plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
-        names, sched_classic, colors_classic,
-        title='uni-proc', title_loc='left',
-        yticks=[0,20,40,60], ymax=65, val_round=1)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.subplot(163)
-    fig.add_subplot(gs[0, 4])
-    plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
-        names, sched_seccomp, colors_phantom,
-        title='seccomp', title_loc='right',
-        ylabel="Max RAM Used (GiB)", 
-        yticks=[0,1,2], ymax=2.45*1.05)
-    #pyplot.subplot(164)
-    fig.add_subplot(gs[0, 5])
-    plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
-        names, sched_classic, colors_classic,
-        title='uni-proc', title_loc='left',
-        yticks=[0,1,2], ymax=2.45*1.05)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.subplot(165)
-    fig.add_subplot(gs[0, 7])
-    plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
-        names, sched_seccomp, colors_phantom,
-        title='seccomp', title_loc='right',
-        ylabel=r"CPU Migrations ($\times$10$^3$)", 
-        val_div=1000.0, 
-        yticks=[0,2,4,6,8,10], ymax=11*1.05)
-    #pyplot.subplot(166)
-    fig.add_subplot(gs[0, 8])
-    plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
-        names, sched_classic, colors_classic,
-        title='uni-proc', title_loc='left',
-        val_div=1000.0, 
-        yticks=[0,2,4,6,8,10], ymax=11*1.05)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.tight_layout(pad=0.3)
-    pyplot.subplots_adjust(left=0.01, right=0.98, bottom=0.3)
-    pyplot.savefig('phold-phase4-sched-bar-seccomp.pdf')
+    with render_figure('phold-phase4-sched-bar-seccomp.pdf', constrained_layout=False) as fig:
+        gs = fig.add_gridspec(ncols=9, nrows=1)
+
+        #pyplot.subplot(161)
+        fig.add_subplot(gs[0, 1])
+        plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
+            names, sched_seccomp, colors_phantom,
+            title='seccomp', title_loc='right',
+            ylabel="Benchmark Time (s)", 
+            yticks=[0,20,40,60], ymax=65, val_round=1)
+        #pyplot.subplot(162)
+        fig.add_subplot(gs[0, 2])
+        plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
+            names, sched_classic, colors_classic,
+            title='uni-proc', title_loc='left',
+            yticks=[0,20,40,60], ymax=65, val_round=1)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.subplot(163)
+        fig.add_subplot(gs[0, 4])
+        plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
+            names, sched_seccomp, colors_phantom,
+            title='seccomp', title_loc='right',
+            ylabel="Max RAM Used (GiB)", 
+            yticks=[0,1,2], ymax=2.45*1.05)
+        #pyplot.subplot(164)
+        fig.add_subplot(gs[0, 5])
+        plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
+            names, sched_classic, colors_classic,
+            title='uni-proc', title_loc='left',
+            yticks=[0,1,2], ymax=2.45*1.05)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.subplot(165)
+        fig.add_subplot(gs[0, 7])
+        plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
+            names, sched_seccomp, colors_phantom,
+            title='seccomp', title_loc='right',
+            ylabel=r"CPU Migrations ($\times$10$^3$)", 
+            val_div=1000.0, 
+            yticks=[0,2,4,6,8,10], ymax=11*1.05)
+        #pyplot.subplot(166)
+        fig.add_subplot(gs[0, 8])
+        plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
+            names, sched_classic, colors_classic,
+            title='uni-proc', title_loc='left',
+            val_div=1000.0, 
+            yticks=[0,2,4,6,8,10], ymax=11*1.05)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.tight_layout(pad=0.3)
+        pyplot.subplots_adjust(left=0.01, right=0.98, bottom=0.3)
 
     ################################
     # ptrace vs classic
-    fig = pyplot.figure(constrained_layout=False)
-    gs = fig.add_gridspec(ncols=9, nrows=1)
-
-    #pyplot.subplot(161)
-    fig.add_subplot(gs[0, 1])
-    plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
-        names, sched_ptrace, colors_phantom,
-        title='ptrace', 
-        ylabel="Benchmark Time (s)", 
-        yticks=[0,20,40,60,80], ymax=95, val_round=1)
-    #pyplot.subplot(162)
-    fig.add_subplot(gs[0, 2])
-    plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
-        names, sched_classic, colors_classic,
-        title='uni-proc', 
-        yticks=[0,20,40,60,80], ymax=95, val_round=1)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.subplot(163)
-    fig.add_subplot(gs[0, 4])
-    plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
-        names, sched_ptrace, colors_phantom,
-        title='ptrace', 
-        ylabel="Max RAM Used (GiB)", 
-        yticks=[0,1,2], ymax=2.45*1.05)
-    #pyplot.subplot(164)
-    fig.add_subplot(gs[0, 5])
-    plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
-        names, sched_classic, colors_classic,
-        title='uni-proc', yticks=[0,1,2], ymax=2.45*1.05)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.subplot(165)
-    fig.add_subplot(gs[0, 7])
-    plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
-        names, sched_ptrace, colors_phantom,
-        title='ptrace',
-        ylabel=r"CPU Migrations ($\times$10$^3$)", 
-        val_div=1000.0, 
-        yticks=[0,2,4,6,8], ymax=9)
-    #pyplot.subplot(166)
-    fig.add_subplot(gs[0, 8])
-    plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
-        names, sched_classic, colors_classic,
-        title='uni-proc', 
-        val_div=1000.0, 
-        yticks=[0,2,4,6,8], ymax=9)
-    pyplot.gca().get_yaxis().set_ticklabels([])
-
-    #pyplot.tight_layout(pad=0.3)
-    pyplot.subplots_adjust(left=0.01, right=0.98, bottom=0.3)
-    pyplot.savefig('phold-phase4-sched-bar-ptrace.pdf')
+    with render_figure('phold-phase4-sched-bar-ptrace.pdf', constrained_layout=False) as fig:
+        gs = fig.add_gridspec(ncols=9, nrows=1)
+
+        #pyplot.subplot(161)
+        fig.add_subplot(gs[0, 1])
+        plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
+            names, sched_ptrace, colors_phantom,
+            title='ptrace', 
+            ylabel="Benchmark Time (s)", 
+            yticks=[0,20,40,60,80], ymax=95, val_round=1)
+        #pyplot.subplot(162)
+        fig.add_subplot(gs[0, 2])
+        plot_phold_phase4_helper_paper(db, 'perf_duration-time-sec', 
+            names, sched_classic, colors_classic,
+            title='uni-proc', 
+            yticks=[0,20,40,60,80], ymax=95, val_round=1)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.subplot(163)
+        fig.add_subplot(gs[0, 4])
+        plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
+            names, sched_ptrace, colors_phantom,
+            title='ptrace', 
+            ylabel="Max RAM Used (GiB)", 
+            yticks=[0,1,2], ymax=2.45*1.05)
+        #pyplot.subplot(164)
+        fig.add_subplot(gs[0, 5])
+        plot_phold_phase4_helper_paper(db, 'mem_used_gib', 
+            names, sched_classic, colors_classic,
+            title='uni-proc', yticks=[0,1,2], ymax=2.45*1.05)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.subplot(165)
+        fig.add_subplot(gs[0, 7])
+        plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
+            names, sched_ptrace, colors_phantom,
+            title='ptrace',
+            ylabel=r"CPU Migrations ($\times$10$^3$)", 
+            val_div=1000.0, 
+            yticks=[0,2,4,6,8], ymax=9)
+        #pyplot.subplot(166)
+        fig.add_subplot(gs[0, 8])
+        plot_phold_phase4_helper_paper(db, 'perf_cpu-migrations',
+            names, sched_classic, colors_classic,
+            title='uni-proc', 
+            val_div=1000.0, 
+            yticks=[0,2,4,6,8], ymax=9)
+        pyplot.gca().get_yaxis().set_ticklabels([])
+
+        #pyplot.tight_layout(pad=0.3)
+        pyplot.subplots_adjust(left=0.01, right=0.98, bottom=0.3)
 
 def plot_phold_phase4_helper_paper(db, metric_key, names, sched_modes, colors,
         val_div=1, val_round=2, title=None, title_loc='center', ymax=None, ylabel=None, yticks=None):
@@ -170,22 +182,21 @@ def plot_phold_phase4_helper_paper(db, metric_key, names, sched_modes, colors,
 
 def plot_phase4_sched_barchart(db):
     # seccomp vs classic
-    pyplot.figure()
+    with render_figure('phold-phase4-sched-bar.pdf'):
+        pyplot.subplot(131)
+        plot_phold_phase4_helper(db, 'perf_duration-time-sec', ylabel="Benchmark Time (s)", ymax=95*1.05, val_round=1)
 
-    pyplot.subplot(131)
-    plot_phold_phase4_helper(db, 'perf_duration-time-sec', ylabel="Benchmark Time (s)", ymax=95*1.05, val_round=1)
-    
-    pyplot.subplot(132)
-    plot_phold_phase4_helper(db, 'mem_used_gib', ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.45*1.05)
-    
-    pyplot.subplot(133)
-    plot_phold_phase4_helper(db, 'perf_cpu-migrations', ylabel=r"CPU Migrations ($\times$10$^3$)", val_div=1000.0, yticks=[0,2,4,6,8,10], ymax=11*1.05)
+        pyplot.subplot(132)
+        plot_phold_phase4_helper(db, 'mem_used_gib', ylabel="Max RAM Used (GiB)", yticks=[0,1,2], ymax=2.45*1.05)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig('phold-phase4-sched-bar.pdf')
+        pyplot.subplot(133)
+        plot_phold_phase4_helper(db, 'perf_cpu-migrations', ylabel=r"CPU Migrations ($\times$10$^3$)", val_div=1000.0, yticks=[0,2,4,6,8,10], ymax=11*1.05)
 
-def plot_all_phase4_metrics(db):
+        pyplot.tight_layout(pad=0.3)
+
+def plot_all_phase4_metrics(db, processes=None, figure_cache=None):
     metric_keys = select(db, im='ptrace', sp='host').keys()
+    jobs = []
     for metric_key in metric_keys:
         metric_label = metric_key.replace('_', '-')
         dir = 'phase4_metrics'
@@ -195,10 +206,13 @@ def plot_all_phase4_metrics(db):
             os.makedirs(dir, exist_ok = True)
             filename = os.path.join(dir, filename)
 
-        pyplot.figure()
-        plot_phold_phase4_helper(db, metric_key, ylabel=metric_label)
+        jobs.append(([filename], plot_phase4_metric, (metric_key, filename), dict(ylabel=metric_label)))
+    render_figures(db, jobs, processes, figure_cache)
+
+def plot_phase4_metric(db, metric_key, filename, ylabel=None):
+    with render_figure(filename):
+        plot_phold_phase4_helper(db, metric_key, ylabel=ylabel)
         pyplot.tight_layout(pad=0.3)
-        pyplot.savefig(filename)
 
 def plot_phold_phase4_helper(db, metric_key, val_div=1, val_round=2, title=None, ymax=None, ylabel=None, yticks=None):
     c = '$\sim$'
@@ -245,24 +259,17 @@ def plot_phold_phase4_helper(db, metric_key, val_div=1, val_round=2, title=None,
         pyplot.title(title)
 
 def select(db, im, sp):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.msgload == 100) &
-        (exp.exe.quantity == 1000) &
-        (exp.exe.weights == 'skewed') &
-        (exp.interpose_method == im) &
-        (exp.num_workers == 28) &
-        (exp.scheduling_policy == sp) &
-        (exp.use_memory_manager == (None if im == 'classic' else True)) &
-        (exp.use_pinning == True) &
-        (exp.use_realtime == False) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else True))
-    )
-
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
+    return select_results(db,
+        msgload=100,
+        quantity=1000,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=28,
+        scheduling_policy=sp,
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True))
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
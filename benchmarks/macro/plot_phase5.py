@@ -1,30 +1,45 @@
 import sys
 import os
 import json
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase5.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
+    )
+    args = parser.parse_args()
+
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube("phase5.json")
 
     set_plot_options()
     plot_phase5_cpuload(db)
     plot_phase5_msgload(db)
     plot_phase5_weights(db)
 
-    plot_all_phase5_metrics(db)
+    plot_all_phase5_metrics(db, processes=args.processes, figure_cache=args.figure_cache)
 
-def plot_all_phase5_metrics(db):
+    report_peak_rss('plot_phase5.py')
+
+def plot_all_phase5_metrics(db, processes=None, figure_cache=None):
     metric_keys = select(db, im='ptrace', ec=0, em=1, ew='skewed').keys()
+    jobs = []
     for metric_key in metric_keys:
         metric_label = metric_key.replace('_', '-')
 
@@ -39,7 +54,13 @@ def plot_all_phase5_metrics(db):
             filename_msg = os.path.join(dir, filename_msg)
             filename_wgt = os.path.join(dir, filename_wgt)
 
-        pyplot.figure()
+        jobs.append(([filename_cpu], plot_phase5_metric_cpuload, (metric_key, metric_label, filename_cpu), {}))
+        jobs.append(([filename_msg], plot_phase5_metric_msgload, (metric_key, metric_label, filename_msg), {}))
+        jobs.append(([filename_wgt], plot_phase5_metric_weights, (metric_key, metric_label, filename_wgt), {}))
+    render_figures(db, jobs, processes, figure_cache)
+
+def plot_phase5_metric_cpuload(db, metric_key, metric_label, filename):
+    with render_figure(filename):
         pyplot.subplot(141)
         plot_phase5_cpuload_helper(db, metric_key, ec=0, ylabel=metric_label)
         pyplot.subplot(142)
@@ -49,9 +70,9 @@ def plot_all_phase5_metrics(db):
         pyplot.subplot(144)
         plot_phase5_cpuload_helper(db, metric_key, ec=3)
         pyplot.tight_layout(pad=0.3)
-        pyplot.savefig(filename_cpu)
 
-        pyplot.figure()
+def plot_phase5_metric_msgload(db, metric_key, metric_label, filename):
+    with render_figure(filename):
         pyplot.subplot(141)
         plot_phase5_msgload_helper(db, metric_key, em=1, ylabel=metric_label)
         pyplot.subplot(142)
@@ -61,9 +82,9 @@ def plot_all_phase5_metrics(db):
         pyplot.subplot(144)
         plot_phase5_msgload_helper(db, metric_key, em=1000)
         pyplot.tight_layout(pad=0.3)
-        pyplot.savefig(filename_msg)
 
-        pyplot.figure()
+def plot_phase5_metric_weights(db, metric_key, metric_label, filename):
+    with render_figure(filename):
         pyplot.subplot(131)
         plot_phase5_weights_helper(db, metric_key, ew='uniform', ylabel=metric_label)
         pyplot.subplot(132)
@@ -71,24 +92,21 @@ def plot_all_phase5_metrics(db):
         pyplot.subplot(133)
         plot_phase5_weights_helper(db, metric_key, ew='ring')
         pyplot.tight_layout(pad=0.3)
-        pyplot.savefig(filename_wgt)
 
 def plot_phase5_cpuload(db):
     metric_key = 'perf_duration-time-sec'
 
-    pyplot.figure()
-
-    pyplot.subplot(141)
-    plot_phase5_cpuload_helper(db, metric_key, ec=0, ylabel="Benchmark Time (s)", ymax=375)
-    pyplot.subplot(142)
-    plot_phase5_cpuload_helper(db, metric_key, ec=1, ymax=375)
-    pyplot.subplot(143)
-    plot_phase5_cpuload_helper(db, metric_key, ec=2, ymax=375, val_round=0)
-    pyplot.subplot(144)
-    plot_phase5_cpuload_helper(db, metric_key, ec=3, ymax=375, val_round=0)
+    with render_figure('phold-phase5-cpuload-bar.pdf'):
+        pyplot.subplot(141)
+        plot_phase5_cpuload_helper(db, metric_key, ec=0, ylabel="Benchmark Time (s)", ymax=375)
+        pyplot.subplot(142)
+        plot_phase5_cpuload_helper(db, metric_key, ec=1, ymax=375)
+        pyplot.subplot(143)
+        plot_phase5_cpuload_helper(db, metric_key, ec=2, ymax=375, val_round=0)
+        pyplot.subplot(144)
+        plot_phase5_cpuload_helper(db, metric_key, ec=3, ymax=375, val_round=0)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig('phold-phase5-cpuload-bar.pdf')
+        pyplot.tight_layout(pad=0.3)
 
 def plot_phase5_cpuload_helper(db, metric_key, ec, val_div=1, val_round=1, title=None, ymax=None, ylabel=None, yticks=None):
     names = ['ptrace', 'seccomp', 'uni-process']
@@ -125,19 +143,17 @@ def plot_phase5_cpuload_helper(db, metric_key, ec, val_div=1, val_round=1, title
 def plot_phase5_msgload(db):
     metric_key = 'perf_duration-time-sec'
 
-    pyplot.figure()
-
-    pyplot.subplot(141)
-    plot_phase5_msgload_helper(db, metric_key, em=1, ylabel="Benchmark Time (s)", ymax=20)
-    pyplot.subplot(142)
-    plot_phase5_msgload_helper(db, metric_key, em=10, ymax=20)
-    pyplot.subplot(143)
-    plot_phase5_msgload_helper(db, metric_key, em=100, ymax=100)
-    pyplot.subplot(144)
-    plot_phase5_msgload_helper(db, metric_key, em=1000, ymax=850, val_round=0)
+    with render_figure('phold-phase5-msgload-bar.pdf'):
+        pyplot.subplot(141)
+        plot_phase5_msgload_helper(db, metric_key, em=1, ylabel="Benchmark Time (s)", ymax=20)
+        pyplot.subplot(142)
+        plot_phase5_msgload_helper(db, metric_key, em=10, ymax=20)
+        pyplot.subplot(143)
+        plot_phase5_msgload_helper(db, metric_key, em=100, ymax=100)
+        pyplot.subplot(144)
+        plot_phase5_msgload_helper(db, metric_key, em=1000, ymax=850, val_round=0)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig('phold-phase5-msgload-bar.pdf')
+        pyplot.tight_layout(pad=0.3)
 
 def plot_phase5_msgload_helper(db, metric_key, em, val_div=1, val_round=1, title=None, ymax=None, ylabel=None, yticks=None):
     names = ['ptrace', 'seccomp', 'uni-process']
@@ -174,17 +190,15 @@ def plot_phase5_msgload_helper(db, metric_key, em, val_div=1, val_round=1, title
 def plot_phase5_weights(db):
     metric_key = 'perf_duration-time-sec'
 
-    pyplot.figure()
-
-    pyplot.subplot(131)
-    plot_phase5_weights_helper(db, metric_key, ew='uniform', ylabel="Benchmark Time (s)", ymax=90)
-    pyplot.subplot(132)
-    plot_phase5_weights_helper(db, metric_key, ew='skewed', ymax=90)
-    pyplot.subplot(133)
-    plot_phase5_weights_helper(db, metric_key, ew='ring', ymax=90)
+    with render_figure('phold-phase5-weights-bar.pdf'):
+        pyplot.subplot(131)
+        plot_phase5_weights_helper(db, metric_key, ew='uniform', ylabel="Benchmark Time (s)", ymax=90)
+        pyplot.subplot(132)
+        plot_phase5_weights_helper(db, metric_key, ew='skewed', ymax=90)
+        pyplot.subplot(133)
+        plot_phase5_weights_helper(db, metric_key, ew='ring', ymax=90)
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig('phold-phase5-weights-bar.pdf')
+        pyplot.tight_layout(pad=0.3)
 
 def plot_phase5_weights_helper(db, metric_key, ew, val_div=1, val_round=1, title=None, ymax=None, ylabel=None, yticks=None):
     names = ['ptrace', 'seccomp', 'uni-process']
@@ -219,25 +233,18 @@ def plot_phase5_weights_helper(db, metric_key, ew, val_div=1, val_round=1, title
     pyplot.title(f'exponential workload' if ew == 'skewed' else f'{ew} workload')
 
 def select(db, im, ec, em, ew):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.cpuload == ec) &
-        (exp.exe.msgload == em) &
-        (exp.exe.quantity == 1000) &
-        (exp.exe.weights == ew) &
-        (exp.interpose_method == im) &
-        (exp.num_workers == 28) &
-        (exp.scheduling_policy == 'host') &
-        (exp.use_memory_manager == (None if im == 'classic' else True)) &
-        (exp.use_pinning == True) &
-        (exp.use_realtime == False) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else True))
-    )
-
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
+    return select_results(db,
+        cpuload=ec,
+        msgload=em,
+        quantity=1000,
+        weights=ew,
+        interpose_method=im,
+        num_workers=28,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True))
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -1,36 +1,80 @@
 import sys
 import os
 import json
+import shutil
+import argparse
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 from matplotlib.ticker import FuncFormatter
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
+from metric_cube import load_metric_cube, select_results, compute_cube_means_and_errors
 
 from plot_common import *
+from plot_pool import render_figures, get_default_processes
+
+# the text options of the figures that are not in the paper: matplotlib renders
+# their text itself (mathtext), instead of running latex for every label and
+# tick label, with computer modern math and a serif font close to the latex one
+MATHTEXT_OPTIONS = {
+    'text.usetex': False,
+    'font.family': 'serif',
+    'mathtext.fontset': 'cm',
+}
+
+TEX_CACHE_DIR = '.tex_cache'
 
 def main():
-    # koios experiments
-    run("phase6.json", 
-        "phase6_metrics", 
-        pdf_name_suffix='',
-        thread_low=14, 
-        thread_high=28, 
-        thread_classic_lim=16000, 
-        thread_phantom_lim=64000
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', "--processes",
+        help="Number of processes that render the figures of the all-metrics sweeps",
+        type=int,
+        default=get_default_processes()
+    )
+    parser.add_argument("--figure_cache",
+        help="Skip the figures of the all-metrics sweeps whose code, options and data are unchanged since they were rendered, as recorded in this json file",
+        default=None
     )
+    parser.add_argument("--tex_cache",
+        help="Directory in which the latex renderings of the text are kept, across runs and processes",
+        default=TEX_CACHE_DIR
+    )
+    parser.add_argument("--usetex_all",
+        help="Also render the text of the all-metrics sweep figures with latex, instead of with mathtext",
+        action='store_true'
+    )
+    parser.add_argument("--allow_mathtext",
+        help="If latex is not installed, render the text of the paper figures with mathtext, which does not match the published figures, instead of failing",
+        action='store_true'
+    )
+    args = parser.parse_args()
+
+    # koios experiments
+    with keep_tex_cache(args.tex_cache):
+        run("phase6.json", 
+            "phase6_metrics", 
+            pdf_name_suffix='',
+            thread_low=14, 
+            thread_high=28, 
+            thread_classic_lim=16000, 
+            thread_phantom_lim=64000,
+            processes=args.processes,
+            figure_cache=args.figure_cache,
+            usetex_all=args.usetex_all,
+            allow_mathtext=args.allow_mathtext
+        )
+
+    report_peak_rss('plot_phase6.py')
 
 def run(db_filename, pdf_dir, pdf_name_suffix, 
-        thread_low, thread_high, thread_classic_lim, thread_phantom_lim):
-    # load the db into ram
-    db = TinyDB(storage=MemoryStorage)
-    with open(db_filename, 'r') as inf:
-        db.insert_multiple(json.load(inf))
+        thread_low, thread_high, thread_classic_lim, thread_phantom_lim, processes=None, figure_cache=None,
+        usetex_all=False, allow_mathtext=False):
+    # pivot the experiments into an array once, so every select is an index into it
+    db = load_metric_cube(db_filename)
 
     set_plot_options_custom(grid='both')
+    set_text_options(allow_mathtext)
     
     # the ones we might want in the paper
     plot_phase6_metric(db, f'perf_duration-time-sec{pdf_name_suffix}',
@@ -60,24 +104,45 @@ def run(db_filename, pdf_dir, pdf_name_suffix,
     plot_all_phase6_metrics(db, pdf_dir, pdf_name_suffix,
         nw=thread_low, 
         thread_classic_lim=thread_classic_lim,
-        thread_phantom_lim=thread_phantom_lim)
+        thread_phantom_lim=thread_phantom_lim,
+        processes=processes,
+        figure_cache=figure_cache,
+        usetex=usetex_all)
     plot_all_phase6_metrics(db, pdf_dir, pdf_name_suffix,
         nw=thread_high, 
         thread_classic_lim=thread_classic_lim,
-        thread_phantom_lim=thread_phantom_lim)
+        thread_phantom_lim=thread_phantom_lim,
+        processes=processes,
+        figure_cache=figure_cache,
+        usetex=usetex_all)
 
-def plot_all_phase6_metrics(db, pdf_dir, pdf_name_suffix, nw, thread_classic_lim, thread_phantom_lim):
+def plot_all_phase6_metrics(db, pdf_dir, pdf_name_suffix, nw, thread_classic_lim, thread_phantom_lim, processes=None, figure_cache=None,
+        usetex=False):
     metric_keys = select(db, im='ptrace', nw=nw, eq=1000).keys()
 
+    jobs = []
     for metric_key in metric_keys:
         metric_label = metric_key.replace('_', '-')
-        plot_phase6_metric(db, metric_key, nw=nw, 
+        outputs = [get_phase6_metric_filename(metric_key, nw, pdf_name_suffix, pdf_dir)]
+        jobs.append((outputs, plot_phase6_metric, (metric_key,), dict(nw=nw, 
             thread_classic_lim=thread_classic_lim,
             thread_phantom_lim=thread_phantom_lim,
             pdf_name_suffix=pdf_name_suffix,
             title=f'{nw} logical processors',
             ylabel=metric_label, 
-            dir=pdf_dir)
+            dir=pdf_dir)))
+
+    # only the paper figures pay for running latex by default; the options are
+    # handed to the pool workers, and are part of the figure cache hashes
+    with matplotlib.rc_context({} if usetex else MATHTEXT_OPTIONS):
+        render_figures(db, jobs, processes, figure_cache)
+
+def get_phase6_metric_filename(metric_key, nw, pdf_name_suffix='', dir=None):
+    metric_label = metric_key.replace('_', '-')
+    filename = f"phold-phase6-{metric_label}-{nw}{pdf_name_suffix}.pdf"
+    if dir != None:
+        filename = os.path.join(dir, filename)
+    return filename
 
 def plot_phase6_metric(db, metric_key, nw, thread_classic_lim, thread_phantom_lim,
         title=None, ncol=1, dir=None, pdf_name_suffix='', val_div=1,
@@ -90,84 +155,73 @@ def plot_phase6_metric(db, metric_key, nw, thread_classic_lim, thread_phantom_li
     x_numhosts_phantom = [1000*2**i for i in range(10) if 1000*2**i <= thread_phantom_lim] # 1000 to 32000
     x_numhosts_classic = [1000*2**i for i in range(10) if 1000*2**i <= thread_classic_lim] # 1000 to 16000
 
-    pyplot.figure()
-
-    for i, im in enumerate(methods):
-        y_vals, y_errs = [], []
-
-        x_numhosts = x_numhosts_classic if im == 'classic' else x_numhosts_phantom
-
-        for eq in x_numhosts:
-            result = select(db, im=im, nw=nw, eq=eq)
-            m, e = compute_mean_and_error(result[metric_key])
-            y_vals.append(m/val_div)
-            y_errs.append(e/val_div)
-
-        pyplot.errorbar(x_numhosts, y_vals, yerr=y_errs,
-            label=names[i], color=colors[i], fmt=formats[i],
-            zorder=2 if i == 2 else 3, # uniproc is a solid line, put it on the bottom
-            capsize=2.0, linewidth=2.0) #markersize=4, 
-
-    pyplot.xscale('log')
-    pyplot.yscale('log')
-    pyplot.gca().get_xaxis().set_major_formatter(FuncFormatter(lambda x, pos: "{}k".format(int(x/1000))))
-    # turns off minor ticks on the x axis
-    pyplot.gca().get_xaxis().set_tick_params(which='minor', bottom=False)
-    # turns off minor ticks on both axes
-    #pyplot.minorticks_off()
-
-    pyplot.xticks(x_numhosts_phantom)
-    if yticks != None:
-        pyplot.yticks(yticks)
-
-    if yscale != None:
-        pyplot.yscale(yscale)
-    if ymin != None:
-        pyplot.ylim(ymin=ymin)
-    if ymax != None:
-        pyplot.ylim(ymax=ymax)
-    if ylabel != None:
-        if ylabel_ralign:
-            pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
-        else:
-            pyplot.ylabel(ylabel)
-    pyplot.xlabel('Virtual Host Count')
+    with render_figure(get_phase6_metric_filename(metric_key, nw, pdf_name_suffix, dir)):
+        for i, im in enumerate(methods):
+            x_numhosts = x_numhosts_classic if im == 'classic' else x_numhosts_phantom
 
-    if title != None:
-        pyplot.title(title)
+            y_vals, y_errs = compute_cube_means_and_errors(db, metric_key, get_query(im=im, nw=nw, eq=x_numhosts))
+            y_vals = [m/val_div for m in y_vals]
+            y_errs = [e/val_div for e in y_errs]
 
-    if bbox != None:
-        pyplot.legend(ncol=ncol, loc='upper left', bbox_to_anchor=bbox)
-    else:
-        pyplot.legend(ncol=ncol)
-    pyplot.tight_layout(pad=0.3)
+            pyplot.errorbar(x_numhosts, y_vals, yerr=y_errs,
+                label=names[i], color=colors[i], fmt=formats[i],
+                zorder=2 if i == 2 else 3, # uniproc is a solid line, put it on the bottom
+                capsize=2.0, linewidth=2.0) #markersize=4, 
 
-    metric_label = metric_key.replace('_', '-')
-    filename = f"phold-phase6-{metric_label}-{nw}{pdf_name_suffix}.pdf"
-    if dir != None:
-        os.makedirs(dir, exist_ok = True)
-        filename = os.path.join(dir, filename)
-    pyplot.savefig(filename)
+        pyplot.xscale('log')
+        pyplot.yscale('log')
+        pyplot.gca().get_xaxis().set_major_formatter(FuncFormatter(lambda x, pos: "{}k".format(int(x/1000))))
+        # turns off minor ticks on the x axis
+        pyplot.gca().get_xaxis().set_tick_params(which='minor', bottom=False)
+        # turns off minor ticks on both axes
+        #pyplot.minorticks_off()
+
+        pyplot.xticks(x_numhosts_phantom)
+        if yticks != None:
+            pyplot.yticks(yticks)
+
+        if yscale != None:
+            pyplot.yscale(yscale)
+        if ymin != None:
+            pyplot.ylim(ymin=ymin)
+        if ymax != None:
+            pyplot.ylim(ymax=ymax)
+        if ylabel != None:
+            if ylabel_ralign:
+                pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
+            else:
+                pyplot.ylabel(ylabel)
+        pyplot.xlabel('Virtual Host Count')
+
+        if title != None:
+            pyplot.title(title)
+
+        if bbox != None:
+            pyplot.legend(ncol=ncol, loc='upper left', bbox_to_anchor=bbox)
+        else:
+            pyplot.legend(ncol=ncol)
+        pyplot.tight_layout(pad=0.3)
+
+        if dir != None:
+            os.makedirs(dir, exist_ok = True)
 
 def select(db, im, nw, eq):
-    exp = Query()
-
-    records = db.search(
-        (exp.exe.msgload == 100) &
-        (exp.exe.quantity == eq) &
-        (exp.exe.weights == 'skewed') &
-        (exp.interpose_method == im) &
-        (exp.num_workers == nw) &
-        (exp.scheduling_policy == 'host') &
-        (exp.use_memory_manager == (None if im == 'classic' else True)) &
-        (exp.use_pinning == True) &
-        (exp.use_realtime == False) &
-        (exp.use_syscall_preloading == (None if im == 'classic' else True))
-    )
+    return select_results(db, **get_query(im, nw, eq))
 
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
-    return records[0]['~results']
+def get_query(im, nw, eq):
+    # eq may also be a list, to select the line of configs over its values
+    return dict(
+        msgload=100,
+        quantity=eq,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=nw,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True)
+    )
 
 def set_plot_options_custom(grid='y'):
     options = {
@@ -208,12 +262,17 @@ def set_plot_options_custom(grid='y'):
     for option_key in options:
         matplotlib.rcParams[option_key] = options[option_key]
 
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 100
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 100
     if 'legend.ncol' in matplotlib.rcParams:
         matplotlib.rcParams['legend.ncol'] = 100
 
+def set_text_options(allow_mathtext):
+    if not matplotlib.rcParams['text.usetex'] or shutil.which('latex') != None:
+        return
+    # the paper figures are only the same as the published ones with latex
+    if not allow_mathtext:
+        sys.exit("latex was not found, install it to render the paper figures, or pass --allow_mathtext to render them with mathtext")
+    print("latex was not found, rendering the text of all figures with mathtext instead", file=sys.stderr)
+    matplotlib.rcParams.update(MATHTEXT_OPTIONS)
+
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
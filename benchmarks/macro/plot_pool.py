@@ -0,0 +1,136 @@
+import sys
+import os
+import json
+import hashlib
+import multiprocessing
+
+import matplotlib
+matplotlib.use('Agg') # for systems without X11
+import matplotlib.pyplot as pyplot
+
+# Renders the figures of the "all metrics" sweeps in a pool of worker
+# processes. A figure job is an (outputs, plot function, args, kwargs) tuple,
+# where the plot function draws the figure of the dataset (the metric cube of
+# the phase) as plot_func(dataset, *args, **kwargs) and saves it to the output
+# files. The dataset and the current plot options are handed to each worker
+# once, when it starts, rather than with every job.
+#
+# With a figure cache file, each job is hashed over the code of the plot
+# scripts, the plot options, the job's arguments, and the part of the dataset
+# that it plots, and a job whose outputs exist and were rendered from the same
+# hash is skipped.
+
+# set in each worker by init_worker
+worker_dataset = None
+
+# the modules whose code a figure depends on, besides the plot script itself
+FIGURE_CODE_MODULES = ['plot_common', 'plot_pool', 'metric_cube', 'stats_common']
+
+def get_default_processes():
+    return os.cpu_count() or 1
+
+def render_figures(dataset, jobs, processes=None, figure_cache=None):
+    jobs = list(jobs)
+
+    if figure_cache != None:
+        cache = load_figure_cache(figure_cache)
+        digests = get_job_digests(dataset, jobs)
+        stale = [job for job, digest in zip(jobs, digests) if not is_job_cached(cache, job, digest)]
+        print(f"Rendering {len(stale)} of {len(jobs)} figures, the others are unchanged")
+    else:
+        stale = jobs
+
+    if processes == None:
+        processes = get_default_processes()
+    processes = min(processes, len(stale))
+
+    if processes <= 1:
+        for job in stale:
+            render_figure_job(dataset, job)
+    else:
+        rc = dict(matplotlib.rcParams)
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(dataset, rc)) as pool:
+            # consume the results so that an error in a worker is raised here
+            for _ in pool.imap_unordered(render_worker_job, stale):
+                pass
+
+    # only written once all of the figures were rendered
+    if figure_cache != None:
+        for (outputs, _, _, _), digest in zip(jobs, digests):
+            for output in outputs:
+                cache[output] = digest
+        save_figure_cache(figure_cache, cache)
+
+def init_worker(dataset, rc):
+    global worker_dataset
+    worker_dataset = dataset
+    # forked workers inherit the figures that the parent has open
+    pyplot.close('all')
+    matplotlib.rcParams.update(rc)
+
+def render_worker_job(job):
+    render_figure_job(worker_dataset, job)
+
+def render_figure_job(dataset, job):
+    _, plot_func, args, kwargs = job
+    # the plot functions draw into a figure of plot_common.render_figure, which
+    # is cleared once it was saved and reused by the next job
+    plot_func(dataset, *args, **kwargs)
+
+def is_job_cached(cache, job, digest):
+    outputs = job[0]
+    return all(cache.get(output) == digest and os.path.exists(output) for output in outputs)
+
+def get_job_digests(dataset, jobs):
+    h = hashlib.sha256()
+    h.update(get_code_digest().encode())
+    h.update(repr(sorted((k, repr(v)) for k, v in matplotlib.rcParams.items())).encode())
+
+    digests = []
+    for outputs, plot_func, args, kwargs in jobs:
+        job_h = h.copy()
+        job_h.update(repr((outputs, plot_func.__name__, args, sorted(kwargs.items()))).encode())
+        job_h.update(get_dataset_digest(dataset, [a for a in args if isinstance(a, str)]).encode())
+        digests.append(job_h.hexdigest())
+    return digests
+
+def get_code_digest():
+    h = hashlib.sha256()
+    paths = [sys.modules['__main__'].__file__]
+    paths += [sys.modules[name].__file__ for name in FIGURE_CODE_MODULES if name in sys.modules]
+    for path in paths:
+        with open(path, 'rb') as inf:
+            h.update(inf.read())
+    return h.hexdigest()
+
+def get_dataset_digest(cube, names):
+    # a sweep figure plots a single metric, so it only depends on the values
+    # of that metric; other figures depend on all of the values
+    h = hashlib.sha256()
+    h.update(repr((cube['axes'], cube['labels'], cube['constants'])).encode())
+    h.update(cube['counts'].tobytes())
+
+    metrics = [cube['metric_index'][name] for name in names if name in cube['metric_index']]
+    if len(metrics) == 0:
+        metrics = list(range(len(cube['metrics'])))
+    for m in metrics:
+        h.update(cube['metrics'][m].encode())
+        h.update(cube['values'][..., m, :].tobytes())
+        if cube['trials'] is not None:
+            h.update(cube['trials'][..., m, :].tobytes())
+    return h.hexdigest()
+
+def load_figure_cache(filepath):
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as inf:
+        return json.load(inf)
+
+def save_figure_cache(filepath, cache):
+    dirname = os.path.dirname(filepath)
+    if dirname != '':
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as outf:
+        json.dump(cache, outf, sort_keys=True, indent=2)
+    os.replace(tmp_path, filepath)
@@ -0,0 +1,211 @@
+import sys
+import os
+import argparse
+import struct
+import time
+import signal
+import select
+
+# Samples the memory and CPU usage of every process in the process tree of a
+# shadow process, i.e., of shadow itself and of the managed plugin processes
+# that phantom spawns. For each process in each sample, we write a fixed-width
+# binary record that collect.py reads with numpy.
+
+PROCSAMPLER_FILENAME = 'procs.bin'
+
+PROCSAMPLER_MAGIC = b'NSPROCv1'
+
+# magic, sampling interval in seconds, clock ticks per second, root pid
+PROCSAMPLER_HEADER = struct.Struct('<8sdII')
+
+# wall clock time of the sample, pid, ppid, rss and pss in bytes, utime and
+# stime in clock ticks, and voluntary and involuntary context switches
+PROCSAMPLER_RECORD = struct.Struct('<dIIQQQQQQ')
+PROCSAMPLER_FIELDS = ['time', 'pid', 'ppid', 'rss', 'pss', 'utime', 'stime', 'vcsw', 'nvcsw']
+
+# written instead of the pss if it was not sampled
+PSS_UNKNOWN = 2**64 - 1
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', "--output",
+        help="Path to the binary file to which the samples are written",
+        default=PROCSAMPLER_FILENAME
+    )
+    parser.add_argument('-p', "--pid",
+        help="PID of the root of the process tree to sample; by default, we wait for a process named COMM",
+        type=int,
+        default=None
+    )
+    parser.add_argument('-c', "--comm",
+        help="Name of the root process to wait for, if no PID is given",
+        default='shadow'
+    )
+    parser.add_argument('-i', "--interval",
+        help="Number of seconds between two samples; each sample writes 64 bytes per process",
+        type=float,
+        default=60.0
+    )
+    parser.add_argument("--no_pss",
+        help="Do not read smaps_rollup, which is the most expensive part of a sample",
+        action='store_true'
+    )
+    args = parser.parse_args()
+    run(args)
+
+def run(args):
+    # a kill only stops the loop after the current sample, instead of exiting
+    # in the middle of a write, so the output only has whole records
+    stop = []
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda signum, frame: stop.append(signum))
+    # python resumes a time.sleep that a signal interrupted, so we wait on a
+    # pipe instead, to which the signals are also written, to wake up at once
+    wakeup_fd = get_signal_wakeup_fd()
+
+    root_pid = args.pid
+    while root_pid == None and len(stop) == 0:
+        root_pid = find_pid_by_comm(args.comm)
+        if root_pid == None:
+            select.select([wakeup_fd], [], [], min(args.interval, 0.5))
+
+    if root_pid == None:
+        return
+
+    with open(args.output, 'wb') as outf:
+        outf.write(PROCSAMPLER_HEADER.pack(PROCSAMPLER_MAGIC, args.interval, os.sysconf('SC_CLK_TCK'), root_pid))
+        outf.flush()
+
+        next_sample = time.monotonic()
+        while len(stop) == 0:
+            now = time.time()
+            procs = sample_procs(root_pid, not args.no_pss)
+            if root_pid not in procs:
+                # the root exited, so the experiment is done
+                break
+
+            outf.write(b''.join(PROCSAMPLER_RECORD.pack(now, pid, *values) for pid, values in procs.items()))
+            outf.flush()
+
+            next_sample += args.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                select.select([wakeup_fd], [], [], delay)
+            else:
+                next_sample = time.monotonic()
+
+def get_signal_wakeup_fd():
+    # returns the read end of a pipe that becomes readable when a signal arrives
+    rfd, wfd = os.pipe()
+    os.set_blocking(wfd, False)
+    signal.set_wakeup_fd(wfd)
+    return rfd
+
+def read_proc_file(path):
+    # returns the contents of a small /proc file, or None if the process exited;
+    # the raw fd calls avoid the overhead of python file objects, which adds up
+    # over tens of thousands of processes
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, 2**13)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+def find_pid_by_comm(comm):
+    target = comm.encode() + b'\n'
+    with os.scandir('/proc') as it:
+        for entry in it:
+            if entry.name.isdigit() and read_proc_file(f'/proc/{entry.name}/comm') == target:
+                return int(entry.name)
+    return None
+
+def parse_stat(data):
+    # returns the ppid, utime, stime and rss (in bytes) of a /proc/pid/stat; the
+    # command name may contain spaces and parentheses, so skip past the last ')'
+    fields = data[data.rindex(b')')+2:].split()
+    return int(fields[1]), int(fields[11]), int(fields[12]), int(fields[21]) * PAGE_SIZE
+
+def parse_proc_value(data, key):
+    # returns the value of a "key: value [kB]" line, in bytes if it is in kB
+    i = data.find(key)
+    if i < 0:
+        return 0
+    start = i + len(key)
+    fields = data[start:data.find(b'\n', start)].split()
+    value = int(fields[0])
+    return value * 1024 if len(fields) > 1 and fields[1] == b'kB' else value
+
+def get_ctx_switches(pid):
+    # the counts in /proc/pid/status are only those of the main thread
+    data = read_proc_file(f'/proc/{pid}/status') or b''
+    return parse_proc_value(data, b'\nvoluntary_ctxt_switches:'), parse_proc_value(data, b'\nnonvoluntary_ctxt_switches:')
+
+def get_all_thread_ctx_switches(pid):
+    vcsw, nvcsw = 0, 0
+    try:
+        with os.scandir(f'/proc/{pid}/task') as it:
+            for entry in it:
+                data = read_proc_file(f'/proc/{pid}/task/{entry.name}/status') or b''
+                vcsw += parse_proc_value(data, b'\nvoluntary_ctxt_switches:')
+                nvcsw += parse_proc_value(data, b'\nnonvoluntary_ctxt_switches:')
+    except OSError:
+        pass
+    return vcsw, nvcsw
+
+def sample_procs(root_pid, with_pss=True):
+    # returns the values of a record for every process in the tree under
+    # root_pid, keyed by pid
+
+    # a single pass over /proc reads the stat of every process, which holds
+    # its parent, so that we can find the tree without walking it in /proc
+    stats = {}
+    with os.scandir('/proc') as it:
+        for entry in it:
+            if not entry.name.isdigit():
+                continue
+            data = read_proc_file(f'/proc/{entry.name}/stat')
+            if data != None:
+                stats[int(entry.name)] = parse_stat(data)
+
+    if root_pid not in stats:
+        return {}
+
+    children = {}
+    for pid, (ppid, _, _, _) in stats.items():
+        children.setdefault(ppid, []).append(pid)
+
+    tree = [root_pid]
+    i = 0
+    while i < len(tree):
+        tree.extend(children.get(tree[i], []))
+        i += 1
+
+    procs = {}
+    for pid in tree:
+        ppid, utime, stime, rss = stats[pid]
+
+        pss = PSS_UNKNOWN
+        if with_pss:
+            data = read_proc_file(f'/proc/{pid}/smaps_rollup')
+            if data != None:
+                pss = parse_proc_value(data, b'\nPss:')
+
+        # shadow is heavily multi-threaded, while the plugins mostly are not
+        if pid == root_pid:
+            vcsw, nvcsw = get_all_thread_ctx_switches(pid)
+        else:
+            vcsw, nvcsw = get_ctx_switches(pid)
+
+        procs[pid] = (ppid, rss, pss, utime, stime, vcsw, nvcsw)
+
+    return procs
+
+if __name__ == '__main__':
+    sys.exit(main())
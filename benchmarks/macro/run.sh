@@ -1,5 +1,11 @@
 set -euo pipefail
 
+basedir=$(pwd)
+# seconds between two samples of the memory usage
+mem_interval=${MEM_INTERVAL:-0.1}
+# seconds between two samples of the shadow and plugin processes
+proc_interval=${PROC_INTERVAL:-60}
+
 cd exps
 echo $RUNHOST > runner_hostname.txt
 count=0
@@ -11,14 +17,21 @@ do
     do
         count=$((count+1))
         cd ${d}
-        bash ../free_cmd.sh &
-        free_pid=$!
+        python3 ${basedir}/memsampler.py --output mem.bin --interval ${mem_interval} &
+        mem_pid=$!
+        # waits for shadow to start, and exits when it does
+        python3 ${basedir}/procsampler.py --output procs.bin --interval ${proc_interval} &
+        proc_pid=$!
         date
         echo "progress = ${count}"
         pwd
         cat shadow_cmd.sh
         bash shadow_cmd.sh
-        kill -9 ${free_pid} 1>/dev/null 2>/dev/null
+        # not -9, so the sampler writes its buffered samples before exiting
+        kill ${mem_pid} 1>/dev/null 2>/dev/null
+        wait ${mem_pid} 1>/dev/null 2>/dev/null || true
+        kill ${proc_pid} 1>/dev/null 2>/dev/null || true
+        wait ${proc_pid} 1>/dev/null 2>/dev/null || true
         cd ..
     done
     cd ..
@@ -0,0 +1 @@
+../stats_common.py
\ No newline at end of file
@@ -1,14 +1,22 @@
 import sys
 import json
+import argparse
 
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
-from scipy.stats import linregress
+from results_db import open_results_db, select_metric
+from metric_cube import load_metric_cube, select_results
 
 def main():
-    db = TinyDB(storage=MemoryStorage)
-    with open("phase6.json", 'r') as inf:
-        db.insert_multiple(json.load(inf))
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--db",
+        help="Query the phase6 results from this sqlite database (see combine.py --db) instead of loading phase6.json",
+        default=None
+    )
+    args = parser.parse_args()
+
+    if args.db != None:
+        db = open_results_db(args.db)
+    else:
+        db = load_metric_cube("phase6.json")
 
     run(db, 'perf_duration-time-sec')
     run(db, 'seconds_to_init')
@@ -34,32 +42,46 @@ def run(db, metric):
 
 
 def run_regression(label, x, y):
+    # imported here, since it is by far the slowest import of this script
+    from scipy.stats import linregress
     slope, intercept, r_value, p_value, std_err = linregress(x, y)
     print(f'label: {label}\n\tslope: {slope}\n\tr: {r_value}\n\tr2: {r_value**2}\n\tp: {p_value}')
 
 def select(db, eq, im, metric):
-    q = Query()
-
-    records = db.search(
-        (q.exe.msgload == 100) &
-        (q.exe.quantity == eq) &
-        (q.exe.weights == 'skewed') &
-        (q.interpose_method == im) &
-        (q.num_workers == 28) &
-        (q.scheduling_policy == 'host') &
-        (q.use_memory_manager == (None if im == 'classic' else True)) &
-        (q.use_pinning == True) &
-        (q.use_realtime == False) &
-        (q.use_syscall_preloading == (None if im == 'classic' else True))
-    )
+    if not isinstance(db, dict):
+        return select_from_results_db(db, eq, im, metric)
+
+    results = select_results(db,
+        msgload=100,
+        quantity=eq,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=28,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True))
+
+    return results[metric]['mean']
+
+def select_from_results_db(db, eq, im, metric):
+    # the same query, but only the matching rows are read from the database
+    rows = select_metric(db, metric, 'mean', source='phase6',
+        msgload=100,
+        quantity=eq,
+        weights='skewed',
+        interpose_method=im,
+        num_workers=28,
+        scheduling_policy='host',
+        use_memory_manager=(None if im == 'classic' else True),
+        use_pinning=True,
+        use_realtime=False,
+        use_syscall_preloading=(None if im == 'classic' else True))
 
-    #print(json.dumps(records, sort_keys=True, indent=2))
-    assert len(records) == 1
+    assert len(rows) == 1
+    return rows[0][1]
 
-    result = records[0]['~results'][metric]
-    #print(json.dumps(result, sort_keys=True, indent=2))
-    return result['mean']
-    
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -1,54 +1,223 @@
 import sys
 import os
+import argparse
 import json
+import time
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 
-from numpy import mean, median, std, var, percentile
+import numpy
+
+from collect_common import *
+from stats_common import get_stats
+from results_db import open_results_db, store_records
+import latency_sketch
+import collect_common
+import stats_common
+
+# the number of latencies that are buffered before they are added to a sketch
+SKETCH_BATCH_SIZE = 2**16
 
 def main():
-    process_benchmark('exps')
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', "--base_directory", 
+        help="Path to a directory containing shadow microbenchmark results",
+        default='exps'
+    )
+    parser.add_argument('-o', "--prefix_name", 
+        help="Prefix for the json output file",
+        default='results'
+    )
+    parser.add_argument('-j', "--jobs", 
+        help="Number of worker processes used to parse experiment directories in parallel",
+        type=int,
+        default=1
+    )
+    parser.add_argument("--sketch", 
+        help="Accumulate the latencies into mergeable log-bucketed histograms, with bounded memory, and store them with the stats",
+        action='store_true'
+    )
+    parser.add_argument("--jsonl", 
+        help="Write the results as json lines (one experiment per line) to PREFIX_NAME.jsonl",
+        action='store_true'
+    )
+    parser.add_argument("--append", 
+        help="Append the experiments that are not yet in PREFIX_NAME.jsonl instead of rewriting it; implies --jsonl",
+        action='store_true'
+    )
+    parser.add_argument("--cache_dir", 
+        help="Directory in which parsed experiments are cached, so unchanged experiments are not parsed again",
+        default=DEFAULT_CACHE_DIR
+    )
+    parser.add_argument("--no_cache", 
+        help="Do not read or write the parse cache",
+        action='store_true'
+    )
+    parser.add_argument("--db", 
+        help="Also upsert the results into this sqlite database, as the source named by the basename of PREFIX_NAME",
+        default=None
+    )
+    args = parser.parse_args()
+    process_benchmark(args)
+
+def process_benchmark(args):
+    jsonl = args.jsonl or args.append
+    outname = f'{args.prefix_name}.jsonl' if jsonl else f'{args.prefix_name}.json'
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    # the stats are computed by the shared modules, so their code is part of
+    # the cache fingerprints too
+    source_digest = get_source_digest(__file__, latency_sketch.__file__, collect_common.__file__, stats_common.__file__)
+    options = {'sketch': args.sketch}
+    paths = find_sims(args.base_directory)
+    fingerprints = {path: get_sim_fingerprint(path, source_digest, options) for path in paths}
+
+    append = args.append and os.path.exists(outname)
+    manifest = load_manifest(outname) if append else {}
+    if append:
+        changed = [path for path in paths if os.path.basename(path) in manifest and \
+            manifest[os.path.basename(path)] != fingerprints[path]]
+        if len(changed) > 0:
+            print(f"{len(changed)} experiments changed since they were written to {outname}, rewriting it")
+            append, manifest = False, {}
+        else:
+            paths = [path for path in paths if os.path.basename(path) not in manifest]
+            print(f"Skipping {len(manifest)} experiments that are already in {outname}")
+
+    records = process_sims(paths, fingerprints, args.sketch, args.jobs, cache_dir, manifest)
+    if args.db != None:
+        db = open_results_db(args.db)
+        records = store_records(db, os.path.basename(args.prefix_name), records)
+    count = write_results(outname, records, jsonl=jsonl, append=append)
+    print(f"Wrote {count} experiments to {outname}")
 
-def process_benchmark(dirname):
-    data = process_sims(dirname)
-    with open('results.json', 'w') as outf:
-        json.dump(data, outf, sort_keys=True, indent=2)
+    if jsonl:
+        save_manifest(outname, manifest)
 
-def process_sims(dirname):
-    data = []
+def find_sims(dirname):
+    paths = []
 
-    for name in os.listdir(dirname):
+    # sort so that the results and the manifest are in a deterministic order
+    for name in sorted(os.listdir(dirname)):
         path = os.path.join(dirname, name)
 
         if 'shadow_' not in name or os.path.isfile(path):
             continue
 
-        with open(os.path.join(path, 'shadow.json'), 'r') as inf:
-            shadow_json = json.load(inf)
+        paths.append(path)
 
-        peerdir = os.path.join(path, 'shadow.data/hosts/peer')
-        peerstdout = ''
-        for name in os.listdir(peerdir):
-            if 'peer' in name and 'stdout' in name and 'benchmark' in name:
-                peerstdout = os.path.join(peerdir, name)
-                break
+    return paths
+
+def find_peer_stdouts(path):
+    # the stdout of every benchmark process on every host, e.g., of peer1 to
+    # peerN if the config runs N peers, in a deterministic order
+    hostsdir = os.path.join(path, 'shadow.data/hosts')
+    filepaths = []
+    for hostname in sorted(os.listdir(hostsdir)):
+        hostdir = os.path.join(hostsdir, hostname)
+        if not os.path.isdir(hostdir):
+            continue
+        names = {strip_log_suffix(name) for name in os.listdir(hostdir) if 'benchmark' in name and 'stdout' in name}
+        filepaths.extend(os.path.join(hostdir, name) for name in sorted(names))
+    return filepaths
 
-        perf_stats = parse_shadow_stderr(os.path.join(path, 'stderr'))
-        syscall_counts = parse_shadow_stdout(os.path.join(path, 'stdout'))
-        noop_stats, bmark_stats = parse_peer_stdout(peerstdout)
+def get_sim_fingerprint(path, source_digest, options):
+    filepaths = [os.path.join(path, name) for name in ['shadow.json', 'stderr', 'stdout']]
+    filepaths.extend(find_peer_stdouts(path))
+    return get_fingerprint(filepaths, source_digest, options)
+
+def process_sims(paths, fingerprints, use_sketch=False, num_jobs=1, cache_dir=None, manifest={}):
+    # yields the parsed experiments in the order of paths, and records each
+    # yielded experiment in the manifest
+
+    # the shadow logs and every peer stdout of an experiment are parsed as
+    # separate jobs, so that the workers are also kept busy by a few
+    # experiments with many peers
+    cached, jobs, num_sim_jobs = {}, [], {}
+    for path in paths:
+        shadow_json = load_cached(cache_dir, path, fingerprints[path]) if cache_dir != None else None
+        if shadow_json != None:
+            cached[path] = shadow_json
+            continue
+        sim_jobs = [('shadow', path, use_sketch)] + [('peer', filepath, use_sketch) for filepath in find_peer_stdouts(path)]
+        jobs.extend(sim_jobs)
+        num_sim_jobs[path] = len(sim_jobs)
 
-        shadow_json['~results'] = {
-            'perf': perf_stats,
-            'bmark': bmark_stats,
-            'noop': noop_stats,
-            'syscalls': syscall_counts,
-        }
+    if num_jobs > 1:
+        with Pool(processes=num_jobs) as pool:
+            # imap yields in input order, so the jobs of each experiment arrive together
+            yield from merge_sim_jobs(paths, pool.imap(run_job, jobs), cached, num_sim_jobs, fingerprints, cache_dir, manifest)
+    else:
+        yield from merge_sim_jobs(paths, map(run_job, jobs), cached, num_sim_jobs, fingerprints, cache_dir, manifest)
 
-        data.append(shadow_json)
+def merge_sim_jobs(paths, results, cached, num_sim_jobs, fingerprints, cache_dir, manifest):
+    for path in paths:
+        if path in cached:
+            print(f"Loaded {path} from cache")
+            shadow_json = cached[path]
+        else:
+            sim_results = [next(results) for _ in range(num_sim_jobs[path])]
+            elapsed = sum(result[1] for result in sim_results)
+            shadow_json = merge_sim_results([result[0] for result in sim_results])
+            print(f"Parsed {path} and {len(sim_results) - 1} peer logs in {elapsed:.3f} seconds")
+            if cache_dir != None:
+                store_cached(cache_dir, path, fingerprints[path], shadow_json)
+        manifest[os.path.basename(path)] = fingerprints[path]
+        yield shadow_json
 
-    return data
+def run_job(job):
+    kind, path, use_sketch = job
+    start = time.perf_counter()
+    if kind == 'shadow':
+        result = process_sim(path)
+    else:
+        result = parse_peer_stdout(path, use_sketch)
+    return result, time.perf_counter() - start
+
+def process_sim(path):
+    with open(os.path.join(path, 'shadow.json'), 'r') as inf:
+        shadow_json = json.load(inf)
+
+    # the logs may be compressed, so parse them concurrently to decompress
+    # them in parallel (the decompressors release the GIL)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        perf_future = executor.submit(parse_shadow_stderr, os.path.join(path, 'stderr'))
+        syscall_future = executor.submit(parse_shadow_stdout, os.path.join(path, 'stdout'))
+
+    shadow_json['~results'] = {
+        'perf': perf_future.result(),
+        'syscalls': syscall_future.result(),
+    }
+
+    return shadow_json
+
+def merge_sim_results(results):
+    # merges the latencies of all peers of an experiment into its results
+    shadow_json, peer_results = results[0], results[1:]
+    assert len(peer_results) > 0, f"no benchmark stdout in {shadow_json['label']}"
+    noop_stats, bmark_stats = merge_peer_latencies(peer_results)
+    shadow_json['~results']['bmark'] = bmark_stats
+    shadow_json['~results']['noop'] = noop_stats
+    shadow_json['~results']['num_peers'] = len(peer_results)
+    return shadow_json
+
+def merge_peer_latencies(peer_results):
+    noops, funcs = zip(*peer_results)
+    # the sketches of the peers merge exactly
+    if isinstance(noops[0], dict):
+        return latency_sketch.get_sketch_stats(latency_sketch.merge_sketches(noops)), \
+            latency_sketch.get_sketch_stats(latency_sketch.merge_sketches(funcs))
+    return get_latency_stats(numpy.concatenate(noops)), get_latency_stats(numpy.concatenate(funcs))
+
+def get_latency_stats(usecs):
+    # a benchmark may not have logged any latencies, e.g., if it failed early
+    if len(usecs) == 0:
+        return {'count': 0}
+    return get_stats(usecs, with_sum=False)
 
 def parse_shadow_stderr(filepath):
     d = {}
-    with open(filepath, 'r') as inf:
+    with open_log(filepath, 'r') as inf:
         for line in inf:
             if line[0] == '*':
                 continue
@@ -69,7 +238,7 @@ def parse_shadow_stderr(filepath):
 def parse_shadow_stdout(filepath):
     d = {}
     token = "Global syscall counts: "
-    with open(filepath, 'r') as inf:
+    with open_log(filepath, 'r') as inf:
         for line in inf:
             if token in line:
                 line = line.strip()
@@ -83,10 +252,14 @@ def parse_shadow_stdout(filepath):
                 break
     return d
 
-def parse_peer_stdout(filepath):
+def parse_peer_stdout(filepath, use_sketch=False):
+    # returns the noop and function call latencies of a peer, as sketches or
+    # arrays that merge_peer_latencies merges with those of the other peers
     noop_usecs = []
     func_usecs = []
-    with open(filepath, 'r') as inf:
+    noop_sketch = latency_sketch.new_sketch()
+    func_sketch = latency_sketch.new_sketch()
+    with open_log(filepath, 'r') as inf:
         for line in inf:
             if 'Time spent in' in line and 'function call' in line:
                 parts = line.strip().split()
@@ -98,21 +271,18 @@ def parse_peer_stdout(filepath):
                 elif 'no-op function call' in line:
                     noop_usecs.append(usec)
 
-    return get_stats(noop_usecs), get_stats(func_usecs)
-
-def get_stats(usecs):
-    stats = {
-        'count': len(usecs),
-        'min': min(usecs),
-        'max': max(usecs),
-        'mean': mean(usecs),
-        'median': median(usecs),
-        'std': std(usecs),
-        'var': var(usecs),
-    }
-    for p in range(5, 100, 5):
-        stats[f'p{p}'] = percentile(usecs, p)
-    return stats
+                # only a bounded batch of latencies is kept in memory with sketches
+                if use_sketch and len(noop_usecs) + len(func_usecs) >= SKETCH_BATCH_SIZE:
+                    latency_sketch.add_values(noop_sketch, noop_usecs)
+                    latency_sketch.add_values(func_sketch, func_usecs)
+                    noop_usecs, func_usecs = [], []
+
+    if use_sketch:
+        latency_sketch.add_values(noop_sketch, noop_usecs)
+        latency_sketch.add_values(func_sketch, func_usecs)
+        return noop_sketch, func_sketch
+
+    return numpy.array(noop_usecs, dtype=numpy.float64), numpy.array(func_usecs, dtype=numpy.float64)
 
 if __name__ == '__main__':
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1 @@
+../collect_common.py
\ No newline at end of file
@@ -0,0 +1,144 @@
+import math
+
+import numpy
+
+# A log-bucketed latency histogram in the style of HdrHistogram and DDSketch.
+# A value v > 0 is counted in bucket ceil(log(v) / log(gamma)), where gamma is
+# derived from the relative accuracy, so every quantile estimate is within that
+# relative accuracy of a true sample. The number of buckets only grows with the
+# log of the range of the values, not with the number of values, and sketches
+# with the same accuracy merge exactly by adding up their bucket counts. The
+# count, min, max, mean and variance are tracked exactly on the side.
+
+DEFAULT_RELATIVE_ACCURACY = 0.001
+
+# the percentiles reported in the stats of a sketch
+SKETCH_PERCENTILES = [p for p in range(5, 100, 5)] + [99, 99.9]
+
+def new_sketch(relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    return {
+        'relative_accuracy': relative_accuracy,
+        'count': 0,
+        'zero_count': 0,
+        'min': math.inf,
+        'max': -math.inf,
+        'mean': 0.0,
+        'm2': 0.0,
+        'bins': {},
+    }
+
+def get_gamma(sketch):
+    a = sketch['relative_accuracy']
+    return (1 + a) / (1 - a)
+
+def add_values(sketch, values):
+    # adds a batch of values >= 0, e.g., latencies, to the sketch
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if len(values) == 0:
+        return sketch
+
+    positive = values[values > 0]
+    sketch['zero_count'] += len(values) - len(positive)
+
+    indexes = numpy.ceil(numpy.log(positive) / math.log(get_gamma(sketch))).astype(numpy.int64)
+    keys, counts = numpy.unique(indexes, return_counts=True)
+    bins = sketch['bins']
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        bins[key] = bins.get(key, 0) + count
+
+    sketch['min'] = min(sketch['min'], float(values.min()))
+    sketch['max'] = max(sketch['max'], float(values.max()))
+    merge_moments(sketch, len(values), float(values.mean()), float(((values - values.mean())**2).sum()))
+    return sketch
+
+def merge_moments(sketch, count, mean, m2):
+    # Chan et al.'s pairwise update, so the variance of merged sketches does
+    # not suffer from the cancellation of a sum of squares
+    if sketch['count'] == 0:
+        # exact, so that merging a single sketch does not change its moments
+        sketch['count'], sketch['mean'], sketch['m2'] = count, mean, m2
+        return
+    total = sketch['count'] + count
+    delta = mean - sketch['mean']
+    sketch['mean'] += delta * count / total
+    sketch['m2'] += m2 + delta**2 * sketch['count'] * count / total
+    sketch['count'] = total
+
+def merge_sketches(sketches):
+    # returns a new sketch holding the values of all of the given sketches,
+    # e.g., of several peers or trials of the same benchmark
+    merged = new_sketch(sketches[0]['relative_accuracy'])
+    for sketch in sketches:
+        assert sketch['relative_accuracy'] == merged['relative_accuracy'], "cannot merge sketches of different accuracies"
+        if sketch['count'] == 0:
+            continue
+        for key, count in sketch['bins'].items():
+            merged['bins'][key] = merged['bins'].get(key, 0) + count
+        merged['zero_count'] += sketch['zero_count']
+        merged['min'] = min(merged['min'], sketch['min'])
+        merged['max'] = max(merged['max'], sketch['max'])
+        merge_moments(merged, sketch['count'], sketch['mean'], sketch['m2'])
+    return merged
+
+def get_quantile(sketch, q):
+    # returns the estimated value at quantile q in [0, 1], using the same rank
+    # as the lower value of numpy.percentile's linear interpolation
+    assert sketch['count'] > 0, "the sketch is empty"
+    rank = q * (sketch['count'] - 1)
+
+    seen = sketch['zero_count']
+    if rank < seen:
+        return 0.0
+
+    gamma = get_gamma(sketch)
+    for key in sorted(sketch['bins']):
+        seen += sketch['bins'][key]
+        if rank < seen:
+            # the value with the smallest relative error to all values in the bucket
+            value = 2 * gamma**key / (gamma + 1)
+            return min(max(value, sketch['min']), sketch['max'])
+
+    return sketch['max']
+
+def get_sketch_stats(sketch):
+    # the same stats as stats_common.get_stats, plus the tail percentiles and the
+    # sketch itself
+    if sketch['count'] == 0:
+        # an empty sketch has no values to summarize, same as an empty list in
+        # collect.get_latency_stats
+        return {'count': 0, 'sketch': sketch_to_json(sketch)}
+    stats = {
+        'count': sketch['count'],
+        'min': sketch['min'],
+        'max': sketch['max'],
+        'mean': sketch['mean'],
+        'median': get_quantile(sketch, 0.5),
+        'std': math.sqrt(sketch['m2'] / sketch['count']),
+        'var': sketch['m2'] / sketch['count'],
+        'sketch': sketch_to_json(sketch),
+    }
+    for p in SKETCH_PERCENTILES:
+        stats[f'p{p}'] = get_quantile(sketch, p / 100.0)
+    return stats
+
+def sketch_to_json(sketch):
+    d = {k: sketch[k] for k in sketch if k != 'bins'}
+    d['bins'] = [[key, sketch['bins'][key]] for key in sorted(sketch['bins'])]
+    if sketch['count'] == 0:
+        # json has no infinity, and an empty sketch has no min and max
+        d['min'], d['max'] = None, None
+    return d
+
+def sketch_from_json(d):
+    # the inverse of sketch_to_json, e.g., to merge the sketches that are stored
+    # in the results of several trials
+    sketch = {k: d[k] for k in d if k != 'bins'}
+    sketch['bins'] = {key: count for key, count in d['bins']}
+    if sketch['count'] == 0:
+        sketch['min'], sketch['max'] = math.inf, -math.inf
+    return sketch
+
+def merge_sketch_stats(stats_list):
+    # merges the stats of get_sketch_stats through their stored sketches, so
+    # the merged percentiles are the same as those of a sketch of all values
+    return get_sketch_stats(merge_sketches([sketch_from_json(stats['sketch']) for stats in stats_list]))
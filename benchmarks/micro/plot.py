@@ -1,18 +1,39 @@
 import sys
+import os
 import json
+import argparse
 from math import sqrt
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
 
-from scipy.stats import t as studentst
-
 from plot_common import *
+from collect_common import load_results
+from results_db import RESULTS_DB_FILENAME, open_results_db, select_records, get_sources
+from latency_sketch import merge_sketch_stats
 
 def main():
-    with open("results.json", 'r') as inf:
-        db = json.load(inf)
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--source",
+        help="The source of the results in the sqlite database, i.e., the basename of the PREFIX_NAME of collect.py --db",
+        default='results'
+    )
+    args = parser.parse_args()
+
+    # collect.py --jsonl writes results.jsonl instead, and collect.py --db
+    # writes the results into an sqlite database
+    if os.path.exists("results.json"):
+        db = load_results("results.json")
+    elif os.path.exists(RESULTS_DB_FILENAME):
+        # a database may hold several collects, whose results must not be mixed
+        results_db = open_results_db(RESULTS_DB_FILENAME)
+        sources = get_sources(results_db)
+        assert args.source in sources, f"{RESULTS_DB_FILENAME} has no source '{args.source}', use one of {', '.join(sources)}"
+        db = select_records(results_db, source=args.source)
+    else:
+        db = load_results("results.jsonl")
+    db = index_results(db)
 
     #return test(db)
 
@@ -27,6 +48,8 @@ def main():
     #plot_bmark_memmgr(db, "memmgr-old.pdf")
     #plot_bmark_cpusched_grouped(db, 'cpusched.pdf')
 
+    report_peak_rss('plot.py')
+
 def test(db):
     result = select(db,
         "SYSCALL", 
@@ -43,20 +66,18 @@ def test(db):
     print(json.dumps(result, sort_keys=True, indent=2))
 
 def plot_bmark_interpose(db, filename):
-    pyplot.figure()
-
-    names = ['only ptrace', 'preload+ptrace', 'only seccomp', 'preload+seccomp', 'uni-process']
-    colors = ['C0', 'C1', 'C2', 'C3', 'C4']
+    with render_figure(filename):
+        names = ['only ptrace', 'preload+ptrace', 'only seccomp', 'preload+seccomp', 'uni-process']
+        colors = ['C0', 'C1', 'C2', 'C3', 'C4']
 
-    pyplot.subplot(131)
-    plot_bmark_interpose_helper(db, names, colors, "SYSCALL", True, None, "blocking nanosleep", ylabel=True)
-    pyplot.subplot(132)
-    plot_bmark_interpose_helper(db, names, colors, "SYSCALL", False, None, "nonblocking nanosleep")
-    pyplot.subplot(133)
-    plot_bmark_interpose_helper(db, names, colors, "BUFFER", None, 1024, "1k write+read")
+        pyplot.subplot(131)
+        plot_bmark_interpose_helper(db, names, colors, "SYSCALL", True, None, "blocking nanosleep", ylabel=True)
+        pyplot.subplot(132)
+        plot_bmark_interpose_helper(db, names, colors, "SYSCALL", False, None, "nonblocking nanosleep")
+        pyplot.subplot(133)
+        plot_bmark_interpose_helper(db, names, colors, "BUFFER", None, 1024, "1k write+read")
 
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(filename)
+        pyplot.tight_layout(pad=0.3)
 
 def plot_bmark_interpose_helper(db, names, colors, mode, is_block, nbytes, title, ylabel=False):
     vals, errs = [], []
@@ -93,71 +114,67 @@ def get_interpose_result(db, vals, errs, mode, method, is_block, is_preloaded, n
     errs.append(e)
 
 def plot_bmark_memmgr(db, filename):
-    pyplot.figure()
-
-    names = ['ptrace', 'preload+ptrace', 'seccomp', 'preload+seccomp']
-
-    vals, errs = [], []
-    get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=False, use_memmgr=False, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=True, use_memmgr=False, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=False, use_memmgr=False, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=True, use_memmgr=False, nbytes=16384)
-
-    pos = list(range(len(vals)))
-    width = 0.33
-
-    rects = pyplot.bar(pos, vals, yerr=errs,
-        width=width,
-        color='C1',
-        capsize=0.5,
-        error_kw={'linewidth': 0.5},
-        label="proc vm copy")
-    pyplot.gca().bar_label(rects, label_type='edge', padding=1, fontsize=6)
-
-    vals, errs = [], []
-    get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=False, use_memmgr=True, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=True, use_memmgr=True, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=False, use_memmgr=True, nbytes=16384)
-    get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=True, use_memmgr=True, nbytes=16384)
-    
-    rects = pyplot.bar([p+width for p in pos], vals, yerr=errs,
-        width=width,
-        color='C0',
-        #alpha=0.5,
-        capsize=0.5,
-        error_kw={'linewidth': 0.5},
-        label="mem map copy")
-    pyplot.gca().bar_label(rects, label_type='edge', padding=2, fontsize=6)
-    
-    ticks = [p + width/2 for p in pos]
-    pyplot.xticks(ticks, names)#, rotation=COMMON_ROTATION, ha='right')
-    pyplot.title("16k write+read")
-    pyplot.ylabel("Benchmark Time (us)", horizontalalignment='right', y=1.2)
-    pyplot.ylim(ymin=0, ymax=30)
+    with render_figure(filename):
+        names = ['ptrace', 'preload+ptrace', 'seccomp', 'preload+seccomp']
+
+        vals, errs = [], []
+        get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=False, use_memmgr=False, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=True, use_memmgr=False, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=False, use_memmgr=False, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=True, use_memmgr=False, nbytes=16384)
+
+        pos = list(range(len(vals)))
+        width = 0.33
+
+        rects = pyplot.bar(pos, vals, yerr=errs,
+            width=width,
+            color='C1',
+            capsize=0.5,
+            error_kw={'linewidth': 0.5},
+            label="proc vm copy")
+        pyplot.gca().bar_label(rects, label_type='edge', padding=1, fontsize=6)
+
+        vals, errs = [], []
+        get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=False, use_memmgr=True, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "ptrace", is_preloaded=True, use_memmgr=True, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=False, use_memmgr=True, nbytes=16384)
+        get_memmgr_result(db, vals, errs, "seccomp", is_preloaded=True, use_memmgr=True, nbytes=16384)
+
+        rects = pyplot.bar([p+width for p in pos], vals, yerr=errs,
+            width=width,
+            color='C0',
+            #alpha=0.5,
+            capsize=0.5,
+            error_kw={'linewidth': 0.5},
+            label="mem map copy")
+        pyplot.gca().bar_label(rects, label_type='edge', padding=2, fontsize=6)
+
+        ticks = [p + width/2 for p in pos]
+        pyplot.xticks(ticks, names)#, rotation=COMMON_ROTATION, ha='right')
+        pyplot.title("16k write+read")
+        pyplot.ylabel("Benchmark Time (us)", horizontalalignment='right', y=1.2)
+        pyplot.ylim(ymin=0, ymax=30)
 
-    pyplot.legend()
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(filename)
+        pyplot.legend()
+        pyplot.tight_layout(pad=0.3)
 
 def plot_bmark_memmgr2(db, filename):
-    pyplot.figure()
-
-    names = ['proc vm', 'proc mmap', 'uni-process']
-    colors = ['C0', 'C1', 'C4']
-
-    pyplot.subplot(141)
-    plot_bmark_memmgr2_helper(db, names, colors, 1<<10, ylabel=True)
-    pyplot.subplot(142)
-    plot_bmark_memmgr2_helper(db, names, colors, 1<<12)
-    pyplot.subplot(143)
-    plot_bmark_memmgr2_helper(db, names, colors, 1<<14)
-    pyplot.subplot(144)
-    plot_bmark_memmgr2_helper(db, names, colors, 1<<16)
-
-    #pyplot.legend()
-    pyplot.tight_layout(pad=0.3)
-    pyplot.subplots_adjust(right=0.975)
-    pyplot.savefig(filename)
+    with render_figure(filename):
+        names = ['proc vm', 'proc mmap', 'uni-process']
+        colors = ['C0', 'C1', 'C4']
+
+        pyplot.subplot(141)
+        plot_bmark_memmgr2_helper(db, names, colors, 1<<10, ylabel=True)
+        pyplot.subplot(142)
+        plot_bmark_memmgr2_helper(db, names, colors, 1<<12)
+        pyplot.subplot(143)
+        plot_bmark_memmgr2_helper(db, names, colors, 1<<14)
+        pyplot.subplot(144)
+        plot_bmark_memmgr2_helper(db, names, colors, 1<<16)
+
+        #pyplot.legend()
+        pyplot.tight_layout(pad=0.3)
+        pyplot.subplots_adjust(right=0.975)
 
 def plot_bmark_memmgr2_helper(db, names, colors, nbytes, ylabel=False):
     vals, errs = [], []
@@ -192,20 +209,18 @@ def get_memmgr_result(db, vals, errs, method, is_preloaded, use_memmgr, nbytes):
     errs.append(e)
 
 def plot_bmark_cpusched(db, filename, method):
-    pyplot.figure()
+    with render_figure(filename):
+        names = ['standard', 'pin+standard', 'realtime', 'pin+realtime']
+        colors = ['C0', 'C1', 'C2', 'C3']
 
-    names = ['standard', 'pin+standard', 'realtime', 'pin+realtime']
-    colors = ['C0', 'C1', 'C2', 'C3']
+        pyplot.subplot(131)
+        plot_bmark_cpusched_helper(db, names, colors, method, "SYSCALL", True, None, "blocking nanosleep", ylabel=True)
+        pyplot.subplot(132)
+        plot_bmark_cpusched_helper(db, names, colors, method, "SYSCALL", False, None, "nonblocking nanosleep")
+        pyplot.subplot(133)
+        plot_bmark_cpusched_helper(db, names, colors, method, "BUFFER", None, 1024, "1k write+read")
 
-    pyplot.subplot(131)
-    plot_bmark_cpusched_helper(db, names, colors, method, "SYSCALL", True, None, "blocking nanosleep", ylabel=True)
-    pyplot.subplot(132)
-    plot_bmark_cpusched_helper(db, names, colors, method, "SYSCALL", False, None, "nonblocking nanosleep")
-    pyplot.subplot(133)
-    plot_bmark_cpusched_helper(db, names, colors, method, "BUFFER", None, 1024, "1k write+read")
-
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(filename)
+        pyplot.tight_layout(pad=0.3)
 
 def plot_bmark_cpusched_helper(db, names, colors, method, mode, is_block, nbytes, title, ylabel=False):
     vals, errs = [], []
@@ -241,30 +256,28 @@ def get_cpusched_result(db, vals, errs, mode, method, is_block, nbytes, is_pin,
     errs.append(e)
 
 def plot_bmark_cpusched_grouped(db, filename):
-    fig = pyplot.figure()
-
-    pyplot.subplot(131)
+    with render_figure(filename) as fig:
+        pyplot.subplot(131)
 
-    plot_bmark_cpusched_grouped_helper(db, get_cpusched_syscall_block)
-    pyplot.title("blocking nanosleep")
-    pyplot.ylabel("Benchmark Time (us)", horizontalalignment='right', y=1.2)
-    #pyplot.ylim(ymax=20)
+        plot_bmark_cpusched_grouped_helper(db, get_cpusched_syscall_block)
+        pyplot.title("blocking nanosleep")
+        pyplot.ylabel("Benchmark Time (us)", horizontalalignment='right', y=1.2)
+        #pyplot.ylim(ymax=20)
 
-    pyplot.subplot(132)
+        pyplot.subplot(132)
 
-    plot_bmark_cpusched_grouped_helper(db, get_cpusched_syscall_nonblock)
-    pyplot.title("nonblocking nanosleep")
-    #pyplot.ylim(ymax=10)
+        plot_bmark_cpusched_grouped_helper(db, get_cpusched_syscall_nonblock)
+        pyplot.title("nonblocking nanosleep")
+        #pyplot.ylim(ymax=10)
 
-    pyplot.subplot(133)
+        pyplot.subplot(133)
 
-    plot_bmark_cpusched_grouped_helper(db, get_cpusched_buffer)
-    pyplot.title("4k write+read")
-    #pyplot.ylim(ymax=15)
+        plot_bmark_cpusched_grouped_helper(db, get_cpusched_buffer)
+        pyplot.title("4k write+read")
+        #pyplot.ylim(ymax=15)
 
-    #pyplot.legend(loc="upper left", ncol=1, bbox_to_anchor=(1.0, 1.0))
-    pyplot.tight_layout(pad=0.3)
-    pyplot.savefig(filename)
+        #pyplot.legend(loc="upper left", ncol=1, bbox_to_anchor=(1.0, 1.0))
+        pyplot.tight_layout(pad=0.3)
 
 def plot_bmark_cpusched_grouped_helper(db, metric_func):
     vals, errs = metric_func(db, is_pin=False, is_realtime=False)
@@ -339,35 +352,47 @@ def get_cpusched_buffer(db, is_pin, is_realtime):
 
     return [round(v, 2) for v in vals], errs
 
-def select(sim_list, mode, is_block, nbytes, method, 
+# the config fields that select() matches, in the order of its arguments
+SELECT_FIELDS = [
+    ('exe', 'mode'),
+    ('exe', 'is_blocking'),
+    ('exe', 'nbytes'),
+    ('interpose_method',),
+    ('use_realtime',),
+    ('use_pinning',),
+    ('use_single_core',),
+    ('use_syscall_preloading',),
+    ('use_shim_syscall_handler',),
+    ('use_memory_manager',),
+]
+
+def get_select_key(sim):
+    key = []
+    for path in SELECT_FIELDS:
+        value = sim
+        for name in path:
+            value = value[name]
+        key.append(value)
+    return tuple(key)
+
+def index_results(sim_list):
+    # groups the sims by the fields that select() matches, once at load, so
+    # that every select is a dict lookup instead of a scan over all sims
+    index = {}
+    for sim in sim_list:
+        index.setdefault(get_select_key(sim), []).append(sim)
+    return index
+
+def select(index, mode, is_block, nbytes, method, 
         is_realtime, is_pin, is_singlecore,
         is_preloaded, use_shimsys, use_memmgr):
-    results = []
-    sims_with_results = []
+    key = (mode, is_block, nbytes, method, is_realtime, is_pin, is_singlecore, is_preloaded, use_shimsys, use_memmgr)
+    sims_with_results = index.get(key, [])
+    results = [sim['~results'] for sim in sims_with_results]
 
-    for sim in sim_list:
-        if sim['exe']['mode'] != mode:
-            continue
-        if sim['exe']['is_blocking'] != is_block:
-            continue
-        if sim['exe']['nbytes'] != nbytes:
-            continue
-        if sim['interpose_method'] != method:
-            continue
-        if sim['use_realtime'] != is_realtime:
-            continue
-        if sim['use_pinning'] != is_pin:
-            continue
-        if sim['use_single_core'] != is_singlecore:
-            continue
-        if sim['use_syscall_preloading'] != is_preloaded:
-            continue
-        if sim['use_shim_syscall_handler'] != use_shimsys:
-            continue
-        if sim['use_memory_manager'] != use_memmgr:
-            continue
-        results.append(sim['~results'])
-        sims_with_results.append(sim)
+    # the trials of a benchmark that were collected with --sketch merge exactly
+    if len(results) > 1 and all('sketch' in r[name] for r in results for name in ['bmark', 'noop']):
+        return {name: merge_sketch_stats([r[name] for r in results]) for name in ['bmark', 'noop']}
 
     if len(results) != 1:
         print('######################################################################################')
@@ -390,9 +415,8 @@ def compute_diff_mean_and_error(result, confidence_level=0.99):
     v = v1/n1 + v2/n2
     s = sqrt(v)
 
-    level = two_to_one_sided_confidence_level(confidence_level)
     deg_freedom = min(n1, n2) - 1
-    t = studentst.ppf(level, deg_freedom)
+    t = get_t_quantile(confidence_level, deg_freedom)
     e = t * s
 
     if m < 0: # the mean can't be a negative time
@@ -404,4 +428,4 @@ def compute_diff_mean_and_error(result, confidence_level=0.99):
     return m, e
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1 @@
+../results_db.py
\ No newline at end of file
@@ -1,30 +1,45 @@
+import os
+import shutil
 from math import sqrt
+from contextlib import contextmanager
+import resource
 
 import matplotlib
-from scipy.stats import t as studentst
+
+from stats_common import two_to_one_sided_confidence_level, get_t_quantile, \
+    compute_mean_and_error_arrays, compute_diff_mean_and_error_arrays, \
+    compute_bootstrap_error_arrays, pad_values
 
 COMMON_ROTATION=35
 COMMON_ROTATION2=45
 
-# The scipy t.ppf distributed is for one-sided hypothesis tests.
-# If we want to compute a two-sided error, then we must convert a two-sided
-# confidence level to an equivalent one-side confidence level for scipy.
-def two_to_one_sided_confidence_level(two_sided_level):
-    return two_sided_level / 2.0 + 0.5
-
 def compute_mean_and_error(result, confidence_level=0.99):
     n = result['count']
     m = result['mean']
     s = result['std']
     #sem = s / sqrt(n) # equivalent to scipy.stats.sem(trial_values)
 
-    level = two_to_one_sided_confidence_level(confidence_level)
-    t = studentst.ppf(level, n-1)
+    t = get_t_quantile(confidence_level, n-1)
     e = t * s / sqrt(n)
 
     # symmetric error
     return m, e
 
+def compute_means_and_errors(results, confidence_level=0.99, method='t'):
+    # same as compute_mean_and_error, for a list of results at once; the method
+    # may also be 'percentile' or 'bca' for bootstrap CIs from the trial values
+    # that combine.py keeps, whose errors are the [lower, upper] rows of a yerr
+    if method != 't':
+        m, e = compute_bootstrap_error_arrays(pad_values([result['values'] for result in results]),
+            confidence_level, method)
+        return m.tolist(), e.tolist()
+
+    counts = [result['count'] for result in results]
+    means = [result['mean'] for result in results]
+    stds = [result['std'] for result in results]
+    m, e = compute_mean_and_error_arrays(counts, means, stds, confidence_level)
+    return m.tolist(), e.tolist()
+
 def set_plot_options(grid='y'):
     options = {
         'backend': 'PDF',
@@ -64,9 +79,76 @@ def set_plot_options(grid='y'):
     for option_key in options:
         matplotlib.rcParams[option_key] = options[option_key]
 
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 100
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 100
     if 'legend.ncol' in matplotlib.rcParams:
         matplotlib.rcParams['legend.ncol'] = 100
+
+# the reusable figure of each layout, see render_figure
+figure_templates = {}
+
+@contextmanager
+def render_figure(filename, **kwargs):
+    # draws the figure in the block into a cleared figure of the layout, i.e.,
+    # of the pyplot.figure() arguments and the figure.* options, which are only
+    # applied when a figure is created; when the block exits, the figure is
+    # saved to the file and cleared, so that a script that renders hundreds of
+    # figures only keeps one figure per layout in memory
+    import matplotlib.pyplot as pyplot
+
+    key = (tuple(sorted(kwargs.items())),
+        tuple((k, repr(v)) for k, v in sorted(matplotlib.rcParams.items()) if k.startswith('figure.')))
+    fig = figure_templates.get(key)
+    if fig == None or not pyplot.fignum_exists(fig.number):
+        fig = pyplot.figure(**kwargs)
+        figure_templates[key] = fig
+    else:
+        pyplot.figure(fig.number)
+
+    try:
+        yield fig
+        fig.savefig(filename)
+    finally:
+        fig.clear()
+
+def close_figures():
+    import matplotlib.pyplot as pyplot
+    for fig in figure_templates.values():
+        pyplot.close(fig)
+    figure_templates.clear()
+
+def get_tex_cache_dir():
+    # matplotlib keeps the latex output of every usetex string in this
+    # directory, under a hash of the latex source of the string, which includes
+    # the font and size settings, so that it only runs latex once per string;
+    # all of the plot processes share it
+    return os.path.join(matplotlib.get_cachedir(), 'tex.cache')
+
+@contextmanager
+def keep_tex_cache(dirpath):
+    # copies the latex renderings kept in dirpath into matplotlib's cache, and
+    # the ones that were added while plotting back into dirpath, so that they
+    # are kept next to the figures across runs and clean ups of the user cache
+    cache_dir = get_tex_cache_dir()
+    copy_missing_files(dirpath, cache_dir, list_files(dirpath))
+    cached = list_files(cache_dir)
+    try:
+        yield
+    finally:
+        copy_missing_files(cache_dir, dirpath, list_files(cache_dir) - cached)
+
+def list_files(dirpath):
+    # the paths of all of the files under dirpath, relative to it
+    return {os.path.relpath(os.path.join(root, name), dirpath)
+        for root, _, names in os.walk(dirpath) for name in names}
+
+def copy_missing_files(src_dir, dst_dir, relpaths):
+    for relpath in sorted(relpaths):
+        dst = os.path.join(dst_dir, relpath)
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(os.path.join(src_dir, relpath), dst)
+
+def report_peak_rss(name):
+    # ru_maxrss is in KiB on Linux; the children are the plot worker processes
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    print(f"Peak RSS of {name}: {rss_self:.1f} MiB, of its largest child process: {rss_children:.1f} MiB")
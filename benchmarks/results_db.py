@@ -0,0 +1,154 @@
+import json
+import sqlite3
+
+# An sqlite database of collected or combined results, as an alternative to the
+# flat json files. Each experiment is a row of the experiments table, with the
+# config fields that the plot and stats scripts select on as indexed columns,
+# and the numeric leaves of its results are rows of the normalized metrics
+# table, e.g., ('perf_duration-time-sec', 'mean', 52.1) for a combined macro
+# experiment or ('bmark', 'p50', 485.1) for a micro experiment. Experiments are
+# grouped by source, e.g., the 'phase1-3' trial or the combined 'phase1', and
+# are upserted, so that the database builds up as new trials are collected.
+
+RESULTS_DB_FILENAME = 'results.db'
+
+# the column name, the path of the field in an experiment, and the column type
+CONFIG_COLUMNS = [
+    ('interpose_method', ['interpose_method'], 'TEXT'),
+    ('num_workers', ['num_workers'], 'INTEGER'),
+    ('scheduling_policy', ['scheduling_policy'], 'TEXT'),
+    ('use_logging', ['use_logging'], 'INTEGER'),
+    ('use_memory_manager', ['use_memory_manager'], 'INTEGER'),
+    ('use_pinning', ['use_pinning'], 'INTEGER'),
+    ('use_realtime', ['use_realtime'], 'INTEGER'),
+    ('use_shim_syscall_handler', ['use_shim_syscall_handler'], 'INTEGER'),
+    ('use_single_core', ['use_single_core'], 'INTEGER'),
+    ('use_syscall_counters', ['use_syscall_counters'], 'INTEGER'),
+    ('use_syscall_preloading', ['use_syscall_preloading'], 'INTEGER'),
+    ('quantity', ['exe', 'quantity'], 'INTEGER'),
+    ('msgload', ['exe', 'msgload'], 'INTEGER'),
+    ('weights', ['exe', 'weights'], 'TEXT'),
+    ('nbytes', ['exe', 'nbytes'], 'INTEGER'),
+    ('mode', ['exe', 'mode'], 'TEXT'),
+    ('is_blocking', ['exe', 'is_blocking'], 'INTEGER'),
+    ('is_phantom', ['exe', 'is_phantom'], 'INTEGER'),
+]
+
+CONFIG_COLUMN_NAMES = [name for name, _, _ in CONFIG_COLUMNS]
+
+def open_results_db(filepath):
+    db = sqlite3.connect(filepath)
+    db.execute('PRAGMA foreign_keys = ON')
+    create_schema(db)
+    return db
+
+def create_schema(db):
+    columns = ''.join(f'{name} {sqltype},\n' for name, _, sqltype in CONFIG_COLUMNS)
+    db.executescript(f'''
+        CREATE TABLE IF NOT EXISTS experiments (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            config_key TEXT NOT NULL,
+            {columns}
+            results TEXT NOT NULL,
+            UNIQUE (source, config_key)
+        );
+        CREATE TABLE IF NOT EXISTS metrics (
+            experiment_id INTEGER NOT NULL REFERENCES experiments (id) ON DELETE CASCADE,
+            metric TEXT NOT NULL,
+            stat TEXT NOT NULL,
+            value,
+            PRIMARY KEY (experiment_id, metric, stat)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS metrics_by_name ON metrics (metric, stat);
+    ''')
+    for name in CONFIG_COLUMN_NAMES:
+        db.execute(f'CREATE INDEX IF NOT EXISTS experiments_by_{name} ON experiments ({name})')
+    db.commit()
+
+def get_config_key(record):
+    # the canonical form of all of the config fields of an experiment
+    return json.dumps({k: v for k, v in record.items() if k != '~results'}, sort_keys=True)
+
+def get_config_value(record, path):
+    for key in path:
+        if not isinstance(record, dict) or key not in record:
+            return None
+        record = record[key]
+    return record
+
+def flatten_results(results, prefix=None):
+    # yields the (metric, stat, value) of every numeric leaf of the results,
+    # where the stat is the last key of the leaf and the metric is the path to it
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten_results(value, key if prefix == None else f'{prefix}.{key}')
+        elif isinstance(value, (int, float)):
+            if prefix == None:
+                yield key, 'value', value
+            else:
+                yield prefix, key, value
+
+def store_records(db, source, records):
+    # upserts the records into the database while passing them through, so
+    # that it can wrap the stream of records that is written to the json file
+    insert_sql = f'''
+        INSERT INTO experiments (source, config_key, {', '.join(CONFIG_COLUMN_NAMES)}, results)
+        VALUES (?, ?, {', '.join('?' for _ in CONFIG_COLUMNS)}, ?)
+        ON CONFLICT (source, config_key) DO UPDATE SET results = excluded.results
+    '''
+    with db:
+        for record in records:
+            config_key = get_config_key(record)
+            config_values = [get_config_value(record, path) for _, path, _ in CONFIG_COLUMNS]
+            db.execute(insert_sql, [source, config_key] + config_values + [json.dumps(record['~results'], sort_keys=True)])
+            experiment_id = db.execute('SELECT id FROM experiments WHERE source = ? AND config_key = ?',
+                (source, config_key)).fetchone()[0]
+
+            db.execute('DELETE FROM metrics WHERE experiment_id = ?', (experiment_id,))
+            db.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)',
+                ((experiment_id, metric, stat, value) for metric, stat, value in flatten_results(record['~results'])))
+            yield record
+
+def write_records(db, source, records):
+    count = 0
+    for _ in store_records(db, source, records):
+        count += 1
+    return count
+
+def get_where_clause(source, config):
+    # 'IS' also matches the NULLs of the fields that do not apply to a config,
+    # e.g., use_memory_manager=None for classic
+    clauses, params = [], []
+    if source != None:
+        clauses.append('e.source = ?')
+        params.append(source)
+    for name, value in config.items():
+        if name not in CONFIG_COLUMN_NAMES:
+            raise ValueError(f"'{name}' is not an indexed config field, use one of {', '.join(CONFIG_COLUMN_NAMES)}")
+        clauses.append(f'e.{name} IS ?')
+        params.append(value)
+    return ' AND '.join(clauses) if len(clauses) > 0 else '1', params
+
+def select_records(db, source=None, **config):
+    # returns the experiments that match the config fields, in the same form
+    # as the records of the json results files
+    where, params = get_where_clause(source, config)
+    records = []
+    for config_key, results in db.execute(f'SELECT e.config_key, e.results FROM experiments e WHERE {where} ORDER BY e.id', params):
+        record = json.loads(config_key)
+        record['~results'] = json.loads(results)
+        records.append(record)
+    return records
+
+def select_metric(db, metric, stat='mean', source=None, **config):
+    # returns the (config_key, value) of the given metric stat of each
+    # experiment that matches the config fields
+    where, params = get_where_clause(source, config)
+    return db.execute(f'''
+        SELECT e.config_key, m.value FROM experiments e JOIN metrics m ON m.experiment_id = e.id
+        WHERE m.metric = ? AND m.stat = ? AND {where} ORDER BY e.id
+    ''', [metric, stat] + params).fetchall()
+
+def get_sources(db):
+    return [row[0] for row in db.execute('SELECT DISTINCT source FROM experiments ORDER BY source')]
@@ -0,0 +1,184 @@
+from math import sqrt
+from functools import lru_cache
+
+import numpy
+
+# scipy is imported by the functions that need it, since importing scipy.stats
+# takes longer than most uses of this module, e.g., by the collectors, which
+# only compute summary stats
+
+PERCENTILES = list(range(5, 100, 5))
+
+BOOTSTRAP_METHODS = ['percentile', 'bca']
+BOOTSTRAP_RESAMPLES = 10000
+BOOTSTRAP_SEED = 1
+
+def get_stats(values, with_sum=True, percentiles=PERCENTILES):
+    # computes all of the summary stats from a single sorted copy of the values,
+    # instead of letting every numpy function sort or partition them again;
+    # the results are identical to calling the numpy functions one by one
+    a = numpy.asarray(values)
+    s = numpy.sort(a)
+    n = len(s)
+
+    stats = {
+        'count': n,
+        'min': s[0].item(),
+        'max': s[-1].item(),
+        # the mean and variance are computed in the original order, so that
+        # the floating point sums are the same as with numpy.mean and numpy.var
+        'mean': a.mean().item(),
+        'median': get_sorted_median(s),
+        'var': a.var().item(),
+    }
+    stats['std'] = sqrt(stats['var'])
+
+    # python's sum is exact for integers, and sums floats in the original order
+    if with_sum:
+        stats['sum'] = sum(values)
+
+    if len(percentiles) > 0:
+        for p, v in zip(percentiles, numpy.percentile(s, percentiles).tolist()):
+            stats[f'p{p}'] = v
+
+    return stats
+
+def get_sorted_median(s):
+    # same as numpy.median, which averages the middle values if n is even
+    n = len(s)
+    if n % 2 == 1:
+        return float(s[n // 2])
+    return s[n//2-1:n//2+1].mean().item()
+
+# The scipy t.ppf distributed is for one-sided hypothesis tests.
+# If we want to compute a two-sided error, then we must convert a two-sided
+# confidence level to an equivalent one-side confidence level for scipy.
+def two_to_one_sided_confidence_level(two_sided_level):
+    return two_sided_level / 2.0 + 0.5
+
+@lru_cache(maxsize=None)
+def get_t_quantile(confidence_level, deg_freedom):
+    # the plots ask for the same few (level, dof) pairs over and over, and each
+    # t.ppf call costs much more than the rest of the CI computation
+    from scipy.stats import t as studentst
+    return float(studentst.ppf(two_to_one_sided_confidence_level(confidence_level), deg_freedom))
+
+def get_t_quantiles(confidence_level, deg_freedoms):
+    # vectorized get_t_quantile, which only looks up each distinct dof once
+    deg_freedoms = numpy.asarray(deg_freedoms)
+    unique, inverse = numpy.unique(deg_freedoms, return_inverse=True)
+    quantiles = numpy.array([get_t_quantile(confidence_level, int(d)) for d in unique.tolist()])
+    return quantiles[inverse.reshape(deg_freedoms.shape)]
+
+def compute_mean_and_error_arrays(counts, means, stds, confidence_level=0.99, sem_ddof=0):
+    # returns the means and the symmetric CI errors t * s / sqrt(n - sem_ddof)
+    # for a whole array of configurations at once
+    counts = numpy.asarray(counts)
+    t = get_t_quantiles(confidence_level, counts - 1)
+    errors = t * numpy.asarray(stds, dtype=numpy.float64) / numpy.sqrt(counts - sem_ddof)
+    return numpy.asarray(means, dtype=numpy.float64), errors
+
+def compute_diff_mean_and_error_arrays(counts1, means1, vars1, counts2, means2, vars2, confidence_level=0.99):
+    # returns the difference between two means and its (Welch) CI error, for a
+    # whole array of configurations at once
+    counts1, counts2 = numpy.asarray(counts1), numpy.asarray(counts2)
+    means = numpy.asarray(means1, dtype=numpy.float64) - numpy.asarray(means2, dtype=numpy.float64)
+    s = numpy.sqrt(numpy.asarray(vars1) / counts1 + numpy.asarray(vars2) / counts2)
+    t = get_t_quantiles(confidence_level, numpy.minimum(counts1, counts2) - 1)
+    return means, t * s
+
+# Bootstrap CIs of the mean, for the small and often skewed samples of trial
+# values where the t interval is a poor fit. The values are a 2D array with one
+# row per configuration, padded with nan where a configuration has fewer values
+# than the longest row. All rows with the same number of values are resampled
+# together: a resample of n values is a vector of n multinomial counts, so the
+# means of all resamples of all rows are a single matrix product.
+
+def get_bootstrap_counts(n, num_resamples, seed):
+    # the same counts for every call with the same n, so that the CIs (and the
+    # plots) do not change from one run to the next
+    rng = numpy.random.default_rng([seed, n])
+    return rng.multinomial(n, numpy.full(n, 1.0/n), size=num_resamples).astype(numpy.float64)
+
+def compute_bootstrap_ci_arrays(values, confidence_level=0.99, method='bca',
+        num_resamples=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED):
+    # returns the means and the lower and upper CI bounds of each row
+    assert method in BOOTSTRAP_METHODS, f"unknown bootstrap method '{method}', use one of {', '.join(BOOTSTRAP_METHODS)}"
+    values = numpy.asarray(values, dtype=numpy.float64)
+    shape = values.shape[:-1]
+    values = values.reshape(-1, values.shape[-1])
+
+    counts = (~numpy.isnan(values)).sum(axis=-1)
+    means = numpy.full(len(values), numpy.nan)
+    lower = numpy.full(len(values), numpy.nan)
+    upper = numpy.full(len(values), numpy.nan)
+
+    for n in numpy.unique(counts).tolist():
+        if n == 0:
+            continue
+        rows = numpy.flatnonzero(counts == n)
+        # move the values of each row to the front, the padding to the back
+        x = numpy.sort(values[rows], axis=-1)[:, :n]
+        m, lo, hi = compute_bootstrap_ci_rows(x, confidence_level, method, num_resamples, seed)
+        means[rows], lower[rows], upper[rows] = m, lo, hi
+
+    return means.reshape(shape), lower.reshape(shape), upper.reshape(shape)
+
+def compute_bootstrap_ci_rows(x, confidence_level, method, num_resamples, seed):
+    # the CIs of the rows of x, which all have n values
+    n = x.shape[1]
+    means = x.mean(axis=-1)
+
+    # a single value has no spread to resample
+    if n == 1:
+        return means, means.copy(), means.copy()
+    boot = numpy.sort(x @ (get_bootstrap_counts(n, num_resamples, seed).T / n), axis=-1)
+
+    alpha = (1.0 - confidence_level) / 2.0
+    q = numpy.tile([alpha, 1.0 - alpha], (len(x), 1))
+
+    if method == 'bca':
+        from scipy.special import ndtr, ndtri
+        # the bias correction from the fraction of resampled means below the
+        # mean, and the acceleration from the skew of the jackknife means
+        z0 = ndtri((boot < means[:, None]).mean(axis=-1))
+        jack = (x.sum(axis=-1, keepdims=True) - x) / (n - 1)
+        d = jack.mean(axis=-1, keepdims=True) - jack
+        num = (d**3).sum(axis=-1)
+        den = 6.0 * (d**2).sum(axis=-1)**1.5
+        a = numpy.divide(num, den, out=numpy.zeros_like(num), where=den > 0)
+
+        z = ndtri(q)
+        with numpy.errstate(invalid='ignore'):
+            zz = z0[:, None] + z
+            adjusted = ndtr(z0[:, None] + zz / (1.0 - a[:, None] * zz))
+        # z0 is infinite if no (or every) resampled mean is below the mean,
+        # e.g., if all of the values are equal; fall back to the percentiles
+        q = numpy.where(numpy.isfinite(z0)[:, None], adjusted, q)
+
+    lo, hi = get_sorted_row_percentiles(boot, q).T
+    return means, lo, hi
+
+def get_sorted_row_percentiles(s, q):
+    # same as numpy.quantile(s[i], q[i]) for each row i of the sorted s, with
+    # its default linear interpolation, where every row has its own quantiles
+    pos = q * (s.shape[1] - 1)
+    i = numpy.clip(numpy.floor(pos).astype(numpy.int64), 0, s.shape[1] - 2)
+    frac = pos - i
+    below = numpy.take_along_axis(s, i, axis=-1)
+    above = numpy.take_along_axis(s, i + 1, axis=-1)
+    return below + (above - below) * frac
+
+def compute_bootstrap_error_arrays(values, confidence_level=0.99, method='bca', **kwargs):
+    # returns the means and the (lower, upper) errors below and above the
+    # means, in the form of a matplotlib yerr
+    means, lower, upper = compute_bootstrap_ci_arrays(values, confidence_level, method, **kwargs)
+    return means, numpy.stack([means - lower, upper - means])
+
+def pad_values(value_lists):
+    # the lists of values of several configurations as a nan-padded 2D array
+    width = max((len(v) for v in value_lists), default=0)
+    a = numpy.full((len(value_lists), width), numpy.nan)
+    for i, v in enumerate(value_lists):
+        a[i, :len(v)] = v
+    return a
@@ -0,0 +1,221 @@
+import sys
+from math import sqrt
+
+import numpy
+from scipy.stats import kstwo
+
+from plot_common import render_figure, report_peak_rss
+from pack import load_tor_data, get_run_indices
+from plot import SCALES, TRIALS, set_plot_options
+
+import matplotlib
+matplotlib.use('Agg') # for systems without X11
+import matplotlib.pyplot as pyplot
+
+# Compares the distributions of the tor client performance metrics of the
+# phantom runs to those of the classic runs, to check that phantom simulates the
+# same network behavior at each scale. The values of the 10 trials of a scale
+# and mode are pooled into one sample (whose sorted values are its ECDF), and
+# the pooled samples are compared with the two-sample Kolmogorov-Smirnov and
+# Anderson-Darling tests.
+#
+# With tens of thousands of values per sample, the tests detect differences
+# that are far smaller than the differences between the trials of the same
+# simulator. So each scale is also compared within classic, between its first
+# and its last 5 trials, as a baseline for the statistics of phantom vs classic.
+#
+# All of the samples of a metric are sorted together in a single array, with the
+# comparison and side of each value, so the statistics of all comparisons are
+# computed at once instead of with one scipy call per comparison.
+
+# the packed columns of the distributions, and their labels
+DISTRIBUTIONS = [
+    ['perfclient_circuit_build_time', "Circuit Build Time"],
+    ['perfclient_goodput', "Client Goodput"],
+    ['round_trip_time', "Round Trip Time"],
+]
+# the time to first/last byte by transfer size (in bytes), and over all sizes
+TRANSFER_SIZES = ['51200', '1048576', '5242880', 'ALL']
+for size in TRANSFER_SIZES:
+    DISTRIBUTIONS.append([f'time_to_first_byte_recv.{size}', f"Time to First Byte ({size})"])
+for size in TRANSFER_SIZES:
+    DISTRIBUTIONS.append([f'time_to_last_byte_recv.{size}', f"Time to Last Byte ({size})"])
+
+# the [name, first mode, first trials, second mode, second trials] comparisons
+# that are made at each scale
+COMPARISONS = [
+    ['phantom', 'classic', TRIALS, 'phantom-preload', TRIALS],
+    ['baseline', 'classic', TRIALS[:5], 'classic', TRIALS[5:]],
+]
+
+SIGNIFICANCE_LEVEL = 0.05
+
+def main():
+    set_plot_options()
+    tordata = load_tor_data()
+
+    for key, label in DISTRIBUTIONS:
+        results = compare_distribution(tordata, key)
+        print_comparisons(key, results)
+        plot_comparisons(f"tor_ks_{key.replace('.', '_')}.pdf", results, label)
+
+    report_peak_rss('compare_distributions.py')
+
+def compare_distribution(tordata, key):
+    # the test results of each comparison at each scale, as arrays with a
+    # (scale, comparison) shape
+    run_groups = []
+    for scale in SCALES:
+        for _, mode_a, trials_a, mode_b, trials_b in COMPARISONS:
+            run_groups.append(get_run_indices(tordata, [scale], trials_a, [mode_a]).flatten())
+            run_groups.append(get_run_indices(tordata, [scale], trials_b, [mode_b]).flatten())
+
+    # the groups 2*i and 2*i+1 are the two sides of comparison i
+    values, groups = gather_samples(tordata, key, run_groups)
+    results = compute_two_sample_tests(values, groups // 2, groups % 2, len(run_groups) // 2)
+    return {name: a.reshape(len(SCALES), len(COMPARISONS)) for name, a in results.items()}
+
+def gather_samples(tordata, key, run_groups):
+    # the pooled values of the runs of each group, and the group of each value
+    runs = numpy.concatenate(run_groups)
+    run_group = numpy.repeat(numpy.arange(len(run_groups)), [len(g) for g in run_groups])
+
+    offsets = tordata[f'{key}#offsets']
+    starts, lengths = offsets[runs], offsets[runs+1] - offsets[runs]
+    # the index of each value in the packed column, i.e., the start of its run
+    # plus its position in the run
+    index = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths) + numpy.arange(lengths.sum())
+    return tordata[key][index], numpy.repeat(run_group, lengths)
+
+def compute_two_sample_tests(values, pairs, sides, num_pairs):
+    # sorts the values of both sides of each comparison (pair) together, so
+    # that the ECDFs of both sides can be evaluated at every value
+    order = numpy.lexsort((values, pairs))
+    values, pairs, sides = values[order], pairs[order], sides[order]
+
+    counts = numpy.bincount(pairs * 2 + sides, minlength=2*num_pairs).reshape(num_pairs, 2)
+    n = counts.sum(axis=1)
+    pair_starts = numpy.concatenate([[0], numpy.cumsum(n)[:-1]])
+
+    # the number of values of each side before each position, within pair p
+    before = [numpy.concatenate([[0], numpy.cumsum(sides == side)]) for side in [0, 1]]
+    def count_before(side, positions, p):
+        return before[side][positions] - before[side][pair_starts[p]]
+
+    # the runs of equal values of each pair
+    first = numpy.ones(len(values), dtype=bool)
+    first[1:] = (pairs[1:] != pairs[:-1]) | (values[1:] != values[:-1])
+    run_starts = numpy.flatnonzero(first)
+    run_ends = numpy.concatenate([run_starts[1:], [len(values)]])
+
+    p = pairs[run_starts]
+    ks_stat = compute_ks_statistics(count_before, counts, run_starts, run_ends, p)
+    ad_stat = compute_ad_statistics(count_before, counts, pair_starts, run_starts, run_ends, p)
+
+    # same as scipy.stats.ks_2samp(method='asymp')
+    en = numpy.round(counts[:, 0] * counts[:, 1] / n)
+    return {
+        'n_a': counts[:, 0],
+        'n_b': counts[:, 1],
+        'ks_stat': ks_stat,
+        'ks_pvalue': numpy.clip(kstwo.sf(ks_stat, en), 0.0, 1.0),
+        'ad_stat': ad_stat,
+        'ad_pvalue': get_ad_pvalues(ad_stat),
+    }
+
+def compute_ks_statistics(count_before, counts, run_starts, run_ends, p):
+    # the largest difference between the ECDFs of both sides, which are only
+    # evaluated after each run of equal values (of pair p)
+    diff = count_before(0, run_ends, p) / counts[p, 0] - count_before(1, run_ends, p) / counts[p, 1]
+    stat = numpy.zeros(len(counts))
+    numpy.maximum.at(stat, p, numpy.abs(diff))
+    return stat
+
+def compute_ad_statistics(count_before, counts, pair_starts, run_starts, run_ends, p):
+    # the standardized k-sample Anderson-Darling statistics for k=2, with the
+    # midrank ECDFs for ties, same as scipy.stats.anderson_ksamp
+    N = counts.sum(axis=1).astype(numpy.float64)
+    Np = N[p]
+
+    l = (run_ends - run_starts).astype(numpy.float64)
+    B = (run_starts - pair_starts[p]) + l / 2.0
+
+    A2 = numpy.zeros(len(counts))
+    for side in [0, 1]:
+        ties = count_before(side, run_ends, p) - count_before(side, run_starts, p)
+        M = count_before(side, run_starts, p) + ties / 2.0
+        n_i = counts[p, side]
+        inner = l / Np * (Np*M - B*n_i)**2 / (B*(Np - B) - Np*l/4.0)
+        A2 += numpy.bincount(p, weights=inner / n_i, minlength=len(counts))
+    A2 *= (N - 1.0) / N
+
+    # the mean of the statistic is k-1, and its variance depends only on the
+    # sizes of the samples
+    k = 2
+    H = (1.0 / counts).sum(axis=1)
+    h, g = numpy.array([get_ad_harmonic_sums(int(n)) for n in N]).T
+    a = (4*g - 6) * (k - 1) + (10 - 6*g)*H
+    b = (2*g - 4)*k**2 + 8*h*k + (2*g - 14*h - 4)*H - 8*h + 4*g - 6
+    c = (6*h + 2*g - 2)*k**2 + (4*h - 4*g + 6)*k + (2*h - 6)*H + 4*h
+    d = (2*h + 6)*k**2 - 4*h*k
+    sigmasq = (a*N**3 + b*N**2 + c*N + d) / ((N - 1.0) * (N - 2.0) * (N - 3.0))
+    return (A2 - (k - 1)) / numpy.sqrt(sigmasq)
+
+def get_ad_harmonic_sums(N):
+    # the h and g sums of the variance of the statistic (Scholz and Stephens,
+    # 1987), which only depend on the number of values N
+    hs_cs = (1.0 / numpy.arange(N - 1, 1, -1)).cumsum()
+    h = hs_cs[-1] + 1
+    g = (hs_cs / numpy.arange(2, N)).sum()
+    return h, g
+
+def get_ad_pvalues(ad_stat):
+    # interpolated from the critical values of the statistic for k=2, and
+    # capped to the range of the table, same as scipy.stats.anderson_ksamp
+    m = 1
+    b0 = numpy.array([0.675, 1.281, 1.645, 1.96, 2.326, 2.573, 3.085])
+    b1 = numpy.array([-0.245, 0.25, 0.678, 1.149, 1.822, 2.364, 3.615])
+    b2 = numpy.array([-0.105, -0.305, -0.362, -0.391, -0.396, -0.345, -0.154])
+    critical = b0 + b1 / sqrt(m) + b2 / m
+    sig = numpy.array([0.25, 0.1, 0.05, 0.025, 0.01, 0.005, 0.001])
+    pf = numpy.polyfit(critical, numpy.log(sig), 2)
+    pvalue = numpy.exp(numpy.polyval(pf, ad_stat))
+    pvalue[ad_stat < critical.min()] = sig.max()
+    pvalue[ad_stat > critical.max()] = sig.min()
+    return pvalue
+
+def print_comparisons(key, results):
+    print(key)
+    for s, scale in enumerate(SCALES):
+        for c, [name, mode_a, _, mode_b, _] in enumerate(COMPARISONS):
+            r = {stat: results[stat][s, c] for stat in results}
+            differ = r['ks_pvalue'] < SIGNIFICANCE_LEVEL or r['ad_pvalue'] < SIGNIFICANCE_LEVEL
+            print(f"  scale={scale} {name:8s} n={r['n_a']}/{r['n_b']} "
+                f"ks={r['ks_stat']:.4f} (p={r['ks_pvalue']:.3g}) "
+                f"ad={r['ad_stat']:.2f} (p={r['ad_pvalue']:.3g})"
+                + (" differ" if differ else ""))
+
+def plot_comparisons(filename, results, label):
+    # the KS statistic of phantom vs classic at each scale, next to that of the
+    # baseline comparison between the classic trials
+    print(filename)
+    x = [int(float(scale) * 100.0) for scale in SCALES] # convert to percentage
+    styles = {
+        'phantom': dict(fmt='^:', color='C1', zorder=3, label='phantom vs shadow'),
+        'baseline': dict(fmt='s-', color='C4', zorder=2, label='shadow vs shadow'),
+    }
+
+    with render_figure(filename):
+        for c, [name, _, _, _, _] in enumerate(COMPARISONS):
+            pyplot.errorbar(x, results['ks_stat'][:, c], linewidth=2.0, **styles[name])
+
+        pyplot.xticks(x, [str(v) for v in x])
+        pyplot.title(label)
+        pyplot.xlabel(r"Tor Network Model Scale (\%)")
+        pyplot.ylabel("KS Statistic", horizontalalignment='right', y=1.0)
+        pyplot.ylim(ymin=0)
+        pyplot.legend()
+        pyplot.tight_layout(pad=0.3)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import sys
+import os
+import re
+import json
+import argparse
+
+import numpy
+
+# Packs the json outputs of all tor runs in data/shadowtor-<scale>-<trial>-<mode>
+# into a single uncompressed npz file with one column per metric, so the plot and
+# analysis scripts parse the json once instead of once per metric and trial.
+#
+# Scalar metrics are stored as arrays with one value per run. Lists (e.g., the
+# round trip times) and numeric-keyed maps (e.g., the ram used per minute) are
+# concatenated over all runs into '<name>', with the start of the values of run i
+# at '<name>#offsets'[i] and the map keys in '<name>#keys', so the values of a
+# run are a slice (i.e., a view) of the column. The runs are indexed by the
+# 'run#scale', 'run#trial', 'run#mode' and 'run#name' columns.
+
+TOR_PACK_FILENAME = 'tordata.npz'
+
+RUN_DIR_PATTERN = re.compile(r'^shadowtor-([0-9.]+)-([0-9a-z]+)-(.+)$')
+TIME_PATTERN = re.compile(r'^(\d+):(\d+):(\d+(\.\d+)?)$')
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', "--data_directory",
+        help="Path to the directory containing the shadowtor-* run directories",
+        default='data'
+    )
+    parser.add_argument('-o', "--output",
+        help="Path to the packed npz file",
+        default=TOR_PACK_FILENAME
+    )
+    args = parser.parse_args()
+
+    columns = pack_runs(args.data_directory)
+    save_packed(args.output, columns)
+    print(f"Packed {len(columns['run#name'])} runs into {len(columns)} columns in {args.output}")
+
+def find_runs(data_dir):
+    runs = []
+    for name in sorted(os.listdir(data_dir)):
+        m = RUN_DIR_PATTERN.match(name)
+        if m != None and os.path.isdir(os.path.join(data_dir, name)):
+            runs.append((m.group(1), m.group(2), m.group(3), name))
+    return runs
+
+def pack_runs(data_dir):
+    runs = find_runs(data_dir)
+
+    scalars, ragged = {}, {}
+    for i, (_, _, _, name) in enumerate(runs):
+        rundir = os.path.join(data_dir, name)
+        for filename in sorted(os.listdir(rundir)):
+            if not filename.endswith('.json'):
+                continue
+            if os.path.getsize(os.path.join(rundir, filename)) == 0:
+                print(f"Skipping empty file {os.path.join(rundir, filename)}", file=sys.stderr)
+                continue
+            with open(os.path.join(rundir, filename), 'r') as inf:
+                d = json.load(inf)
+            flatten_metric(filename[:-len('.json')], d, i, scalars, ragged)
+
+    columns = {
+        'run#scale': numpy.array([float(run[0]) for run in runs]),
+        'run#trial': numpy.array([run[1] for run in runs]),
+        'run#mode': numpy.array([run[2] for run in runs]),
+        'run#name': numpy.array([run[3] for run in runs]),
+    }
+
+    for key, values in scalars.items():
+        # a metric missing from some runs is nan in those runs
+        if len(values) == len(runs) and all(isinstance(v, int) for v in values.values()):
+            columns[key] = numpy.array([values[i] for i in range(len(runs))], dtype=numpy.int64)
+        else:
+            columns[key] = numpy.array([values.get(i, numpy.nan) for i in range(len(runs))], dtype=numpy.float64)
+
+    for key, values in ragged.items():
+        segments = [values.get(i, ([], [])) for i in range(len(runs))]
+        lengths = [len(segment[1]) for segment in segments]
+        columns[f'{key}#offsets'] = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+        columns[key] = numpy.array([v for segment in segments for v in segment[1]], dtype=numpy.float64)
+        if any(segment[0] != None for segment in segments):
+            columns[f'{key}#keys'] = numpy.array([k for segment in segments for k in (segment[0] or [])], dtype=numpy.float64)
+
+    return columns
+
+def flatten_metric(key, value, i, scalars, ragged):
+    if isinstance(value, dict):
+        if len(value) > 0 and all(is_number(k) and is_scalar(v) for k, v in value.items()):
+            # e.g., the ram used per minute, or the goodput per relay
+            ragged.setdefault(key, {})[i] = ([float(k) for k in value.keys()], list(value.values()))
+        else:
+            for k, v in value.items():
+                flatten_metric(f'{key}.{k}', v, i, scalars, ragged)
+    elif isinstance(value, list):
+        # e.g., the round trip times, or the [x, y] points of the error rates
+        ragged.setdefault(key, {})[i] = (None, value)
+    elif is_scalar(value):
+        scalars.setdefault(key, {})[i] = value
+    elif isinstance(value, str) and TIME_PATTERN.match(value) != None:
+        scalars.setdefault(f'{key}_seconds', {})[i] = parse_time_seconds(value)
+
+def is_scalar(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+def parse_time_seconds(s):
+    # same arithmetic as the plot script used on the json strings
+    parts = s.strip().split(':')
+    h, m, s = int(parts[0]), int(parts[1]), float(parts[2])
+    s += (m*60.0 + h*3600.0)
+    return s
+
+def save_packed(filepath, columns):
+    # uncompressed, so that loading is a plain read of each column
+    tmp_path = f'{filepath}.{os.getpid()}.tmp.npz'
+    numpy.savez(tmp_path, **columns)
+    os.replace(tmp_path, filepath)
+
+def load_packed(filepath):
+    with numpy.load(filepath) as npz:
+        tordata = {name: npz[name] for name in npz.files}
+    tordata['runs'] = {name: i for i, name in enumerate(tordata['run#name'].tolist())}
+    return tordata
+
+def is_packed_stale(filepath, data_dir):
+    if not os.path.exists(filepath):
+        return True
+    mtime = os.path.getmtime(filepath)
+    for _, _, _, name in find_runs(data_dir):
+        rundir = os.path.join(data_dir, name)
+        if os.path.getmtime(rundir) > mtime or \
+                any(os.path.getmtime(os.path.join(rundir, f)) > mtime for f in os.listdir(rundir)):
+            return True
+    return False
+
+def load_tor_data(data_dir='data', filepath=TOR_PACK_FILENAME):
+    # packs the data first if the packed file is missing or older than the data
+    if is_packed_stale(filepath, data_dir):
+        save_packed(filepath, pack_runs(data_dir))
+    return load_packed(filepath)
+
+def get_run_indices(tordata, scales, trials, modes):
+    # the (scale, trial, mode) array of the indices of the runs, with which the
+    # packed columns of all of the runs are selected at once
+    runs = tordata['runs']
+    return numpy.array([[[runs[f'shadowtor-{scale}-{trial}-{mode}'] for mode in modes]
+        for trial in trials] for scale in scales], dtype=numpy.int64)
+
+def get_run_values(tordata, key, run):
+    # the list or map values of a run, as a view into the packed column
+    offsets = tordata[f'{key}#offsets']
+    return tordata[key][offsets[run]:offsets[run+1]]
+
+def get_run_keys(tordata, key, run):
+    offsets = tordata[f'{key}#offsets']
+    return tordata[f'{key}#keys'][offsets[run]:offsets[run+1]]
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,12 @@
 import sys
 import json
-from math import log, exp, sqrt
-from statistics import mean, stdev
+from math import sqrt
 
-from scipy.stats import t as studentst
+import numpy
+
+from stats_common import get_t_quantile
+from plot_common import render_figure, report_peak_rss
+from pack import load_tor_data, get_run_indices
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
@@ -11,196 +14,161 @@ from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as pyplot
 from matplotlib.ticker import MaxNLocator
 
-def main():
-    set_plot_options()
-    plot_all_metrics()
-
-
-def plot_all_metrics():
-    metrics = [
-        [get_run_time, "run_time", "Relative Run Time (\%)", "Absolute Run Time (h)"],
-        [get_ram_used, "ram_used", "Relative RAM Used (\%)", "Absolute RAM Used (GiB)"],
-        [get_packets_per_second, "tput_pps", "Relative Throughput (\%)", "Absolute Throughput (pkt/s)"],
-        [get_microseconds_per_packet, 'lat_ppus', "Relative Latency (\%)", "Absolute Latency ($\mu$s/pkt)"]
-    ]
-
-    for [metric_func, file_tag, rel_ylabel, abs_ylabel] in metrics:
-        x, y_abs, y_rel, y_abs_err, y_rel_err = load_metric_values(metric_func)
-        plot(f'tor_rel_{file_tag}.pdf', x, y_rel, yerr=y_rel_err, ylabel=rel_ylabel)
-        plot(f'tor_abs_{file_tag}.pdf', x, y_abs, yerr=y_abs_err, ylabel=abs_ylabel)
+# the scales of the tor network model, and the runs of each scale
+SCALES = ['0.05', '0.1', '0.15', '0.2', '0.25', '0.3']
+TRIALS = [str(i+1) for i in range(10)]
+MODES = ['classic', 'phantom-preload'] #, 'phantom-ptrace']
 
-def load_metric_values(metric_func):
-    x = []
-    y_abs, y_rel, y_abs_err, y_rel_err = {}, {}, {}, {}
+# the columns of the metric matrix, see get_metric_matrix
+METRICS = [
+    ["run_time", r"Relative Run Time (\%)", "Absolute Run Time (h)"],
+    ["ram_used", r"Relative RAM Used (\%)", "Absolute RAM Used (GiB)"],
+    ["tput_pps", r"Relative Throughput (\%)", "Absolute Throughput (pkt/s)"],
+    ['lat_ppus', r"Relative Latency (\%)", r"Absolute Latency ($\mu$s/pkt)"]
+]
 
-    for netsize in ['0.05', '0.1', '0.15', '0.2', '0.25', '0.3']:
-        percent_size = int(float(netsize) * 100.0) # convert to percentage
-        x.append(percent_size)
-
-        for mode in ['classic', 'phantom-preload']: #, 'phantom-ptrace']:
-            vals_abs, vals_rel = get_trial_values(netsize, mode, metric_func)
-
-            # we use the arithmetic mean of the abs values
-            m, e = compute_arithmetic_mean_and_error(vals_abs)
-            y_abs.setdefault(mode, []).append(m)
-            y_abs_err.setdefault(mode, []).append(e)
-
-            # we use the geometric mean of the rel values (i.e., ratios)
-            m, [e_lo, e_hi] = compute_geometric_mean_and_error(vals_rel)
-            # convert to percentages
-            y_rel.setdefault(mode, []).append(m*100.0)
-            y_rel_err.setdefault(mode, [[], []])
-            y_rel_err[mode][0].append(e_lo*100.0)
-            y_rel_err[mode][1].append(e_hi*100.0)
-
-    return x, y_abs, y_rel, y_abs_err, y_rel_err
+def main():
+    set_plot_options()
+    # all of the json files in data are parsed once, into tordata.npz in the
+    # current directory
+    tordata = load_tor_data()
+    plot_all_metrics(tordata)
+
+    report_peak_rss('plot.py')
+
+def plot_all_metrics(tordata):
+    # the (scale, trial, mode, metric) values of all of the runs
+    values = get_metric_matrix(tordata, get_run_indices(tordata, SCALES, TRIALS, MODES))
+    plot_metrics(values, METRICS)
+
+def plot_metrics(values, metrics):
+    # the metrics are the [file tag, rel ylabel, abs ylabel] of the last axis
+    x = [int(float(scale) * 100.0) for scale in SCALES] # convert to percentage
+    y_abs, y_rel, y_abs_err, y_rel_err = compute_metric_values(values)
+
+    for k, [file_tag, rel_ylabel, abs_ylabel] in enumerate(metrics):
+        plot(f'tor_rel_{file_tag}.pdf', x, get_mode_series(y_rel[..., k]),
+            yerr=get_mode_series(y_rel_err[..., k]), ylabel=rel_ylabel)
+        plot(f'tor_abs_{file_tag}.pdf', x, get_mode_series(y_abs[..., k]),
+            yerr=get_mode_series(y_abs_err[..., k]), ylabel=abs_ylabel)
+
+def compute_metric_values(values):
+    # we use the arithmetic mean of the abs values
+    y_abs, y_abs_err = compute_arithmetic_means_and_errors(values)
+
+    # we use the geometric mean of the rel values (i.e., ratios to the classic
+    # run of the same scale and trial)
+    classic = MODES.index('classic')
+    y_rel, y_rel_err = compute_geometric_means_and_errors(values / values[:, :, [classic], :])
+
+    # convert to percentages
+    return y_abs, y_rel*100.0, y_abs_err, y_rel_err*100.0
+
+def get_mode_series(a):
+    # the series of each mode over the scales, from an array whose last two
+    # axes are the scale and the mode, e.g., the [lower, upper] errors
+    return {mode: a[..., i].tolist() for i, mode in enumerate(MODES)}
 
 def plot(filename, x, y, yerr=None, ylabel='Performance'):
     print(filename)
     print(json.dumps(y))
 
-    fig = pyplot.figure()
-
-    # pyplot.errorbar(x, y['phantom-ptrace'], 
-    #     yerr=yerr['phantom-ptrace'] if yerr != None else None, 
-    #     fmt='o--', 
-    #     capsize=5.0, 
-    #     capthick=1.0,
-    #     linewidth=2.0,
-    #     zorder=3,
-    #     label='ptrace')
-
-    pyplot.errorbar(x, y['phantom-preload'], 
-        yerr=yerr['phantom-preload'] if yerr != None else None, 
-        fmt='^:', 
-        capsize=5.0,
-        capthick=1.0,
-        linewidth=2.0,
-        color='C1',
-        zorder=3,
-        label='phantom')
-
-    pyplot.errorbar(x, y['classic'], 
-        yerr=yerr['classic'] if yerr != None else None, 
-        fmt='s-', 
-        capsize=5.0,
-        capthick=1.0,
-        linewidth=2.0,
-        color='C4',
-        zorder=2,
-        label='shadow')
-
-    legloc = None
-    if 'Absolute Run' in ylabel:
-        #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=5, integer=True))
-        #legloc = 'upper left'
-        pyplot.yticks([5, 10, 15, 20, 25, 30])
-    elif 'Relative Run' in ylabel:
-        #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=5, integer=True))
-        legloc = 'lower right'
-        pyplot.yticks([90, 95, 100, 105, 110])
-    elif 'Relative RAM' in ylabel:
-        #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
-        legloc = 'center left'
-        pyplot.yticks([90, 92, 94, 96, 98, 100])
-
-    pyplot.xticks(x, [str(v) for v in x])
-    pyplot.xlabel("Tor Network Model Scale (\%)")
-    pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
-    #pyplot.legend(loc='lower center', bbox_to_anchor=(0.5, 1.10), ncol=3)
-    #pyplot.legend(loc='upper left' if "Absolute Run Time" in ylabel else 'center')
-    pyplot.legend(loc=legloc)
-    pyplot.tight_layout(pad=0.3)
-
-    pyplot.savefig(filename)
-
-# The scipy t.ppf distributed is for one-sided hypothesis tests.
-# If we want to compute a two-sided error, then we must convert a two-sided
-# confidence level to an equivalent one-side confidence level for scipy.
-def two_to_one_sided_confidence_level(two_sided_level):
-    return two_sided_level / 2.0 + 0.5
-
-def compute_arithmetic_mean_and_error(trial_values, confidence_level=0.95):
-    n = len(trial_values)
-
-    m = mean(trial_values)
-    s = stdev(trial_values)
+    with render_figure(filename) as fig:
+        # pyplot.errorbar(x, y['phantom-ptrace'], 
+        #     yerr=yerr['phantom-ptrace'] if yerr != None else None, 
+        #     fmt='o--', 
+        #     capsize=5.0, 
+        #     capthick=1.0,
+        #     linewidth=2.0,
+        #     zorder=3,
+        #     label='ptrace')
+
+        pyplot.errorbar(x, y['phantom-preload'], 
+            yerr=yerr['phantom-preload'] if yerr != None else None, 
+            fmt='^:', 
+            capsize=5.0,
+            capthick=1.0,
+            linewidth=2.0,
+            color='C1',
+            zorder=3,
+            label='phantom')
+
+        pyplot.errorbar(x, y['classic'], 
+            yerr=yerr['classic'] if yerr != None else None, 
+            fmt='s-', 
+            capsize=5.0,
+            capthick=1.0,
+            linewidth=2.0,
+            color='C4',
+            zorder=2,
+            label='shadow')
+
+        legloc = None
+        if 'Absolute Run' in ylabel:
+            #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=5, integer=True))
+            #legloc = 'upper left'
+            pyplot.yticks([5, 10, 15, 20, 25, 30])
+        elif 'Relative Run' in ylabel:
+            #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=5, integer=True))
+            legloc = 'lower right'
+            pyplot.yticks([90, 95, 100, 105, 110])
+        elif 'Relative RAM' in ylabel:
+            #fig.gca().yaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
+            legloc = 'center left'
+            pyplot.yticks([90, 92, 94, 96, 98, 100])
+
+        pyplot.xticks(x, [str(v) for v in x])
+        pyplot.xlabel(r"Tor Network Model Scale (\%)")
+        pyplot.ylabel(ylabel, horizontalalignment='right', y=1.0)
+        #pyplot.legend(loc='lower center', bbox_to_anchor=(0.5, 1.10), ncol=3)
+        #pyplot.legend(loc='upper left' if "Absolute Run Time" in ylabel else 'center')
+        pyplot.legend(loc=legloc)
+        pyplot.tight_layout(pad=0.3)
+
+def compute_arithmetic_means_and_errors(trial_values, confidence_level=0.95):
+    # the means and errors over the trial axis (1) of the array
+    n = trial_values.shape[1]
+
+    m = trial_values.mean(axis=1)
+    s = trial_values.std(axis=1, ddof=1)
     #sem = s / sqrt(n) # equivalent to scipy.stats.sem(trial_values)
 
-    level = two_to_one_sided_confidence_level(confidence_level)
-    t = studentst.ppf(level, n-1)
+    t = get_t_quantile(confidence_level, n-1)
     e = t * s / sqrt(n-1)
 
     # symmetric error
     return m, e
 
 # https://stats.stackexchange.com/questions/8306/confidence-interval-for-geometric-mean
-def compute_geometric_mean_and_error(trial_values, confidence_level=0.95):
+def compute_geometric_means_and_errors(trial_values, confidence_level=0.95):
     # Convert to arithmetic space, where CI error is additively related to the mean
-    trial_values_log = [log(v) for v in trial_values]
-    m_a, e_a = compute_arithmetic_mean_and_error(trial_values_log)
+    m_a, e_a = compute_arithmetic_means_and_errors(numpy.log(trial_values), confidence_level)
     ci_lo_a, ci_hi_a = m_a - e_a, m_a + e_a
 
     # Convert back to geometric, where CIs are multiplicatively related to the mean
     # Note: m_g is equivalent to scipy.stats.gmean(trial_values)
-    m_g, e_g = exp(m_a), exp(e_a)
+    m_g, e_g = numpy.exp(m_a), numpy.exp(e_a)
     ci_lo_g, ci_hi_g = m_g / e_g, m_g * e_g
 
     # Now converting the arithmetic CIs should match the geometric CIs
-    assert(round(ci_lo_g, 9) == round(exp(ci_lo_a), 9))
-    assert(round(ci_hi_g, 9) == round(exp(ci_hi_a), 9))
-
-    # pyplot wants relative error, i.e., the abs length of the error bars
-    e_lo = m_g - ci_lo_g
-    e_hi = ci_hi_g - m_g
-    return m_g, [e_lo, e_hi]
-
-def get_trial_values(netsize, mode, metric_func):
-    y_abs, y_rel = [], []
-
-    num_trials = 10
-    trial_nums = [str(i+1) for i in range(num_trials)]
-
-    for trial_num in trial_nums:
-        value = metric_func(f'shadowtor-{netsize}-{trial_num}-{mode}')
-        y_abs.append(value)
-        baseline = metric_func(f'shadowtor-{netsize}-{trial_num}-classic')
-        y_rel.append(value / baseline)
+    assert(numpy.allclose(ci_lo_g, numpy.exp(ci_lo_a), rtol=0, atol=1e-9))
+    assert(numpy.allclose(ci_hi_g, numpy.exp(ci_hi_a), rtol=0, atol=1e-9))
 
-    return y_abs, y_rel
+    # pyplot wants relative error, i.e., the abs length of the error bars, as
+    # the [lower, upper] rows of the yerr
+    return m_g, numpy.stack([m_g - ci_lo_g, ci_hi_g - m_g])
 
-def get_ram_used(dirname):
-    with open(f'data/{dirname}/resource_usage.json') as inf:
-        d = json.load(inf)
-    return float(d['ram']['gib_used_max'])
-
-def get_run_time(dirname):
-    with open(f'data/{dirname}/resource_usage.json') as inf:
-        d = json.load(inf)
-    return float(d['run_time']['hours'])
-
-def get_packet_count(dirname):
-    with open(f'data/{dirname}/packet_counts.json') as inf:
-        d = json.load(inf)
-    return float(int(d['total_packets_sent']))
-
-def get_packets_per_second(dirname):
-    p, s = get_packets_seconds(dirname)
-    return p / s
-
-def get_microseconds_per_packet(dirname):
-    p, s = get_packets_seconds(dirname)
+def get_metric_matrix(tordata, runs):
+    # the metrics of the runs, with the columns of METRICS as the last axis
+    s = tordata['packet_counts.real_time_seconds'][runs].astype(numpy.float64)
+    p = tordata['packet_counts.total_packets_sent'][runs].astype(numpy.float64)
     us = s * 1000.0 * 1000.0
-    return us / p
-
-def get_packets_seconds(dirname):
-    with open(f'data/{dirname}/packet_counts.json') as inf:
-        d = json.load(inf)
-    parts = d['real_time'].strip().split(':')
-    h, m, s = int(parts[0]), int(parts[1]), float(parts[2])
-    s += (m*60.0 + h*3600.0)
-    p = float(int(d['total_packets_sent']))
-    return p, s
+    return numpy.stack([
+        tordata['resource_usage.run_time.hours'][runs].astype(numpy.float64),
+        tordata['resource_usage.ram.gib_used_max'][runs].astype(numpy.float64),
+        p / s, # packets per second
+        us / p, # microseconds per packet
+    ], axis=-1)
 
 def set_plot_options():
     options = {
@@ -241,10 +209,6 @@ def set_plot_options():
     for option_key in options:
         matplotlib.rcParams[option_key] = options[option_key]
 
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 50
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 50
     if 'legend.ncol' in matplotlib.rcParams:
         matplotlib.rcParams['legend.ncol'] = 50
 
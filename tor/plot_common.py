@@ -0,0 +1 @@
+../benchmarks/plot_common.py
\ No newline at end of file
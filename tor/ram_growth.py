@@ -0,0 +1,149 @@
+import sys
+
+import numpy
+
+from plot_common import render_figure, report_peak_rss
+from pack import load_tor_data, get_run_indices, get_run_values, get_run_keys
+from plot import SCALES, TRIALS, MODES, set_plot_options, plot_metrics
+
+import matplotlib
+matplotlib.use('Agg') # for systems without X11
+import matplotlib.pyplot as pyplot
+
+# Analyzes how the RAM used by the tor simulations grows over their run time,
+# from the RAM used per (real) minute of each run. The series of all runs are
+# aligned into one nan-padded (scale, trial, mode, minute) array, together with
+# the simulated time at each minute, from which the growth metrics of all runs
+# are computed at once:
+#   ramp: the simulation bootstraps tor (the first 300 simulated seconds) and
+#       the clients ramp up their traffic, until about 1200 simulated seconds
+#   steady: afterwards, the RAM grows linearly until the simulation ends
+#   peak: when the most RAM was used
+# The slopes are least-squares fits over the minutes of each phase, and the
+# minutes after the end of the simulation (its teardown) are in no phase.
+
+RAM_KEY = 'resource_usage.ram.gib_used_per_minute'
+# despite its name, the elapsed real seconds at each simulated second
+CLOCK_KEY = 'resource_usage.run_time.real_seconds_per_sim_second'
+
+RAMP_END_SIM_SECONDS = 1200
+
+# the columns of the growth matrix, see compute_growth_metrics
+GROWTH_METRICS = [
+    ["ram_ramp_slope", r"Relative Ramp Growth (\%)", "Ramp RAM Growth (GiB/min)"],
+    ["ram_steady_slope", r"Relative Steady Growth (\%)", "Steady RAM Growth (GiB/min)"],
+    ["ram_ramp_time", r"Relative Ramp Time (\%)", "Ramp Time (h)"],
+    ["ram_peak_time", r"Relative Peak Time (\%)", "Time to Peak RAM (h)"],
+]
+
+# the band around the median RAM curves, as percentiles over the trials
+BAND_PERCENTILES = [25, 75]
+
+def main():
+    set_plot_options()
+    tordata = load_tor_data()
+
+    gib, sim_seconds = load_ram_series(tordata)
+    plot_metrics(compute_growth_metrics(gib, sim_seconds), GROWTH_METRICS)
+    plot_ram_curves(gib, sim_seconds)
+
+    report_peak_rss('ram_growth.py')
+
+def load_ram_series(tordata):
+    # the (scale, trial, mode, minute) arrays of the RAM used and of the
+    # simulated seconds at each minute, with nan at the minutes without a value
+    # (e.g., after the end of a run)
+    runs = get_run_indices(tordata, SCALES, TRIALS, MODES)
+    offsets = tordata[f'{RAM_KEY}#offsets']
+    cell_runs = runs.flatten()
+    starts, lengths = offsets[cell_runs], offsets[cell_runs+1] - offsets[cell_runs]
+
+    # each value is placed at the minute of its key, so that a missing sample
+    # leaves a gap instead of shifting the later values of its run
+    index = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths) + numpy.arange(lengths.sum())
+    cells = numpy.repeat(numpy.arange(runs.size), lengths)
+    minutes = tordata[f'{RAM_KEY}#keys'][index].astype(numpy.int64)
+    gib = numpy.full((runs.size, minutes.max() + 1), numpy.nan)
+    gib[cells, minutes] = tordata[RAM_KEY][index]
+    gib = gib.reshape(runs.shape + gib.shape[-1:])
+
+    # the simulated time at each minute, which is nan once the simulation ended
+    minutes = numpy.arange(gib.shape[-1])
+    sim_seconds = numpy.full(gib.shape, numpy.nan)
+    for cell in numpy.ndindex(runs.shape):
+        # up to the last minute with a value
+        n = int(get_run_keys(tordata, RAM_KEY, runs[cell]).max()) + 1
+        sim_seconds[cell][:n] = numpy.interp(minutes[:n] * 60.0,
+            get_run_values(tordata, CLOCK_KEY, runs[cell]), get_run_keys(tordata, CLOCK_KEY, runs[cell]),
+            left=0.0, right=numpy.nan)
+
+    return gib, sim_seconds
+
+def compute_growth_metrics(gib, sim_seconds):
+    # the growth metrics of the runs, with the columns of GROWTH_METRICS as the
+    # last axis instead of the minute axis
+    minutes = numpy.arange(gib.shape[-1], dtype=numpy.float64)
+    running = ~numpy.isnan(sim_seconds)
+    ramp = running & (sim_seconds < RAMP_END_SIM_SECONDS)
+    steady = running & (sim_seconds >= RAMP_END_SIM_SECONDS)
+
+    # the peak may also be in the teardown
+    peak_minute = numpy.nanargmax(gib, axis=-1)
+    ramp_minutes = ramp.sum(axis=-1)
+
+    return numpy.stack([
+        compute_masked_slopes(minutes, gib, ramp),
+        compute_masked_slopes(minutes, gib, steady),
+        ramp_minutes / 60.0,
+        peak_minute / 60.0,
+    ], axis=-1)
+
+def compute_masked_slopes(x, y, mask):
+    # the least-squares slopes of y over x along the last axis, only over the
+    # points in the mask, or nan if there are less than 2 points
+    mask = mask & ~numpy.isnan(y)
+    n = mask.sum(axis=-1)
+    fitted = n >= 2
+    n = numpy.maximum(n, 1)[..., None]
+    x = numpy.broadcast_to(x, y.shape)
+    x_mean = numpy.where(mask, x, 0.0).sum(axis=-1, keepdims=True) / n
+    y_mean = numpy.where(mask, y, 0.0).sum(axis=-1, keepdims=True) / n
+    dx = numpy.where(mask, x - x_mean, 0.0)
+    dy = numpy.where(mask, y - y_mean, 0.0)
+    sxx = numpy.where(fitted, (dx * dx).sum(axis=-1), 1.0)
+    return numpy.where(fitted, (dx * dy).sum(axis=-1) / sxx, numpy.nan)
+
+def plot_ram_curves(gib, sim_seconds):
+    # the median RAM curve of each scale and mode over its trials, with a band
+    # between the percentiles, up to the first end of a simulation of the trials
+    all_running = (~numpy.isnan(sim_seconds)).all(axis=1)
+    gib = numpy.where(all_running[:, None], gib, 0.0)
+    lo, median, hi = numpy.percentile(gib, [BAND_PERCENTILES[0], 50, BAND_PERCENTILES[1]], axis=1)
+
+    hours = numpy.arange(gib.shape[-1]) / 60.0
+    styles = {
+        'phantom-preload': dict(linestyle=':', color='C1', zorder=3, label='phantom'),
+        'classic': dict(linestyle='-', color='C4', zorder=2, label='shadow'),
+    }
+
+    for s, scale in enumerate(SCALES):
+        percent_size = int(float(scale) * 100.0) # convert to percentage
+        filename = f'tor_ram_growth_{percent_size}.pdf'
+        print(filename)
+
+        with render_figure(filename):
+            for mode, style in styles.items():
+                m = MODES.index(mode)
+                n = all_running[s, m].sum()
+                pyplot.fill_between(hours[:n], lo[s, m, :n], hi[s, m, :n],
+                    color=style['color'], alpha=0.3, linewidth=0.0, zorder=style['zorder'])
+                pyplot.plot(hours[:n], median[s, m, :n], linewidth=2.0, **style)
+
+            pyplot.title(f"Tor Network Model Scale {scale}")
+            pyplot.xlabel("Real Time (h)")
+            pyplot.ylabel("RAM Used (GiB)", horizontalalignment='right', y=1.0)
+            pyplot.legend(loc='lower right')
+            pyplot.tight_layout(pad=0.3)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+../benchmarks/stats_common.py
\ No newline at end of file